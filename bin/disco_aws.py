@@ -5,6 +5,10 @@ Command line tool for working with EC2 instances.
 from __future__ import print_function
 import sys
 import argparse
+import csv
+import json
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from ConfigParser import NoOptionError
 
@@ -13,10 +17,32 @@ from dateutil import parser as dateutil_parser
 from disco_aws_automation import DiscoAWS, DiscoBake, DiscoSSM, read_config
 from disco_aws_automation.resource_helper import TimeoutError
 from disco_aws_automation.disco_logging import configure_logging
+from disco_aws_automation.api_profiler import profile_api_until_exit
 from disco_aws_automation.disco_aws_util import graceful, EasyExit, read_pipeline_file
+from disco_aws_automation.disco_remote_exec import disable_ssh_multiplexing
 from disco_aws_automation.exceptions import SmokeTestError
 import logging
 
+# listhosts fields in display order
+LISTHOSTS_FIELDS = [
+    "id", "hostclass", "ip", "state", "hostname", "owner", "instance_type", "ami", "smoketest",
+    "ami_age", "uptime", "private_ip", "availability_zone", "productline", "securitygroup"
+]
+# listhosts fields that are instance tags, and the tag names
+LISTHOSTS_TAGS = {
+    "hostclass": "hostclass", "hostname": "hostname", "owner": "owner", "smoketest": "smoketest",
+    "productline": "productline"
+}
+# listhosts fields that are instance attributes under another name
+LISTHOSTS_ATTRIBUTES = {"ami": "image_id", "availability_zone": "placement"}
+LISTHOSTS_TEXT_FORMATS = {
+    "hostclass": u"{0:<30}", "ip": u"{0:<15}", "state": u"{0:<10}", "hostname": u"{0:<1}",
+    "owner": u"{0:<11}", "instance_type": u"{0:<10}", "ami": u"{0:<12}", "smoketest": u"{0:<1}",
+    "ami_age": u"{0:<4}", "uptime": u"{0:<3}", "private_ip": u"{0:<16}", "availability_zone": u"{0:<12}",
+    "productline": u"{0:<15}", "securitygroup": u"{0:15}"
+}
+LISTHOSTS_STATES = ["pending", "running", "shutting-down", "stopping", "stopped"]
+
 
 # R0912 Allow more than 12 branches so we can parse a lot of commands..
 # R0914 Allow more than 15 local variables so we can parse a lot of commands..
@@ -29,6 +55,12 @@ def get_parser():
                         help='Log in debug level.')
     parser.add_argument('--truncate', dest='truncate', action='store_true',
                         help='Truncate extra long fields in output.')
+    parser.add_argument('--profile-api', dest='profile_api', action='store_true',
+                        help='Print a JSON summary of the AWS API calls made to stderr at exit.')
+    parser.add_argument('--profile-api-file', dest='profile_api_file', type=str, default=None,
+                        help='Write a JSON summary of the AWS API calls made to this file at exit.')
+    parser.add_argument('--no-ssh-multiplexing', dest='no_ssh_multiplexing', action='store_true',
+                        help='Open a new ssh connection for every remote command.')
     region_env_group = parser.add_mutually_exclusive_group()
     region_env_group.add_argument('--env', dest='env', type=str, default=None,
                                   help="Environment. Normally, the name of a VPC. " +
@@ -108,6 +140,13 @@ def get_parser():
     parser_listhosts.add_argument('--all', dest='all', action='store_const',
                                   const=True, default=False,
                                   help='Enables all extra info')
+    parser_listhosts.add_argument('--format', dest='format', default='text',
+                                  choices=['text', 'json', 'csv', 'tsv'],
+                                  help='Output format. json prints one object per line, csv and tsv start '
+                                  'with a header line. Only text output is sorted.')
+    parser_listhosts.add_argument('--fields', dest='fields', type=str, default=None,
+                                  help='Comma separated list of the fields to display instead of the ones '
+                                  'chosen by the other options: ' + ', '.join(LISTHOSTS_FIELDS))
 
     parser_terminate = subparsers.add_parser(
         'terminate', help='Terminate instance and discard EBS volume. Note that if the instance is managed '
@@ -134,6 +173,10 @@ def get_parser():
     parser_exec.set_defaults(mode="exec")
     parser_exec.add_argument('--command', dest='command', required=True)
     parser_exec.add_argument('--user', dest='user', required=True)
+    parser_exec.add_argument('--parallel', dest='parallel', type=int, default=1,
+                             help='Number of instances to run the command on at the same time')
+    parser_exec.add_argument('--timeout', dest='timeout', type=int, default=None,
+                             help='Seconds after which the command is killed on an instance')
     parser_exec_group = parser_exec.add_mutually_exclusive_group(required=True)
     parser_exec_group.add_argument('--instance', dest='instances', default=[], action='append', type=str)
     parser_exec_group.add_argument('--hostname', dest='hostnames', default=[], action='append', type=str)
@@ -199,6 +242,9 @@ def get_parser():
     parser_spinup.add_argument('--testing', dest='testing', action='store_const',
                                const=True, default=False,
                                help="Bring up host in testing mode (no fixed IP or special routing)")
+    parser_spinup.add_argument('--max-concurrency', dest='max_concurrency', type=int, default=None,
+                               help="Maximum number of hostclasses of the same sequence to provision "
+                               "at once, overrides the provision_concurrency config setting")
 
     parser_spindown = subparsers.add_parser(
         'spindown', help="Spin down (terminate) a set of hostclasses, as defined in a csv file")
@@ -232,12 +278,9 @@ def instances_from_args(disco_aws, args):
     Return list instances based on following arguments:
     hostclass, instance, amis, hostname
     """
-    instances = (disco_aws.instances(instance_ids=args.instances) if args.instances else [])
-    instances.extend(disco_aws.instances_from_hostclasses(args.hostclasses))
-    instances.extend(disco_aws.instances_from_amis(args.amis))
-    instances.extend([disco_aws.instance_from_hostname(h) for h in args.hostnames])
-    instances.extend(disco_aws.instances_from_asgs(args.asgs))
-    return instances
+    return disco_aws.instances_from_selectors(
+        instance_ids=args.instances, hostclasses=args.hostclasses, amis=args.amis,
+        hostnames=args.hostnames, asgs=args.asgs)
 
 
 def get_preferred_private_ip(instance):
@@ -253,6 +296,90 @@ def get_preferred_private_ip(instance):
         return interfaces[1].private_ip_address
 
 
+def listhosts_fields(args):
+    """Returns the listhosts fields to display, in display order"""
+    if args.fields:
+        fields = [field.strip() for field in args.fields.split(",") if field.strip()]
+        unknown = [field for field in fields if field not in LISTHOSTS_FIELDS]
+        if unknown:
+            raise EasyExit("Unknown listhosts fields: {0}".format(", ".join(unknown)))
+        return fields
+    most = args.all or args.most
+    flags = {
+        "state": args.state or most, "hostname": args.hostname or most, "owner": args.owner or most,
+        "instance_type": args.instance_type or most, "ami": args.ami or most, "smoketest": args.smoke or most,
+        "ami_age": args.ami_age or most, "uptime": args.uptime or most,
+        "private_ip": args.private_ip or args.all, "availability_zone": args.availability_zone or args.all,
+        "productline": args.productline or args.all, "securitygroup": args.securitygroup or args.all
+    }
+    return [field for field in LISTHOSTS_FIELDS if flags.get(field, True)]
+
+
+def listhosts_values(instance, fields, ami_creation_times, now):
+    """Returns the values of the fields of an instance, None for missing tags"""
+    values = []
+    for field in fields:
+        if field in LISTHOSTS_TAGS:
+            value = instance.tags.get(LISTHOSTS_TAGS[field])
+        elif field == "ip":
+            value = instance.ip_address or get_preferred_private_ip(instance)
+        elif field == "private_ip":
+            value = get_preferred_private_ip(instance)
+        elif field == "ami_age":
+            value = DiscoBake.time_diff_in_hours(now, ami_creation_times.get(instance.image_id))
+        elif field == "uptime":
+            launch_time = dateutil_parser.parse(instance.launch_time)
+            now_with_tz = now.replace(tzinfo=launch_time.tzinfo)  # use a timezone-aware `now`
+            value = DiscoBake.time_diff_in_hours(now_with_tz, launch_time)
+        elif field == "securitygroup":
+            value = instance.groups[0].name
+        else:
+            value = getattr(instance, LISTHOSTS_ATTRIBUTES.get(field, field))
+        values.append(value)
+    return values
+
+
+def listhosts_text(fields, values):
+    """Formats the values of the fields of an instance as a line of fixed width columns"""
+    columns = []
+    for field, value in zip(fields, values):
+        if field in ("hostname", "smoketest"):
+            value = "-" if value is None else "y"
+        elif field in LISTHOSTS_TAGS and (value is None or (field == "productline" and value == u"unknown")):
+            value = u"-"
+        columns.append(LISTHOSTS_TEXT_FORMATS.get(field, u"{0}").format(value))
+    return u" ".join(columns)
+
+
+def print_listhosts(instances, fields, output_format, ami_creation_times):
+    """
+    Prints a line per instance, sorted by state, hostclass and hostname for text output. The other
+    formats print the instances in the order given and flush each line, but the instances are
+    all described before this is called.
+    """
+    now = datetime.utcnow()
+    if output_format == "text":
+        instances = sorted(instances, key=lambda i: (i.state, i.tags.get("hostclass", "-"),
+                                                     i.tags.get("hostname", "-")))
+        for instance in instances:
+            print(listhosts_text(fields, listhosts_values(instance, fields, ami_creation_times, now)))
+        return
+
+    writer = None
+    if output_format in ("csv", "tsv"):
+        writer = csv.writer(sys.stdout, delimiter="," if output_format == "csv" else "\t",
+                            lineterminator="\n")
+        writer.writerow(fields)
+    for instance in instances:
+        values = listhosts_values(instance, fields, ami_creation_times, now)
+        if writer:
+            writer.writerow([value.encode("utf-8") if isinstance(value, unicode) else value
+                             for value in values])
+        else:
+            print(json.dumps(OrderedDict(zip(fields, values))))
+        sys.stdout.flush()
+
+
 def parse_ssm_parameters(parameters):
     # Borrow the AWS CLI syntax of splitting the name of the parameter and it's value on '='
     keys_to_values = [parameter.split('=', 1) for parameter in parameters]
@@ -270,6 +397,12 @@ def run():
     args = parser.parse_args()
     configure_logging(args.debug)
 
+    if args.profile_api or args.profile_api_file:
+        profile_api_until_exit(args.profile_api_file)
+
+    if args.no_ssh_multiplexing:
+        disable_ssh_multiplexing()
+
     environment_name = args.env or config.get("disco_aws", "default_environment")
 
     aws = DiscoAWS(config, environment_name=environment_name)
@@ -290,51 +423,22 @@ def run():
         }]
         aws.spinup(hostclass_dicts, testing=args.testing)
     elif args.mode == "listhosts":
-        instances = aws.instances_from_hostclass(args.hostclass) if args.hostclass else aws.instances()
-        instances_filtered = [i for i in instances if i.state != u"terminated"]
-        instances_sorted = sorted(instances_filtered, key=lambda i: (i.state, i.tags.get("hostclass", "-"),
-                                                                     i.tags.get("hostname", "-")))
-        instance_to_private_ip = {i.id: get_preferred_private_ip(i) for i in instances_sorted}
-        most = args.all or args.most
-
-        if args.ami_age or args.uptime or most:
-            bake = DiscoBake(config, aws.connection)
-            ami_dict = bake.list_amis_by_instance(instances)
-            now = datetime.utcnow()
-
-        for instance in instances_sorted:
-            line = u"{0} {1:<30} {2:<15}".format(
-                instance.id, instance.tags.get("hostclass", "-"),
-                instance.ip_address or instance_to_private_ip[instance.id])
-            if args.state or most:
-                line += u" {0:<10}".format(instance.state)
-            if args.hostname or most:
-                line += u" {0:<1}".format("-" if instance.tags.get("hostname") is None else "y")
-            if args.owner or most:
-                line += u" {0:<11}".format(instance.tags.get("owner", u"-"))
-            if args.instance_type or most:
-                line += u" {0:<10}".format(instance.instance_type)
-            if args.ami or most:
-                line += u" {0:<12}".format(instance.image_id)
-            if args.smoke or most:
-                line += u" {0:<1}".format("-" if instance.tags.get("smoketest") is None else "y")
-            if args.ami_age or most:
-                creation_time = bake.get_ami_creation_time(ami_dict.get(instance.id))
-                line += u" {0:<4}".format(DiscoBake.time_diff_in_hours(now, creation_time))
-            if args.uptime or most:
-                launch_time = dateutil_parser.parse(instance.launch_time)
-                now_with_tz = now.replace(tzinfo=launch_time.tzinfo)  # use a timezone-aware `now`
-                line += u" {0:<3}".format(DiscoBake.time_diff_in_hours(now_with_tz, launch_time))
-            if args.private_ip or args.all:
-                line += u" {0:<16}".format(instance_to_private_ip[instance.id])
-            if args.availability_zone or args.all:
-                line += u" {0:<12}".format(instance.placement)
-            if args.productline or args.all:
-                productline = instance.tags.get("productline", u"unknown")
-                line += u" {0:<15}".format(productline if productline != u"unknown" else u"-")
-            if args.securitygroup or args.all:
-                line += u" {0:15}".format(instance.groups[0].name)
-            print(line)
+        fields = listhosts_fields(args)
+        # Leave terminated instances out of the describe call rather than dropping them afterwards
+        filters = {"instance-state-name": LISTHOSTS_STATES}
+        if args.hostclass:
+            filters["tag:hostclass"] = args.hostclass
+        instances = aws.instances(filters=filters)
+
+        ami_creation_times = {}
+        if "ami_age" in fields:
+            # Each distinct AMI is looked up once, and only when its age is displayed
+            bake = DiscoBake(config, aws.connection, describe_cache=aws.describe_cache)
+            image_ids = sorted(set(instance.image_id for instance in instances))
+            amis = bake.get_amis(image_ids, skip_missing=True) if image_ids else []
+            ami_creation_times = bake.get_ami_creation_times(amis)
+
+        print_listhosts(instances, fields, args.format, ami_creation_times)
 
     elif args.mode == "terminate":
         instances = instances_from_args(aws, args)
@@ -346,10 +450,21 @@ def run():
         print("Stopped: {0}".format(",".join([str(inst) for inst in stopped_instances])))
     elif args.mode == "exec":
         instances = instances_from_args(aws, args)
+        output_lock = threading.Lock()
+
+        def _write_output(instance, line):
+            # Lines of different instances are interleaved when running in parallel, so prefix them
+            if args.parallel > 1:
+                line = "{0}: {1}".format(instance.tags.get("hostname") or instance.id, line)
+            with output_lock:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+        results = aws.remotecmd_parallel(instances, [args.command], user=args.user,
+                                         max_concurrency=args.parallel, timeout=args.timeout,
+                                         output_handler=_write_output)
         exit_code = 0
-        for instance in instances:
-            _code, _stdout = aws.remotecmd(instance, [args.command], user=args.user, nothrow=True)
-            sys.stdout.write(_stdout)
+        for _code, _ in results:
             exit_code = _code if _code else exit_code
         sys.exit(exit_code)
     elif args.mode == "exec-ssm":
@@ -387,7 +502,8 @@ def run():
                 instance.add_tag(args.key, args.value)
     elif args.mode == "spinup":
         hostclass_dicts = read_pipeline_file(args.pipeline_definition_file)
-        aws.spinup(hostclass_dicts, stage=args.stage, no_smoke=args.no_smoke, testing=args.testing)
+        aws.spinup(hostclass_dicts, stage=args.stage, no_smoke=args.no_smoke, testing=args.testing,
+                   max_concurrency=args.max_concurrency)
     elif args.mode == "spindown":
         hostclasses = [line["hostclass"] for line in read_pipeline_file(args.pipeline_definition_file)]
         aws.spindown(hostclasses)
@@ -9,6 +9,7 @@ import argparse
 from datetime import datetime
 
 from disco_aws_automation import DiscoBake, HostclassTemplating
+from disco_aws_automation.disco_bake import BAKE_CONCURRENCY
 from disco_aws_automation.disco_aws_util import run_gracefully
 from disco_aws_automation.disco_logging import configure_logging
 
@@ -110,6 +111,28 @@ def get_parser():
                              help="Use instances' local ip address for operations. "
                              "Set this flag when baking from same subnet as where the baking is occuring.")
 
+    parser_bakemany = subparsers.add_parser(
+        'bakemany', help="Create the amis of several hostclasses at once",
+        description="Bakes the hostclasses concurrently, the phase 2 ones from the same phase 1 AMI, and "
+        "prints a line with the outcome of each bake.")
+    parser_bakemany.set_defaults(mode="bakemany")
+    parser_bakemany.add_argument('--hostclasses', type=str, nargs='+', required=True)
+    parser_bakemany.add_argument('--parallel', dest='parallel', type=int, default=BAKE_CONCURRENCY,
+                                 help='Number of hostclasses to bake at the same time')
+    parser_bakemany.add_argument('--log-dir', dest='log_dir', type=str, default=None,
+                                 help='Also write the log of each bake to LOG_DIR/<hostclass>.log')
+    parser_bakemany.add_argument('--no-destroy', dest='no_destroy', action='store_const', const=True,
+                                 default=False,
+                                 help='Keep each bake instance for debugging instead of creating an AMI '
+                                 'from it and terminating it')
+    parser_bakemany.add_argument("--stage", dest="stage", default=None,
+                                 help="Which stage to tag baked amis with", type=str)
+    parser_bakemany.add_argument('--source-ami', type=str, default=None,
+                                 help='The ami to be used as a base for baking')
+    parser_bakemany.add_argument('--use-local-ip', dest='use_local_ip', action='store_const',
+                                 const=True, default=False,
+                                 help="Use instances' local ip address for operations.")
+
     parser_create = subparsers.add_parser(
         'create', help="Create a hostclass",
         description="Creates the necessary bits for a generic hostclass")
@@ -132,6 +155,18 @@ def run():
     if args.mode == "bake":
         bakery = DiscoBake(use_local_ip=args.use_local_ip)
         bakery.bake_ami(args.hostclass, args.no_destroy, args.source_ami, args.stage)
+    elif args.mode == "bakemany":
+        bakery = DiscoBake(use_local_ip=args.use_local_ip)
+        results = bakery.bake_amis(args.hostclasses, args.no_destroy, args.source_ami, args.stage,
+                                   max_concurrency=args.parallel, log_dir=args.log_dir)
+        for result in results:
+            if result["error"]:
+                outcome = "failed: {0}".format(result["error"])
+            else:
+                outcome = "done" if result["ami"] else "not baked"
+            print("{0:40} {1:21} {2}".format(result["hostclass"], result["ami"] or "-", outcome))
+        if any(result["error"] for result in results):
+            sys.exit(1)
     elif args.mode == "create":
         HostclassTemplating.create_hostclass(args.hostclass)
     elif args.mode == "promote":
@@ -5,9 +5,10 @@ Deploys newly baked hostclasses
 Usage:
     disco_deploy.py [options] test --pipeline PIPELINE
                     [--environment ENV] [--ami AMI | --hostclass HOSTCLASS] [--allow-any-hostclass]
-                    [--strategy STRATEGY]
+                    [--strategy STRATEGY] [--parallel N]
     disco_deploy.py [options] update --pipeline PIPELINE --environment ENV
                     [--ami AMI | --hostclass HOSTCLASS] [--allow-any-hostclass] [--strategy STRATEGY]
+                    [--parallel N]
     disco_deploy.py [options] list (--tested|--untested|--failed|--failures|--testable)
                     [--pipeline PIPELINE] [--environment ENV] [--ami AMI | --hostclass HOSTCLASS]
                     [--allow-any-hostclass]
@@ -27,6 +28,11 @@ Options:
      -h --help              Show this screen
      --debug                Log in debug level
      --dry-run              Does not make any modifications
+     --profile-api          Print a JSON summary of the AWS API calls made to stderr at exit
+     --profile-api-file FILE  Write a JSON summary of the AWS API calls made to FILE at exit
+     --timeline FILE        Append a JSON line for every phase of each deployment to FILE
+     --timeline-namespace NAMESPACE  Send the duration of every phase of each deployment to
+                            CloudWatch as a custom metric in NAMESPACE
 
      --pipeline PIPELINE    File name of the pipeline definition
      --ami AMI              Limit command to a specific AMI
@@ -34,6 +40,8 @@ Options:
      --environment ENV      Environment to operate in
      --allow-any-hostclass  Do not limit command to hostclasses defined in pipeline
      --strategy STRATEGY    The deployment strategy to use. Currently supported: 'classic' or 'blue_green'.
+     --parallel N           Test or update every hostclass with a new AMI instead of a single one, N
+                            hostclasses at a time, and print a line with the outcome of each
 
      --tested               List of latest tested AMI for each hostclass
      --untested             List of latest untested AMI for each hostclass
@@ -55,6 +63,8 @@ from disco_aws_automation import (DiscoAWS, DiscoAutoscale, DiscoBake, DiscoDepl
                                   read_config)
 from disco_aws_automation.disco_aws_util import run_gracefully
 from disco_aws_automation.disco_logging import configure_logging
+from disco_aws_automation.api_profiler import profile_api_until_exit
+from disco_aws_automation.deploy_timeline import record_deploy_timeline
 
 
 # R0912 Allow more than 12 branches so we can parse a lot of commands..
@@ -68,6 +78,12 @@ def run():
 
     configure_logging(args["--debug"])
 
+    if args["--profile-api"] or args["--profile-api-file"]:
+        profile_api_until_exit(args["--profile-api-file"])
+
+    if args["--timeline"] or args["--timeline-namespace"]:
+        record_deploy_timeline(args["--timeline"], args["--timeline-namespace"])
+
     env = args["--environment"] or config.get("disco_aws", "default_environment")
 
     pipeline_definition = []
@@ -87,15 +103,24 @@ def run():
     vpc = DiscoVPC.fetch_environment(environment_name=env)
 
     deploy = DiscoDeploy(
-        aws, test_aws, DiscoBake(config, aws.connection), DiscoAutoscale(env), DiscoELB(vpc),
+        aws, test_aws, DiscoBake(config, aws.connection, describe_cache=aws.describe_cache),
+        DiscoAutoscale(env, describe_cache=aws.describe_cache), DiscoELB(vpc),
         pipeline_definition=pipeline_definition,
         ami=args.get("--ami"), hostclass=args.get("--hostclass"),
         allow_any_hostclass=args["--allow-any-hostclass"])
 
-    if args["test"]:
-        deploy.test(dry_run=args["--dry-run"], deployment_strategy=args["--strategy"])
-    elif args["update"]:
-        deploy.update(dry_run=args["--dry-run"], deployment_strategy=args["--strategy"])
+    max_concurrency = int(args["--parallel"]) if args["--parallel"] else None
+    if args["test"] or args["update"]:
+        handle = deploy.test if args["test"] else deploy.update
+        results = handle(dry_run=args["--dry-run"], deployment_strategy=args["--strategy"],
+                         max_concurrency=max_concurrency)
+        if max_concurrency:
+            for result in results:
+                print("{} {:40} {:10} {}".format(
+                    result["ami"], result["hostclass"], result["stage"] or "-",
+                    "failed: {}".format(result["error"]) if result["error"] else "done"))
+            if any(result["error"] for result in results):
+                sys.exit(1)
     elif args["list"]:
         missing = "-" if len(pipeline_definition) else ""
         if args["--tested"]:
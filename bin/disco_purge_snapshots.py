@@ -30,12 +30,12 @@ import re
 from datetime import datetime
 import sys
 
-import boto
 from boto.exception import EC2ResponseError
 from docopt import docopt
 import iso8601
 import pytz
 
+from disco_aws_automation.client_registry import get_boto2_connection
 from disco_aws_automation.disco_aws_util import run_gracefully
 from disco_aws_automation.disco_logging import configure_logging
 
@@ -68,7 +68,7 @@ def purge_snapshots(options):
     """
     Purge snapshots we consider no longer worth keeping
     """
-    ec2_conn = boto.connect_ec2()
+    ec2_conn = get_boto2_connection('ec2')
     snap_pattern = re.compile(
         r"Created by CreateImage\(i-[a-f0-9]+\) for ami-[a-f0-9]+"
     )
@@ -71,11 +71,8 @@ def instances_from_args(disco_aws, args):
     Return list instances based on following arguments:
     hostclass, instance, amis, hostname
     """
-    instances = (disco_aws.instances(instance_ids=args.instances) if args.instances else [])
-    instances.extend(disco_aws.instances_from_hostclasses(args.hostclasses))
-    instances.extend(disco_aws.instances_from_amis(args.amis))
-    instances.extend([disco_aws.instance_from_hostname(h) for h in args.hostnames])
-    return instances
+    return disco_aws.instances_from_selectors(
+        instance_ids=args.instances, hostclasses=args.hostclasses, amis=args.amis, hostnames=args.hostnames)
 
 
 def run():
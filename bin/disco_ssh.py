@@ -14,18 +14,19 @@ Options:
      --debug                Log in debug level
      --env ENV              Environment to operate in
      --first                In case of multiple matching instances, connect to the first instead of failing
+     --no-ssh-multiplexing  Open a new ssh connection for every ssh command run on our behalf
 """
 
 import logging
 import os
 import re
-import socket
 
 from docopt import docopt
 
 from disco_aws_automation import DiscoAWS, read_config
 from disco_aws_automation.disco_aws_util import run_gracefully, EasyExit
 from disco_aws_automation.disco_logging import configure_logging
+from disco_aws_automation.disco_remote_exec import disable_ssh_multiplexing, first_ssh_reachable
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +44,8 @@ class DiscoSSH(object):
         self.env = self.args["--env"] or self.config.get("disco_aws", "default_environment")
         self.pick_instance = self.args['--first']
         configure_logging(args["--debug"])
+        if args["--no-ssh-multiplexing"]:
+            disable_ssh_multiplexing()
 
     def is_ip(self, string):
         """Returns True if the given string is an IPv4 address"""
@@ -89,18 +92,6 @@ class DiscoSSH(object):
         else:
             raise EasyExit("Too many instances matched: %s" % ", ".join(names))
 
-    def is_reachable(self, ip_address):
-        """Returns True if we can connect to port 22 at the given ip address"""
-        if not ip_address:
-            return False
-        logger.info("Probing %s", ip_address)
-        try:
-            sock = socket.create_connection((ip_address, 22), timeout=2)
-            sock.close()
-            return True
-        except socket.timeout:
-            return False
-
     def detect_best_route(self, host):
         """
         Detects the best way to ssh into an instance. Returns a list of ip addresses where
@@ -115,12 +106,11 @@ class DiscoSSH(object):
 
         logger.info("Detecting best route to %s", instance.tags.get("hostname"))
 
-        if self.is_reachable(instance.ip_address):  # ip_address is actually the public ip address (or None)
-            return [instance.ip_address]
-
-        for interface in instance.interfaces:
-            if self.is_reachable(interface.private_ip_address):
-                return [interface.private_ip_address]
+        # ip_address is actually the public ip address (or None), all of them are probed at once
+        direct_address = first_ssh_reachable(
+            [instance.ip_address] + [interface.private_ip_address for interface in instance.interfaces])
+        if direct_address:
+            return [direct_address]
 
         logger.info("No direct route. Trying jump host.")
         jump_host_ip = self.aws().find_jump_address()
@@ -1,22 +1,36 @@
 ''' For package documentation, see README '''
 
-from os import getenv
+from importlib import import_module
+from os import getenv, stat
 from os.path import join, exists
+from types import ModuleType
 from ConfigParser import ConfigParser
+import sys
+import threading
 
 
 ASIAQ_CONFIG = getenv("ASIAQ_CONFIG", ".")
 DEFAULT_CONFIG_FILE = "disco_aws.ini"
 
+_CONFIGS = {}  # path -> (modification time, size, ConfigParser)
+_CONFIGS_LOCK = threading.Lock()
+
 
 def read_config(config_file=DEFAULT_CONFIG_FILE):
     """
     Normalize and read in a config file (defaulting to "disco_aws.ini").
+    The parsed config is shared process wide until the file is modified, so treat it as read only.
     """
     real_config_file = normalize_path(config_file)
-    config = ConfigParser()
-    config.read(real_config_file)
-    return config
+    file_stat = stat(real_config_file)
+    with _CONFIGS_LOCK:
+        cached = _CONFIGS.get(real_config_file)
+        if cached and cached[:2] == (file_stat.st_mtime, file_stat.st_size):
+            return cached[2]
+        config = ConfigParser()
+        config.read(real_config_file)
+        _CONFIGS[real_config_file] = (file_stat.st_mtime, file_stat.st_size, config)
+        return config
 
 
 def normalize_path(path):
@@ -30,38 +44,75 @@ def normalize_path(path):
         raise RuntimeError("Config path not found: %s" % normalized_path)
 
 
+# Classes are exported lazily so that importing the package, or a single class from it, doesn't pull in
+# the boto, boto3, elasticsearch and requests_aws4auth stacks of every other module. Maps each exported
+# name to the module that defines it.
+_LAZY_EXPORTS = {
+    "DiscoACM": ".disco_acm",
+    "DiscoAutoscale": ".disco_autoscale",
+    "DiscoAWS": ".disco_aws",
+    "DiscoBake": ".disco_bake",
+    "DiscoS3Bucket": ".disco_creds",
+    "DiscoDynamoDB": ".disco_dynamodb",
+    "S3AccountBackend": ".disco_accounts",
+    "DiscoIAM": ".disco_iam",
+    "DiscoEIP": ".disco_eip",
+    "DiscoELB": ".disco_elb",
+    "DiscoRoute53": ".disco_route53",
+    "DiscoElastiCache": ".disco_elasticache",
+    "DiscoVPC": ".disco_vpc",
+    "DiscoVPCPeerings": ".disco_vpc_peerings",
+    "DiscoVPCEndpoints": ".disco_vpc_endpoints",
+    "HostclassTemplating": ".hostclass_templating",
+    "DiscoAlarm": ".disco_alarm",
+    "DiscoAlarmsConfig": ".disco_alarm_config",
+    "DiscoAlarmConfig": ".disco_alarm_config",
+    "DiscoMetrics": ".disco_metrics",
+    "DiscoAppAuth": ".disco_app_auth",
+    "DiscoDeploy": ".disco_deploy",
+    "DiscoSNS": ".disco_sns",
+    "DiscoSSM": ".disco_ssm",
+    "DiscoChaos": ".disco_chaos",
+    "DiscoStorage": ".disco_storage",
+    "DiscoLogMetrics": ".disco_log_metrics",
+    "DiscoElasticsearch": ".disco_elasticsearch",
+    "DiscoESArchive": ".disco_elasticsearch_archive",
+}
+
+
+class _LazyPackage(ModuleType):
+    """Package module that imports the module defining an exported class on first access"""
+
+    def __init__(self, original_module):
+        super(_LazyPackage, self).__init__(original_module.__name__, original_module.__doc__)
+        self.__dict__.update(original_module.__dict__)
+        # Python 2 clears the globals of a module object when it is garbage collected, so keep the
+        # original module alive for the functions defined in it.
+        self._original_module = original_module
+
+    def __getattr__(self, name):
+        if name not in _LAZY_EXPORTS:
+            raise AttributeError("module {0} has no attribute {1}".format(self.__name__, name))
+        value = getattr(import_module(_LAZY_EXPORTS[name], self.__name__), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__.keys()) | set(_LAZY_EXPORTS.keys()))
+
+
 # The following imports are at the bottom to avoid a circular import when importing read_config
 # pylint: disable=wrong-import-position
-from .disco_acm import DiscoACM
-from .disco_autoscale import DiscoAutoscale
-from .disco_aws import DiscoAWS
-from .disco_bake import DiscoBake
-from .disco_creds import DiscoS3Bucket
-from .disco_dynamodb import DiscoDynamoDB
-from .disco_accounts import S3AccountBackend
-from .disco_iam import DiscoIAM
-from .disco_eip import DiscoEIP
-from .disco_elb import DiscoELB
-from .disco_route53 import DiscoRoute53
-from .disco_elasticache import DiscoElastiCache
-from .disco_vpc import DiscoVPC
-from .disco_vpc_peerings import DiscoVPCPeerings
-from .disco_vpc_endpoints import DiscoVPCEndpoints
-from .hostclass_templating import HostclassTemplating
-from .disco_alarm import DiscoAlarm
-from .disco_alarm_config import DiscoAlarmsConfig, DiscoAlarmConfig
-from .disco_metrics import DiscoMetrics
-from .disco_app_auth import DiscoAppAuth
-from .disco_deploy import DiscoDeploy
-from .disco_sns import DiscoSNS
-from .disco_ssm import DiscoSSM
-from .disco_chaos import DiscoChaos
-from .disco_storage import DiscoStorage
-from .disco_log_metrics import DiscoLogMetrics
-from .disco_elasticsearch import DiscoElasticsearch
-from .disco_elasticsearch_archive import DiscoESArchive
 from .exceptions import TimeoutError, ExpectedTimeoutError, AccountError, CommandError, VPCEnvironmentError
 from .exceptions import SmokeTestError, AMIError, VolumeError, InstanceMetadataError, S3WritingError
 from .exceptions import MissingAppAuthError, AppAuthKeyNotFoundError, VPCConfigError, VPCPeeringSyntaxError
-from .exceptions import MultipleVPCsForVPCNameError, VPCNameNotFound, AlarmConfigError
+from .exceptions import MultipleVPCsForVPCNameError, VPCNameNotFound, AlarmConfigError, ProvisioningError
 from .version import __version__, __rpm_version__, __git_hash__
+
+
+def _install_lazy_package():
+    """Replaces this module in sys.modules with a _LazyPackage sharing its contents"""
+    sys.modules[__name__] = _LazyPackage(sys.modules[__name__])
+
+
+_install_lazy_package()
@@ -0,0 +1,199 @@
+"""
+Collects statistics about the AWS API calls made by a process.
+
+Profiling is switched off by default. Once enable_api_profiling has been called, every connection
+passed through profile_connection counts its calls and their latency per service and operation,
+while throttled_call and keep_trying report throttled retries, retry sleeps and rate limiter waits.
+write_api_profile dumps the statistics as JSON.
+"""
+from __future__ import print_function
+from collections import defaultdict
+import atexit
+import bisect
+import json
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]  # upper bounds in seconds
+
+
+class _OperationStats(object):
+    """Statistics of the calls of one AWS operation"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.latency_histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, seconds, error):
+        """Records one call"""
+        self.calls += 1
+        self.errors += 1 if error else 0
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.latency_histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def as_dict(self):
+        """Returns the statistics as a JSON serializable dict"""
+        bucket_names = ["<={0}s".format(bound) for bound in LATENCY_BUCKETS]
+        bucket_names.append(">{0}s".format(LATENCY_BUCKETS[-1]))
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_seconds": round(self.total_seconds, 3),
+            "mean_seconds": round(self.total_seconds / self.calls, 3) if self.calls else 0,
+            "max_seconds": round(self.max_seconds, 3),
+            "latency_histogram": dict(zip(bucket_names, self.latency_histogram))
+        }
+
+
+class _RetryStats(object):
+    """Statistics of the retries of one function called through throttled_call or keep_trying"""
+
+    def __init__(self):
+        self.throttles = 0
+        self.failures = 0
+        self.sleep_seconds = 0.0
+        self.rate_limit_wait_seconds = 0.0
+
+    def as_dict(self):
+        """Returns the statistics as a JSON serializable dict"""
+        return {
+            "throttles": self.throttles,
+            "failures": self.failures,
+            "sleep_seconds": round(self.sleep_seconds, 3),
+            "rate_limit_wait_seconds": round(self.rate_limit_wait_seconds, 3)
+        }
+
+
+class ApiProfiler(object):
+    """Thread safe collection of AWS API call statistics"""
+
+    def __init__(self):
+        self.enabled = False
+        self.start_time = None
+        self._lock = threading.Lock()
+        self._operations = defaultdict(_OperationStats)
+        self._retries = defaultdict(_RetryStats)
+        self._local = threading.local()
+
+    def enable(self):
+        """Starts collecting statistics"""
+        self.enabled = True
+        self.start_time = time.time()
+
+    def record_call(self, service, operation, seconds, error=False):
+        """Records one API call that took seconds"""
+        if self.enabled:
+            with self._lock:
+                self._operations["{0}.{1}".format(service, operation)].record(seconds, error)
+
+    def record_retry(self, name, sleep_seconds, throttled):
+        """Records a retry of a failed call, after sleeping sleep_seconds"""
+        if self.enabled:
+            with self._lock:
+                stats = self._retries[name]
+                stats.throttles += 1 if throttled else 0
+                stats.failures += 0 if throttled else 1
+                stats.sleep_seconds += sleep_seconds
+
+    def record_rate_limit_wait(self, name, seconds):
+        """Records time spent waiting for a rate limiter before a call"""
+        if self.enabled and seconds:
+            with self._lock:
+                self._retries[name].rate_limit_wait_seconds += seconds
+
+    def summary(self):
+        """Returns all statistics as a JSON serializable dict"""
+        with self._lock:
+            operations = {name: stats.as_dict() for name, stats in self._operations.iteritems()}
+            retries = {name: stats.as_dict() for name, stats in self._retries.iteritems()}
+        return {
+            "wall_clock_seconds": round(time.time() - self.start_time, 3) if self.start_time else 0,
+            "total_calls": sum([stats["calls"] for stats in operations.values()]),
+            "total_call_seconds": round(sum([stats["total_seconds"] for stats in operations.values()]), 3),
+            "operations": operations,
+            "retries": retries
+        }
+
+    def _before_boto3_call(self, model, context=None, **_):
+        starts = context if context is not None else self._local.__dict__
+        starts["api_profiler_start_" + model.name] = time.time()
+
+    def _after_boto3_call(self, model, http_response=None, context=None, **_):
+        starts = context if context is not None else self._local.__dict__
+        start = starts.pop("api_profiler_start_" + model.name, None)
+        if start is not None:
+            error = http_response is not None and http_response.status_code >= 400
+            self.record_call(model.service_model.service_name, model.name, time.time() - start, error)
+
+    def profile_connection(self, connection):
+        """
+        Makes a boto3 client or a boto2 query connection (ec2, autoscaling, elb, cloudwatch, ...)
+        report its calls. Returns the connection, unchanged if profiling isn't enabled.
+        """
+        # Compare with True, proxies and mocks answer any attribute with something truthy
+        if not self.enabled or getattr(connection, "_api_profiled", False) is True:
+            return connection
+
+        meta = getattr(connection, "meta", None)
+        if meta is not None and hasattr(meta, "events"):
+            meta.events.register("before-call", self._before_boto3_call)
+            meta.events.register("after-call", self._after_boto3_call)
+        elif hasattr(connection, "make_request") and hasattr(connection, "host"):
+            service = connection.host.split(".")[0]
+            make_request = connection.make_request
+
+            def _profiled_make_request(action, *args, **kwargs):
+                start = time.time()
+                error = True
+                try:
+                    response = make_request(action, *args, **kwargs)
+                    error = getattr(response, "status", 200) >= 400
+                    return response
+                finally:
+                    self.record_call(service, action, time.time() - start, error)
+
+            connection.make_request = _profiled_make_request
+        else:
+            logger.debug("Don't know how to profile %s", connection)
+            return connection
+
+        connection._api_profiled = True
+        return connection
+
+
+API_PROFILER = ApiProfiler()
+
+
+def enable_api_profiling():
+    """Starts collecting AWS API call statistics for this process"""
+    API_PROFILER.enable()
+
+
+def profile_api_until_exit(path=None):
+    """Starts collecting AWS API call statistics and writes them out when the process exits"""
+    enable_api_profiling()
+    atexit.register(write_api_profile, path)
+
+
+def profile_connection(connection):
+    """Makes a boto3 client or boto2 connection report its calls if profiling is enabled"""
+    return API_PROFILER.profile_connection(connection)
+
+
+def write_api_profile(path=None):
+    """Writes the collected statistics as JSON to a file, or to stderr if no path is given"""
+    summary = json.dumps(API_PROFILER.summary(), indent=4, sort_keys=True)
+    if path:
+        with open(path, "w") as profile_file:
+            profile_file.write(summary)
+        logger.info("Wrote AWS API profile to %s", path)
+    else:
+        print(summary, file=sys.stderr)
@@ -0,0 +1,128 @@
+"""
+Process wide registry of AWS clients and connections.
+
+Creating a client resolves credentials, loads the endpoint and service model data and opens fresh
+HTTPS connections, so modules ask this registry for their clients instead of creating their own.
+boto3 clients are thread safe and are shared by all threads, one per service and region, all created
+from boto3's default session so that credentials are only resolved once. boto3 resources and boto2
+connections aren't thread safe, so every thread gets its own, which it then keeps reusing. All of them
+keep their pooled HTTP connections open between calls, and are passed through profile_connection.
+"""
+import logging
+import threading
+
+import boto
+import boto.ec2
+import boto.ec2.autoscale
+import boto.ec2.cloudwatch
+import boto.iam
+import boto.route53
+import boto.s3
+import boto.sns
+import boto.sts
+import boto.vpc
+from boto.connection import AWSAuthConnection
+import boto3
+from boto3.resources.base import ServiceResource
+from botocore.client import BaseClient
+
+from .api_profiler import profile_connection
+
+logger = logging.getLogger(__name__)
+
+# boto2 connection factories by service name, called with a region name or None for the default region
+_BOTO2_CONNECTORS = {
+    "autoscale": lambda region: (
+        boto.ec2.autoscale.connect_to_region(region, use_block_device_types=True) if region
+        else boto.ec2.autoscale.AutoScaleConnection(use_block_device_types=True)),
+    "cloudwatch": lambda region: (
+        boto.ec2.cloudwatch.connect_to_region(region) if region else boto.connect_cloudwatch()),
+    "ec2": lambda region: boto.ec2.connect_to_region(region) if region else boto.connect_ec2(),
+    "iam": lambda region: boto.iam.connect_to_region(region) if region else boto.connect_iam(),
+    "route53": lambda region: boto.route53.connect_to_region(region) if region else boto.connect_route53(),
+    "s3": lambda region: boto.s3.connect_to_region(region) if region else boto.connect_s3(),
+    "sns": lambda region: boto.sns.connect_to_region(region) if region else boto.connect_sns(),
+    "sts": lambda region: boto.sts.connect_to_region(region) if region else boto.connect_sts(),
+    "vpc": lambda region: boto.vpc.connect_to_region(region) if region else boto.connect_vpc(),
+}
+
+_LOCK = threading.RLock()
+_SHARED = {}
+_LOCAL = threading.local()
+_generation = [0]  # bumped by clear_clients so that every thread drops its own cache
+
+
+def _registered(cache, key, create, shareable_type):
+    """
+    Returns the object cached under key, creating it first if necessary. Only real boto objects are
+    cached, anything else (such as the test double returned by a patched factory) is returned as is.
+    """
+    with _LOCK:
+        if key in cache:
+            return cache[key]
+        logger.debug("Creating AWS %s %s", key[0], key[1:])
+        created = create()
+        if isinstance(created, shareable_type):
+            cache[key] = created
+        return created
+
+
+def _thread_cache():
+    if getattr(_LOCAL, "generation", None) != _generation[0]:
+        _LOCAL.cache = {}
+        _LOCAL.generation = _generation[0]
+    return _LOCAL.cache
+
+
+def _profiled_resource(resource):
+    profile_connection(resource.meta.client)
+    return resource
+
+
+def _region_kwargs(region):
+    # Don't pass region_name unless asked to, boto3's default region comes from the environment and config
+    return {"region_name": region} if region else {}
+
+
+def get_boto3_session():
+    """Returns boto3's default session, which the registry creates all boto3 clients and resources from"""
+    with _LOCK:
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        return boto3.DEFAULT_SESSION
+
+
+def get_boto3_client(service, region=None):
+    """Returns the boto3 client for an AWS service in a region that is shared by all threads"""
+    return _registered(
+        _SHARED, ("client", service, region),
+        lambda: profile_connection(boto3.client(service, **_region_kwargs(region))),
+        BaseClient)
+
+
+def get_boto3_resource(service, region=None):
+    """Returns this thread's boto3 service resource for an AWS service in a region"""
+    return _registered(
+        _thread_cache(), ("resource", service, region),
+        lambda: _profiled_resource(boto3.resource(service, **_region_kwargs(region))),
+        ServiceResource)
+
+
+def get_boto2_connection(service, region=None):
+    """
+    Returns this thread's boto2 connection to an AWS service in a region. The service is one of
+    autoscale, cloudwatch, ec2, iam, route53, s3, sns, sts or vpc.
+    """
+    if service not in _BOTO2_CONNECTORS:
+        raise ValueError("No boto2 connection for AWS service {0}".format(service))
+    return _registered(
+        _thread_cache(), ("connection", service, region),
+        lambda: profile_connection(_BOTO2_CONNECTORS[service](region)),
+        AWSAuthConnection)
+
+
+def clear_clients():
+    """Forgets all registered clients, resources and connections, new ones are created on next use"""
+    with _LOCK:
+        _SHARED.clear()
+        _generation[0] += 1
@@ -0,0 +1,97 @@
+"""
+Flat index of the options of a configuration for fast lookups.
+
+Looking up a hostclass option used to take several has_option and get probes, each formatting an
+option@environment name, to find the environment specific value, the hostclass value or the
+default_ value from the disco_aws section. ConfigIndex reads every option of a configuration once
+into a dict keyed by section, option and environment, and remembers how each lookup was resolved,
+so repeated lookups cost a dict hit. Indexes are shared process wide, one per configuration object,
+and read_config only creates a new configuration object once its file is modified.
+
+Values are interpolated one option at a time, so an option whose %(...)s reference can't be
+interpolated only raises its InterpolationError when that option is looked up.
+"""
+from ConfigParser import ConfigParser, InterpolationError, NoOptionError, NoSectionError, RawConfigParser
+import threading
+import weakref
+
+_MISSING = object()
+
+
+class ConfigIndex(object):
+    """Read only index of a ConfigParser, or of any object with the sections and items methods"""
+
+    def __init__(self, config):
+        # Real ConfigParsers normalize option names, so lookups must do the same
+        self._optionxform = config.optionxform if isinstance(config, RawConfigParser) else (lambda opt: opt)
+        self._sections = set(config.sections())
+        self._values = {}  # (section, option, environment or None) -> value
+        self._resolved = {}  # (candidates, environment) -> value of the first candidate set
+        for section in self._sections:
+            if isinstance(config, ConfigParser):
+                items = self._interpolated_items(config, section)
+            else:
+                items = config.items(section)
+            for name, value in items:
+                option, _, environment = name.partition("@")
+                self._values[(section, option, environment or None)] = value
+
+    @staticmethod
+    def _interpolated_items(config, section):
+        """Yields the interpolated items of a section, or the InterpolationError of those that fail"""
+        for name, _ in config.items(section, raw=True):
+            try:
+                yield name, config.get(section, name)
+            except InterpolationError as err:
+                yield name, err
+
+    def _find(self, section, option, environment):
+        option = self._optionxform(option)
+        if environment:
+            value = self._values.get((section, option, self._optionxform(environment)), _MISSING)
+            if value is not _MISSING:
+                return value
+        return self._values.get((section, option, None), _MISSING)
+
+    def get(self, section, option, environment=None):
+        """
+        Returns an option of a section like ConfigParser.get, preferring the option@environment
+        value if there is one for the environment.
+        """
+        return self.lookup(((section, option),), environment)
+
+    def lookup(self, candidates, environment=None):
+        """
+        Returns the value of the first (section, option) candidate that is set, preferring the
+        option@environment value of each candidate over its plain value. Raises NoSectionError or
+        NoOptionError for the last candidate if none of them is set.
+        """
+        key = (tuple(candidates), environment)
+        value = self._resolved.get(key, _MISSING)
+        if value is _MISSING:
+            for section, option in key[0]:
+                value = self._find(section, option, environment)
+                if value is not _MISSING:
+                    break
+            self._resolved[key] = value
+        if value is _MISSING:
+            section, option = key[0][-1]
+            if section not in self._sections:
+                raise NoSectionError(section)
+            raise NoOptionError(option, section)
+        if isinstance(value, InterpolationError):
+            raise value
+        return value
+
+
+_INDEXES = weakref.WeakKeyDictionary()
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_config_index(config):
+    """Returns the index shared by everything that looks up options of a configuration object"""
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(config)
+        if index is None:
+            index = _INDEXES[config] = ConfigIndex(config)
+        return index
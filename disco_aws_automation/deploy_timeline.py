@@ -0,0 +1,135 @@
+"""
+Records a timeline of the phases of each deployment.
+
+DiscoDeploy wraps the phases of a deployment, such as creating the testing autoscaling group, waiting
+for the group to reach its size, smoke tests, integration tests, ELB health and tearing down the old
+group, in spans that carry their start and end timestamps and outcome. Spans nest, and every span
+belongs to the deployment of the outermost span of its thread, so concurrent deployments keep their
+own timelines. Recording is switched off by default. Once record_deploy_timeline has been called,
+each span is appended to a file as a line of JSON when it ends, and the durations of the spans of a
+deployment can be sent to CloudWatch as custom metrics when the deployment ends.
+"""
+from contextlib import contextmanager
+import datetime
+import json
+import logging
+import threading
+import time
+
+from .client_registry import get_boto3_client
+from .resource_helper import throttled_call
+
+logger = logging.getLogger(__name__)
+
+PHASE_DURATION_METRIC = "DeployPhaseDuration"
+PUT_METRIC_DATA_MAX_ITEMS = 20  # AWS limit on the metric data of one PutMetricData call
+
+
+class DeployTimeline(object):
+    """Thread safe recorder of deploy phase spans"""
+
+    def __init__(self):
+        self.path = None
+        self.namespace = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        """True once spans are written to a file or sent to CloudWatch"""
+        return bool(self.path or self.namespace)
+
+    def enable(self, path=None, namespace=None):
+        """
+        Starts appending spans as JSON lines to the file at path, and sending the durations of the
+        spans of each deployment to the CloudWatch namespace, if given.
+        """
+        self.path = path
+        self.namespace = namespace
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+            self._local.spans = []
+        return self._local.stack
+
+    @contextmanager
+    def phase(self, name, hostclass=None, ami_id=None):
+        """
+        Records the code run in a with block as a span of the named phase, and yields the span dict.
+        The outcome of the span is "error" if the block raises, or else whatever the block sets
+        span["outcome"] to, "done" by default. Spans that don't name a hostclass or AMI take those
+        of the span they are nested in.
+        """
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        start = time.time()
+        span = {
+            "phase": name,
+            "parent": parent["phase"] if parent else None,
+            "hostclass": hostclass or (parent["hostclass"] if parent else None),
+            "ami": ami_id or (parent["ami"] if parent else None),
+            "start": round(start, 3),
+            "outcome": None
+        }
+        span["deploy"] = parent["deploy"] if parent else "{0}-{1}".format(span["ami"] or name, int(start))
+        stack.append(span)
+        try:
+            yield span
+        except Exception:
+            span["outcome"] = "error"
+            raise
+        finally:
+            stack.pop()
+            span["end"] = round(time.time(), 3)
+            span["seconds"] = round(span["end"] - span["start"], 3)
+            span["outcome"] = span["outcome"] or "done"
+            self._record(span, deploy_ended=not stack)
+
+    def _record(self, span, deploy_ended):
+        if not self.enabled:
+            return
+        self._local.spans.append(span)
+        if self.path:
+            with self._lock:
+                with open(self.path, "a") as timeline_file:
+                    timeline_file.write(json.dumps(span, sort_keys=True) + "\n")
+        if deploy_ended:
+            spans, self._local.spans = self._local.spans, []
+            if self.namespace:
+                self._put_metrics(spans)
+
+    def _put_metrics(self, spans):
+        metric_data = []
+        for span in spans:
+            dimensions = [{"Name": "Phase", "Value": span["phase"]}]
+            if span["hostclass"]:
+                dimensions.append({"Name": "Hostclass", "Value": span["hostclass"]})
+            metric_data.append({
+                "MetricName": PHASE_DURATION_METRIC,
+                "Dimensions": dimensions,
+                "Timestamp": datetime.datetime.utcfromtimestamp(span["end"]),
+                "Value": span["seconds"],
+                "Unit": "Seconds"
+            })
+        try:
+            cloudwatch = get_boto3_client("cloudwatch")
+            for index in range(0, len(metric_data), PUT_METRIC_DATA_MAX_ITEMS):
+                throttled_call(cloudwatch.put_metric_data, Namespace=self.namespace,
+                               MetricData=metric_data[index:index + PUT_METRIC_DATA_MAX_ITEMS])
+        except Exception:
+            # Failing to report on a deployment must not fail the deployment
+            logger.exception("Unable to send deploy timeline metrics to CloudWatch")
+
+
+DEPLOY_TIMELINE = DeployTimeline()
+
+
+def record_deploy_timeline(path=None, namespace=None):
+    """Starts recording deploy phase spans to a JSON lines file and/or a CloudWatch namespace"""
+    DEPLOY_TIMELINE.enable(path, namespace)
+
+
+def deploy_phase(name, hostclass=None, ami_id=None):
+    """Returns a context manager recording a span of the named phase, see DeployTimeline.phase"""
+    return DEPLOY_TIMELINE.phase(name, hostclass, ami_id)
@@ -0,0 +1,59 @@
+"""
+Short lived read-through cache for AWS describe calls.
+
+A single DiscoAWS run tends to describe the same instances, autoscaling groups, launch configurations
+and images over and over. DiscoAWS hands its DescribeCache to the DiscoAutoscale and DiscoBake objects
+it creates, so that repeated identical describes cost a single round trip. Entries expire after a few
+seconds, which is shorter than any of our polling intervals, and are invalidated explicitly by the
+methods that create, change or delete the described resources.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DESCRIBE_CACHE_TTL = 10  # seconds, keep this below the AUTOSCALE and SMOKETEST poll intervals
+
+
+class DescribeCache(object):
+    """Thread safe cache of describe results keyed by operation and parameters"""
+
+    def __init__(self, ttl=DESCRIBE_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _freeze(value):
+        """Returns a hashable equivalent of describe parameters made of dicts, lists and scalars"""
+        if isinstance(value, dict):
+            return tuple(sorted((key, DescribeCache._freeze(item)) for key, item in value.iteritems()))
+        if isinstance(value, (list, tuple, set)):
+            return tuple(DescribeCache._freeze(item) for item in value)
+        return value
+
+    def get(self, operation, fetch, **params):
+        """
+        Returns the cached result of an operation called with params, calling fetch()
+        to get and cache it if there is no unexpired entry.
+        """
+        key = (operation, DescribeCache._freeze(params))
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] > time.time():
+            logger.debug("Describe cache hit for %s %s", operation, params)
+            return entry[1]
+        result = fetch()
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, result)
+        return result
+
+    def invalidate(self, *operations):
+        """Drops the cached results of the given operations, or of all operations if none are given"""
+        with self._lock:
+            if not operations:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] in operations]:
+                    del self._entries[key]
@@ -3,9 +3,10 @@ Some code to manage the Amazon Certificate Service.
 """
 import logging
 
-import boto3
 import botocore
 
+from .client_registry import get_boto3_client
+
 logger = logging.getLogger(__name__)
 
 CERT_SUMMARY_LIST_KEY = 'CertificateSummaryList'
@@ -57,7 +58,7 @@ class DiscoACM(object):
         """
         if not self._acm:
             try:
-                self._acm = boto3.client('acm')
+                self._acm = get_boto3_client('acm')
             except Exception:
                 logger.warning("ACM service does not exist in current region")
                 return None
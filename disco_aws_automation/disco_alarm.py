@@ -2,8 +2,7 @@
 
 import logging
 
-from boto.ec2.cloudwatch import CloudWatchConnection
-
+from .client_registry import get_boto2_connection
 from .disco_sns import DiscoSNS
 from .disco_alarm_config import DiscoAlarmConfig, DiscoAlarmsConfig
 from .resource_helper import throttled_call
@@ -21,11 +20,17 @@ class DiscoAlarm(object):
     """
 
     def __init__(self, environment, disco_sns=None, alarm_configs=None):
-        self.cloudwatch = CloudWatchConnection()
         self.environment = environment
         self._disco_sns = disco_sns
         self._alarm_configs = alarm_configs
 
+    @property
+    def cloudwatch(self):
+        """
+        The calling thread's own boto2 CloudWatch connection
+        """
+        return get_boto2_connection('cloudwatch')
+
     @property
     def disco_sns(self):
         """
@@ -121,6 +126,18 @@ class DiscoAlarm(object):
         """
         self._delete_alarms(self.get_alarms({"env": environment, "hostclass": hostclass}))
 
+    def delete_hostclasses_environment_alarms(self, environment, hostclasses):
+        """
+        Delete the alarms of several hostclasses in an environment, listing all alarms only once
+        """
+        hostclasses = set(hostclasses)
+        alarms = []
+        for alarm in self.alarms():
+            decoded_name = DiscoAlarmConfig.decode_alarm_name(alarm.name)
+            if decoded_name.get("env") == environment and decoded_name.get("hostclass") in hostclasses:
+                alarms.append(alarm)
+        self._delete_alarms(alarms)
+
     def delete_environment_alarms(self, environment):
         """
         Delete all alarms for an environment
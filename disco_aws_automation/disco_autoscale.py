@@ -1,7 +1,9 @@
 '''Contains DiscoAutoscale class that orchestrates AWS Autoscaling'''
+import hashlib
 import logging
-import random
 import time
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 import boto
 import boto.ec2
@@ -9,10 +11,12 @@ import boto.ec2.autoscale
 import boto.ec2.autoscale.launchconfig
 import boto.ec2.autoscale.group
 from boto.ec2.autoscale.policy import ScalingPolicy
+from boto.ec2.blockdevicemapping import BlockDeviceType
 from boto.exception import BotoServerError
-from botocore.exceptions import WaiterError
-import boto3
+from botocore.exceptions import ClientError, WaiterError
 
+from .client_registry import get_boto2_connection, get_boto3_client
+from .describe_cache import DescribeCache
 from .resource_helper import throttled_call
 from .exceptions import TooManyAutoscalingGroups
 
@@ -20,37 +24,40 @@ logger = logging.getLogger(__name__)
 
 
 DEFAULT_TERMINATION_POLICIES = ["OldestLaunchConfiguration"]
+DESCRIBE_GROUPS_MAX_NAMES = 50  # group names passed to one DescribeAutoScalingGroups call
+CONFIG_DELETE_CONCURRENCY = 8  # unused launch configurations deleted at the same time
+GROUP_DELETE_CONCURRENCY = 8  # autoscaling groups deleted at the same time
 
 
 class DiscoAutoscale(object):
     '''Class orchestrating autoscaling'''
 
     def __init__(self, environment_name, autoscaling_connection=None, boto3_autoscaling_connection=None,
-                 boto3_ec_connection=None):
+                 boto3_ec_connection=None, describe_cache=None):
         self.environment_name = environment_name
-        self._connection = autoscaling_connection or None  # lazily initialized
+        self.describe_cache = describe_cache or DescribeCache()
+        self._connection = autoscaling_connection or None  # else each thread uses its own
         self._boto3_autoscale = boto3_autoscaling_connection or None  # lazily initialized
         self._boto3_ec = boto3_ec_connection or None  # lazily initialized
+        self._config_cleanup_deferred = False  # see deferred_config_cleanup
 
     @property
     def connection(self):
-        '''Lazily create boto autoscaling connection'''
-        if not self._connection:
-            self._connection = boto.ec2.autoscale.AutoScaleConnection(use_block_device_types=True)
-        return self._connection
+        '''The boto autoscaling connection passed in, or else the calling thread's own one'''
+        return self._connection or get_boto2_connection('autoscale')
 
     @property
     def boto3_autoscale(self):
         '''Lazily create boto3 autoscaling connection'''
         if not self._boto3_autoscale:
-            self._boto3_autoscale = boto3.client('autoscaling')
+            self._boto3_autoscale = get_boto3_client('autoscaling')
         return self._boto3_autoscale
 
     @property
     def boto3_ec(self):
         '''Lazily create boto3 ec2 connection'''
         if not self._boto3_ec:
-            self._boto3_ec = boto3.client('ec2')
+            self._boto3_ec = get_boto3_client('ec2')
         return self._boto3_ec
 
     def get_new_groupname(self, hostclass):
@@ -105,6 +112,17 @@ class DiscoAutoscale(object):
             if not next_token:
                 break
 
+    def get_groups(self, group_names):
+        '''
+        Returns the current state of the named autoscaling groups in the current environment,
+        bypassing the describe cache. Groups carry their list of instances.
+        '''
+        group_names = sorted(set(group_names))
+        return [group
+                for index in range(0, len(group_names), DESCRIBE_GROUPS_MAX_NAMES)
+                for group in self._get_group_generator(
+                    group_names=group_names[index:index + DESCRIBE_GROUPS_MAX_NAMES])]
+
     def get_instances(self, instance_ids=None, hostclass=None, group_name=None):
         '''Returns autoscaled instances in the current environment'''
         return list(self._get_instance_generator(instance_ids=instance_ids, hostclass=hostclass,
@@ -124,7 +142,8 @@ class DiscoAutoscale(object):
 
     def get_configs(self, names=None):
         '''Returns Launch Configurations in current environment'''
-        return list(self._get_config_generator(names=names))
+        return list(self.describe_cache.get(
+            "launch_configs", lambda: list(self._get_config_generator(names=names)), names=names))
 
     def get_config(self, *args, **kwargs):
         '''Returns a new launch configuration'''
@@ -132,21 +151,100 @@ class DiscoAutoscale(object):
             connection=self.connection, *args, **kwargs
         )
         throttled_call(self.connection.create_launch_configuration, config)
+        self.describe_cache.invalidate("launch_configs")
         return config
 
+    @staticmethod
+    def _config_digest(params):
+        '''Returns a short hash of launch configuration parameters'''
+        def _canonical(value):
+            if isinstance(value, dict):
+                return sorted((key, _canonical(item)) for key, item in value.iteritems())
+            if isinstance(value, (list, tuple)):
+                return [_canonical(item) for item in value]
+            if isinstance(value, BlockDeviceType):
+                return _canonical({key: item for key, item in vars(value).iteritems() if key != "connection"})
+            return value
+        return hashlib.sha1(repr(_canonical(params))).hexdigest()[:16]
+
+    def get_or_create_config(self, hostclass, **kwargs):
+        '''
+        Returns a launch configuration with the given parameters, reusing the existing launch
+        configuration with the same parameters if there is one. Launch configurations are named
+        after the environment, the hostclass and a hash of their parameters.
+        '''
+        name = '{0}_{1}_{2}'.format(self.environment_name, hostclass, DiscoAutoscale._config_digest(kwargs))
+        existing = self.get_configs(names=[name])
+        if existing:
+            logger.info("Reusing launch configuration %s", name)
+            return existing[0]
+        try:
+            return self.get_config(name=name, **kwargs)
+        except BotoServerError as err:
+            if err.error_code != "AlreadyExists":
+                raise
+            # Someone else created the same launch configuration since we looked
+            self.describe_cache.invalidate("launch_configs")
+            return self.get_configs(names=[name])[0]
+
     def delete_config(self, config_name):
         '''Delete a specific Launch Configuration'''
         throttled_call(self.connection.delete_launch_configuration, config_name)
+        self.describe_cache.invalidate("launch_configs")
         logger.info("Deleting launch configuration %s", config_name)
 
+    def _delete_config_if_unused(self, config_name):
+        '''Deletes a launch configuration unless an autoscaling group still uses it'''
+        try:
+            self.delete_config(config_name)
+        except BotoServerError as err:
+            logger.debug("Not deleting launch configuration %s: %s", config_name, err.error_code)
+
     def clean_configs(self):
-        '''Delete unused Launch Configurations in current environment'''
+        '''
+        Delete unused Launch Configurations in current environment. Launch configurations that are in
+        use by an autoscaling group are left alone without trying to delete them, and the others
+        are deleted several at a time.
+        '''
+        if self._config_cleanup_deferred:
+            logger.debug("Deferring the cleanup of unused launch configurations")
+            return
         logger.info("Cleaning up unused launch configurations in %s", self.environment_name)
-        for config in self._get_config_generator():
+        used = set(group.launch_config_name for group in self._get_group_generator())
+        unused = [config.name for config in self._get_config_generator() if config.name not in used]
+        if not unused:
+            return
+
+        def _delete(config_name):
             try:
-                self.delete_config(config.name)
-            except BotoServerError:
-                pass
+                throttled_call(self.boto3_autoscale.delete_launch_configuration,
+                               LaunchConfigurationName=config_name)
+                logger.info("Deleting launch configuration %s", config_name)
+            except ClientError as err:
+                # A group may have started using it since we looked
+                logger.debug("Not deleting launch configuration %s: %s", config_name, err)
+
+        pool = ThreadPool(processes=min(CONFIG_DELETE_CONCURRENCY, len(unused)))
+        try:
+            pool.map(_delete, unused)
+        finally:
+            pool.close()
+            pool.join()
+        self.describe_cache.invalidate("launch_configs")
+
+    @contextmanager
+    def deferred_config_cleanup(self):
+        '''
+        Within this context clean_configs does nothing, and unused launch configurations are cleaned up
+        once on exit instead. Several spinups can then run at the same time without one deleting a
+        launch configuration that another has created or reused but not yet attached to its group.
+        '''
+        self._config_cleanup_deferred = True
+        try:
+            yield
+        finally:
+            self._config_cleanup_deferred = False
+            self.clean_configs()
 
     def delete_groups(self, hostclass=None, group_name=None, force=False):
         '''
@@ -160,9 +258,45 @@ class DiscoAutoscale(object):
             try:
                 throttled_call(group.delete, force_delete=force)
                 logger.info("Deleting group %s", group.name)
-                self.delete_config(group.launch_config_name)
             except BotoServerError:
                 logger.info("Unable to delete group %s, try force deleting", group.name)
+                continue
+            # Launch configurations are shared by groups with identical configurations
+            self._delete_config_if_unused(group.launch_config_name)
+        self.describe_cache.invalidate("autoscaling_groups", "instances")
+
+    def delete_hostclasses_groups(self, hostclasses, force=False, max_concurrency=GROUP_DELETE_CONCURRENCY):
+        '''
+        Delete the autoscaling groups of several hostclasses, at most max_concurrency at the same time,
+        and then the launch configurations they no longer use.
+
+        If force is True, autoscaling groups will be forcibly destroyed, even if they are currently in use.
+        '''
+        hostclasses = set(hostclasses)
+        groups = [group for group in self.get_existing_groups()
+                  if self.get_hostclass(group.name) in hostclasses]
+        if not groups:
+            return
+
+        def _delete(group):
+            try:
+                throttled_call(self.boto3_autoscale.delete_auto_scaling_group,
+                               AutoScalingGroupName=group.name, ForceDelete=force)
+                logger.info("Deleting group %s", group.name)
+                return group.launch_config_name
+            except ClientError:
+                logger.info("Unable to delete group %s, try force deleting", group.name)
+                return None
+
+        pool = ThreadPool(processes=min(max_concurrency, len(groups)))
+        try:
+            config_names = pool.map(_delete, groups)
+        finally:
+            pool.close()
+            pool.join()
+        self.describe_cache.invalidate("autoscaling_groups", "instances")
+        for config_name in sorted(set(name for name in config_names if name)):
+            self._delete_config_if_unused(config_name)
 
     def clean_groups(self, force=False):
         '''
@@ -185,6 +319,7 @@ class DiscoAutoscale(object):
             group.min_size = group.max_size = group.desired_capacity = 0
             logger.info("Scaling down group %s", group.name)
             throttled_call(group.update)
+            self.describe_cache.invalidate("autoscaling_groups")
 
             if wait:
                 waiter = throttled_call(self.boto3_ec.get_waiter, 'instance_terminated')
@@ -227,6 +362,7 @@ class DiscoAutoscale(object):
         if tags:
             throttled_call(self.connection.create_or_update_tags,
                            DiscoAutoscale.create_autoscale_tags(group.name, tags))
+        self.describe_cache.invalidate("autoscaling_groups")
         if load_balancers:
             self.update_elb(elb_names=load_balancers, group_name=group.name)
         return group
@@ -263,6 +399,7 @@ class DiscoAutoscale(object):
             termination_policies=termination_policies,
             instance_id=None)
         throttled_call(self.connection.create_auto_scaling_group, group)
+        self.describe_cache.invalidate("autoscaling_groups")
         return group
 
     # pylint: disable=too-many-arguments
@@ -296,7 +433,9 @@ class DiscoAutoscale(object):
         Returns all autoscaling groups for a given hostclass, sorted by most recent creation. If no
         autoscaling groups can be found, returns an empty list.
         """
-        groups = list(self._get_group_generator(group_names=[group_name]))
+        groups = self.describe_cache.get(
+            "autoscaling_groups", lambda: list(self._get_group_generator(group_names=[group_name])),
+            group_name=group_name)
         filtered_groups = [group for group in groups
                            if not hostclass or self.get_hostclass(group.name) == hostclass]
         filtered_groups.sort(key=lambda group: group.name, reverse=True)
@@ -329,6 +468,7 @@ class DiscoAutoscale(object):
         """
         throttled_call(self.connection.terminate_instance,
                        instance_id, decrement_capacity=decrement_capacity)
+        self.describe_cache.invalidate("autoscaling_groups", "instances")
 
     def get_launch_configs(self, hostclass=None, group_name=None):
         """Returns all launch configurations for a hostclass if any exist, None otherwise"""
@@ -402,9 +542,9 @@ class DiscoAutoscale(object):
         return snapshot_devs[0]
 
     def _create_new_launchconfig(self, hostclass, launch_config):
-        """Creates a launch configuration"""
-        return self.get_config(
-            name='{0}_{1}_{2}'.format(self.environment_name, hostclass, str(random.randrange(0, 9999999))),
+        """Creates a launch configuration, or reuses an identical one"""
+        return self.get_or_create_config(
+            hostclass,
             image_id=launch_config.image_id,
             key_name=launch_config.key_name,
             security_groups=launch_config.security_groups,
@@ -459,4 +599,6 @@ class DiscoAutoscale(object):
             throttled_call(self.boto3_autoscale.detach_load_balancers,
                            AutoScalingGroupName=group.name,
                            LoadBalancerNames=list(extras))
+        if new_lbs or extras:
+            self.describe_cache.invalidate("autoscaling_groups")
         return (new_lbs, extras)
@@ -1,20 +1,22 @@
 """
 Top level disco_aws_automation module.  Orchestrates deployment to AWS.
 """
-from ConfigParser import NoOptionError
+# pylint: disable=too-many-lines
+from ConfigParser import NoOptionError, NoSectionError
 from collections import defaultdict
 import getpass
 import logging
-import random
+import threading
 import time
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
+from Queue import Empty, Queue
 import dateutil.parser
 
-import boto
-import boto.ec2
-import boto.ec2.autoscale
 from boto.exception import EC2ResponseError
 
+from .client_registry import get_boto2_connection
+from .config_index import get_config_index
 from .disco_log_metrics import DiscoLogMetrics
 from .disco_elb import DiscoELB
 from .disco_alarm import DiscoAlarm
@@ -26,6 +28,7 @@ from .disco_aws_util import (
     size_as_maximum_int_or_none
 )
 from .disco_bake import DiscoBake
+from .describe_cache import DescribeCache
 from .disco_constants import (
     DEFAULT_CONFIG_SECTION,
     DEFAULT_INSTANCE_TYPE,
@@ -33,25 +36,31 @@ from .disco_constants import (
     SMOKETEST_TIMEOUT,
     AUTOSCALE_POLL_INTERVAL,
     AUTOSCALE_TIMEOUT,
+    PROVISION_CONCURRENCY,
+    DESCRIBE_INSTANCES_MAX_IDS,
 )
-from .disco_remote_exec import DiscoRemoteExec
+from .disco_remote_exec import DiscoRemoteExec, is_ssh_reachable
 from .disco_storage import DiscoStorage
 from .disco_vpc import DiscoVPC
 from .resource_helper import (
+    BatchWaiter,
     TimeoutError,
     keep_trying,
-    wait_for_state,
+    throttled_call,
 )
 from .exceptions import (
     AMIError,
     VPCEnvironmentError,
     SmokeTestError,
     CommandError,
+    ProvisioningError,
     TimeoutError,
 )
 
 logger = logging.getLogger(__name__)
 
+SPINUP_POLL_INTERVAL = 1  # seconds between checks for Ctrl-C while waiting for a hostclass to spin up
+
 
 class DiscoAWS(object):
     '''Class orchestrating deployment on AWS'''
@@ -71,26 +80,28 @@ class DiscoAWS(object):
         self._elb = elb or None  # lazily initialized
         self._log_metrics = log_metrics or None  # lazily initialized
         self._alarms = alarms or None  # lazily initialized
+        self.describe_cache = DescribeCache()  # shared with the autoscale and bake objects we create
+        self._jump_address = None  # lazily found, see find_jump_address
+        self._jump_address_lock = threading.Lock()
 
     @property
     def connection(self):
-        """Lazily creates boto2 ec2 connection"""
-        if not self._connection:
-            self._connection = boto.connect_ec2()
-        return self._connection
+        """The boto2 ec2 connection passed in, or else the calling thread's own one"""
+        return self._connection or get_boto2_connection('ec2')
 
     @property
     def disco_storage(self):
         """Lazily creates disco storage object"""
         if not self._disco_storage:
-            self._disco_storage = DiscoStorage(self.environment_name, self.connection)
+            self._disco_storage = DiscoStorage(self.environment_name, self._connection)
         return self._disco_storage
 
     @property
     def autoscale(self):
         """Lazily creates disco autoscale object"""
         if not self._autoscale:
-            self._autoscale = DiscoAutoscale(environment_name=self.environment_name)
+            self._autoscale = DiscoAutoscale(environment_name=self.environment_name,
+                                             describe_cache=self.describe_cache)
         return self._autoscale
 
     @property
@@ -133,12 +144,9 @@ class DiscoAWS(object):
 
     def config(self, option, section=DEFAULT_CONFIG_SECTION, default=None):
         """Get a value from the config"""
-        env_option = "{0}@{1}".format(option, self.environment_name)
-        if self._config.has_option(section, env_option):
-            return self._config.get(section, env_option)
-        if self._config.has_option(section, option):
-            return self._config.get(section, option)
-        else:
+        try:
+            return self.config_no_default(option, section)
+        except (NoSectionError, NoOptionError):
             return default
 
     def config_no_default(self, option, section=DEFAULT_CONFIG_SECTION):
@@ -146,21 +154,14 @@ class DiscoAWS(object):
         Similar to config function above except that it doesnt return a default when an option is not found.
         Raises a NoOptionError error when option not found.
         """
-        env_option = "{0}@{1}".format(option, self.environment_name)
-        if self._config.has_option(section, env_option):
-            return self._config.get(section, env_option)
-        return self._config.get(section, option)
+        return get_config_index(self._config).get(section, option, self.environment_name)
 
     def hostclass_option(self, hostclass, option):
         # TODO swap hostclass (default to DEFAULT_CONFIG_SECTION) and option
         """Fetch a hostclass configuration option, if it does not exist get the default"""
-        env_option = "{0}@{1}".format(option, self.environment_name)
-        if self._config.has_option(hostclass, env_option):
-            return self._config.get(hostclass, env_option)
-        elif self._config.has_option(hostclass, option):
-            return self._config.get(hostclass, option)
-        else:
-            return self.config_no_default(section=DEFAULT_CONFIG_SECTION, option="default_{0}".format(option))
+        return get_config_index(self._config).lookup(
+            [(hostclass, option), (DEFAULT_CONFIG_SECTION, "default_{0}".format(option))],
+            self.environment_name)
 
     def hostclass_option_default(self, hostclass, option, default=None):
         """Fetch a hostclass configuration option if it exists, otherwise return value passed in as default"""
@@ -377,16 +378,13 @@ class DiscoAWS(object):
         group_name -- force reuse of an existing autoscaling group
         """
         # It's possible that the ami isn't available yet, so wait here
-        wait_for_state(ami, u'available', 600)
+        if ami.state != u'available':
+            BatchWaiter(self.connection, "image", timeout=600).wait([ami.id], u'available')
         # TODO is it necessary to wait here???
 
         meta_network = self.get_meta_network(hostclass)
         instance_type = instance_type if instance_type else self.get_instance_type(hostclass)
 
-        # Use a human friendly name and append a random tail to avoid name collisions.
-        lc_name = '{0}_{1}_{2}'.format(
-            self.environment_name, hostclass, str(random.randrange(0, 9999999)))
-
         user_data = self.create_userdata(hostclass, owner)
 
         block_device_mappings = self.get_block_device_mappings(
@@ -395,8 +393,9 @@ class DiscoAWS(object):
 
         self.log_metrics.update(hostclass)
 
-        launch_config = self.autoscale.get_config(
-            name=lc_name,
+        # Identical launch configurations are shared rather than created anew for every provision
+        launch_config = self.autoscale.get_or_create_config(
+            hostclass,
             image_id=ami.id,
             key_name=DiscoAWS._nonify(self.hostclass_option(hostclass, "ssh_key_name")),
             security_groups=[meta_network.security_group.id],
@@ -405,7 +404,8 @@ class DiscoAWS(object):
             instance_monitoring=monitoring_enabled,
             instance_profile_name=self.hostclass_option_default(hostclass, "instance_profile_name"),
             ebs_optimized=self.disco_storage.is_ebs_optimized(instance_type),
-            user_data="\n".join(['{0}="{1}"'.format(key, value) for key, value in user_data.iteritems()]),
+            user_data="\n".join(['{0}="{1}"'.format(key, value)
+                                 for key, value in sorted(user_data.iteritems())]),
             associate_public_ip_address=is_truthy(self.hostclass_option(hostclass, "public_ip")))
 
         self.create_floating_interfaces(meta_network, hostclass)
@@ -438,13 +438,15 @@ class DiscoAWS(object):
         if not testing:
             self.alarms.create_alarms(hostclass, group.name)
 
+        self.describe_cache.invalidate("instances")
+
         logger.info("Spun up %s instances of %s from %s into group %s",
                     size_as_maximum_int_or_none(desired_size), hostclass, ami.id, group.name)
 
         return {
             "hostclass": hostclass,
             "no_destroy": no_destroy,
-            "launch_config": lc_name,
+            "launch_config": launch_config.name,
             "group_name": group.name,
             "chaos": chaos
         }
@@ -477,6 +479,7 @@ class DiscoAWS(object):
             else:
                 self.connection.stop_instances(instance_ids)
                 logger.info("stopped: %s", instances)
+            self.describe_cache.invalidate("instances")
         else:
             logger.info("No unterminated instances")
 
@@ -501,9 +504,19 @@ class DiscoAWS(object):
         return None
 
     def find_jump_address(self):
-        """Returns IPv4 address of ssh jump host"""
-        host = self.find_jump_host()
-        return None if not host else host.ip_address if host.ip_address else host.private_ip_address
+        """
+        Returns IPv4 address of ssh jump host.
+
+        The address is remembered, and only looked up again once the remembered jump host no longer
+        accepts connections on the ssh port.
+        """
+        with self._jump_address_lock:
+            if self._jump_address and is_ssh_reachable(self._jump_address):
+                return self._jump_address
+            host = self.find_jump_host()
+            self._jump_address = (
+                None if not host else host.ip_address if host.ip_address else host.private_ip_address)
+            return self._jump_address
 
     def remotecmd(self, instance, *args, **kwargs):
         """
@@ -534,6 +547,35 @@ class DiscoAWS(object):
             raise CommandError("No private IP address available to ssh to")
         return self.disco_remote_exec.remotecmd(address, jump_address=jump_address, *args, **kwargs)
 
+    def remotecmd_parallel(self, instances, remote_command, user, max_concurrency=1, timeout=None,
+                           output_handler=None):
+        """
+        Runs a command on each of the instances with remotecmd, on at most max_concurrency of them
+        at the same time. Commands that run for longer than timeout seconds are killed. If an
+        output_handler is given, it is called with the instance and each line of its output as soon
+        as the line arrives.
+
+        Returns a list of (return_code, captured_output) tuples in the order of the instances.
+        """
+        def _run(instance):
+            handler = (lambda line: output_handler(instance, line)) if output_handler else None
+            return self.remotecmd(instance, remote_command, user=user, nothrow=True,
+                                  output_handler=handler, timeout=timeout)
+
+        workers = min(max_concurrency, len(instances))
+        if workers <= 1:
+            return [_run(instance) for instance in instances]
+
+        # Add the ssh keys and find the jump host up front so the worker threads share them
+        _ = self.disco_remote_exec
+        self.find_jump_address()
+        pool = ThreadPool(processes=workers)
+        try:
+            return pool.map(_run, instances, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
     def instances(self, filters=None, instance_ids=None):
         """
         Return all instances or subset as specified by filter.
@@ -547,8 +589,12 @@ class DiscoAWS(object):
         if self.vpc:
             vpc_filter = {tag.get('Name'): tag.get('Values')[0] for tag in self.vpc.vpc_filters()}
             combined_filters.update(vpc_filter)
-        reservations = keep_trying(
-            60, self.connection.get_all_instances,
+        reservations = self.describe_cache.get(
+            "instances",
+            lambda: keep_trying(
+                60, self.connection.get_all_instances,
+                filters=combined_filters, instance_ids=instance_ids
+            ),
             filters=combined_filters, instance_ids=instance_ids
         )
         return [instance
@@ -570,54 +616,95 @@ class DiscoAWS(object):
 
     def instances_from_hostclasses(self, hostclasses):
         """Returns a flat list of all instances for a list of hostclasses"""
-        return [
-            instance
-            for instance in self.instances()
-            if instance.tags.get("hostclass", "-") in hostclasses
-        ]
+        return self._instances_from_filter_values("tag:hostclass", hostclasses)
 
     def instances_from_amis(self, ami_ids):
         """Returns instances matching any of a list of AMI ids"""
-        return self.instances(filters={"image_id": ami_ids})
+        return self._instances_from_filter_values("image_id", ami_ids)
 
     def instances_from_asgs(self, asgs):
         """Returns instances matching any of a list of autoscaling group names"""
+        return self._instances_from_filter_values("tag:aws:autoscaling:groupName", asgs)
+
+    def _instances_from_filter_values(self, name, values):
+        """
+        Returns the instances for which a DescribeInstances filter matches any of a list of values.
+        Makes no call for an empty list and one call per DESCRIBE_INSTANCES_MAX_IDS values otherwise.
+        """
+        values = sorted(set(values))
         return [
             instance
-            for instance in self.instances()
-            if instance.tags.get("aws:autoscaling:groupName", "-") in asgs
+            for index in range(0, len(values), DESCRIBE_INSTANCES_MAX_IDS)
+            for instance in self.instances(filters={name: values[index:index + DESCRIBE_INSTANCES_MAX_IDS]})
         ]
 
-    def spindown(self, hostclasses):
+    def instances_from_selectors(self, instance_ids=(), hostclasses=(), amis=(), hostnames=(), asgs=()):
+        """
+        Returns the instances matching any of the given instance ids, hostclasses, AMI ids, hostnames
+        or autoscaling group names, each instance once. Only the first instance with each hostname
+        is returned, like instance_from_hostname does.
+
+        Makes one DescribeInstances call per kind of selector given (more for very long lists),
+        rather than one per selector.
+        """
+        instances = self.instances(instance_ids=list(instance_ids)) if instance_ids else []
+        instances.extend(self.instances_from_hostclasses(hostclasses))
+        instances.extend(self.instances_from_amis(amis))
+        named = {}
+        for instance in self._instances_from_filter_values("tag:hostname", hostnames):
+            named.setdefault(instance.tags.get("hostname"), instance)
+        instances.extend(named[hostname] for hostname in hostnames if hostname in named)
+        instances.extend(self.instances_from_asgs(asgs))
+
+        seen = set()
+        unique_instances = []
+        for instance in instances:
+            if instance.id not in seen:
+                seen.add(instance.id)
+                unique_instances.append(instance)
+        return unique_instances
+
+    def spindown(self, hostclasses, max_concurrency=None):
         """
         Shuts down hosts in all hostclasses in list.
 
+        The autoscaling groups, ELBs and log groups of all hostclasses are deleted together, at most
+        max_concurrency of each at a time, defaulting to the provision_concurrency option of the
+        disco_aws section. Alarms and log groups are listed once for all hostclasses.
+
         .. warning:: This currently does a dirty shutdown, no attempt is made to preserve logs.
         """
-        for hostclass in hostclasses:
-            self.autoscale.delete_groups(hostclass=hostclass, force=True)
+        max_concurrency = int(max_concurrency or self.config("provision_concurrency",
+                                                             default=PROVISION_CONCURRENCY))
+        self.autoscale.delete_hostclasses_groups(hostclasses, force=True, max_concurrency=max_concurrency)
 
-            self.elb.delete_elb(hostclass)
+        self.elb.delete_elbs(hostclasses, max_concurrency=max_concurrency)
 
-            self.alarms.delete_hostclass_environment_alarms(
-                self.environment_name, hostclass
-            )
+        self.alarms.delete_hostclasses_environment_alarms(self.environment_name, hostclasses)
 
-            self.log_metrics.delete_metrics(hostclass)
-            self.log_metrics.delete_log_groups(hostclass)
+        # Deleting the log groups deletes their metric filters too
+        self.log_metrics.delete_hostclasses_log_groups(hostclasses, max_concurrency=max_concurrency)
 
     def spinup(self, hostclass_dicts, stage=None, no_smoke=False, testing=False, create_if_exists=False,
-               group_name=None):
+               group_name=None, max_concurrency=None):
         # Pylint thinks this function has too many local variables
         # pylint: disable=R0914,R0912
         """
         Provisions a complete pipeline.
         Hosts are spun up in sequential groups, where each group spins up in parallel.
 
+        At most max_concurrency hostclasses of a group are provisioned at the same time, defaulting to
+        the provision_concurrency option of the disco_aws section.
+
+        If any entry has a depends_on value (a space separated list of hostclasses) the sequence
+        numbers are ignored and every hostclass is spun up as soon as the hostclasses it depends on
+        have been provisioned and, where smoke testing is requested, have passed their smoke tests.
+
         The pipeline should be defined in this format:
         hostclass_dicts = [
             { "sequence": 1,
               "hostclass": "mhcdiscosomething",
+              "depends_on": None,
               "desired_size": 1,
               "instance_type": "m1.large",
               "extra_space": None,
@@ -637,15 +724,25 @@ class DiscoAWS(object):
 
         # If AMI specified lookup hostclass from AMI else lookup AMI from hostclass
         stage = stage if stage else self.vpc.ami_stage()
-        bake = DiscoBake(self._config, self.connection)
+        bake = DiscoBake(self._config, self._connection, describe_cache=self.describe_cache)
+        # Listing all images once is cheaper than listing the images of each hostclass on its own
+        index = bake.ami_index() if len(hostclass_dicts) > 1 else None
         for entry in hostclass_dicts:
-            entry["ami_obj"] = bake.find_ami(stage, entry.get("hostclass"), entry.get("ami"))
+            entry["ami_obj"] = bake.find_ami(stage, entry.get("hostclass"), entry.get("ami"), index=index)
             if not entry["ami_obj"]:
                 raise AMIError(
                     "Couldn't find AMI {0} for hostclass {1}, aborting spinup.".format(
                         entry.get("ami"), entry.get("hostclass")))
             entry["hostclass"] = DiscoBake.ami_hostclass(entry["ami_obj"])
 
+        # Wait for the AMIs that aren't available yet all at once rather than in each provision
+        pending_amis = {entry["ami_obj"].id: entry["ami_obj"] for entry in hostclass_dicts
+                        if entry["ami_obj"].state != u'available'}
+        if pending_amis:
+            BatchWaiter(self.connection, "image", timeout=600).wait(pending_amis.keys(), u'available')
+            for ami in pending_amis.values():
+                ami.state = u'available'
+
         # determine which subset of hostclasses will need smoke testing
         flammable = set([]) if no_smoke else set(
             [
@@ -655,55 +752,279 @@ class DiscoAWS(object):
             ]
         )
 
+        max_concurrency = int(max_concurrency or self.config("provision_concurrency",
+                                                             default=PROVISION_CONCURRENCY))
+
+        if any(hdict.get("depends_on") for hdict in hostclass_dicts):
+            self._spinup_dependency_graph(
+                hostclass_dicts, flammable,
+                max_concurrency=max_concurrency,
+                testing=testing,
+                create_if_exists=create_if_exists,
+                group_name=group_name)
+            return
+
         # group by sequence number and run groups sequentially
         groups = set([int(hdict["sequence"]) for hdict in hostclass_dicts])
         for group in sorted(list(groups)):
-            hostclass_iter = (
-                (hdict["hostclass"], hdict.get("termination_policies"), hdict)
-                for hdict in hostclass_dicts
-                if int(hdict["sequence"]) == group
-            )
-
             # spinup all hostclasses within the same group in parallel
-            metadata = [
-                self.provision(
-                    ami=hdict["ami_obj"],
-                    hostclass=hostclass,
-                    instance_type=hdict.get("instance_type") or self.get_instance_type(hdict["hostclass"]),
-                    extra_space=int(hdict["extra_space"]) if hdict.get("extra_space") else None,
-                    extra_disk=int(hdict["extra_disk"]) if hdict.get("extra_disk") else None,
-                    iops=int(hdict["iops"]) if hdict.get("iops") else None,
-                    min_size=hdict.get("min_size"), max_size=hdict.get("max_size"),
-                    desired_size=hdict.get("desired_size"), testing=testing,
-                    termination_policies=termination_policies.split() if termination_policies else None,
-                    chaos=hdict.get("chaos"),
-                    create_if_exists=create_if_exists,
-                    group_name=group_name)
-                for (hostclass, termination_policies, hdict) in hostclass_iter]
-
-            self.smoketest(self.wait_for_autoscaling_instances(
-                [_hc for _hc in metadata if _hc["hostclass"] in flammable]))
+            metadata = self._provision_sequence_group(
+                [hdict for hdict in hostclass_dicts if int(hdict["sequence"]) == group],
+                max_concurrency=max_concurrency,
+                testing=testing,
+                create_if_exists=create_if_exists,
+                group_name=group_name)
+
+            # smoke test each autoscaling group as soon as it has scaled up
+            for _, instances in self.iter_autoscaling_instances(
+                    [_hc for _hc in metadata if _hc["hostclass"] in flammable]):
+                self.smoketest(instances)
+
+    def _provision_hostclass_dict(self, hdict, testing=False, create_if_exists=False, group_name=None):
+        """Provisions a single pipeline entry"""
+        termination_policies = hdict.get("termination_policies")
+        return self.provision(
+            ami=hdict["ami_obj"],
+            hostclass=hdict["hostclass"],
+            instance_type=hdict.get("instance_type") or self.get_instance_type(hdict["hostclass"]),
+            extra_space=int(hdict["extra_space"]) if hdict.get("extra_space") else None,
+            extra_disk=int(hdict["extra_disk"]) if hdict.get("extra_disk") else None,
+            iops=int(hdict["iops"]) if hdict.get("iops") else None,
+            min_size=hdict.get("min_size"), max_size=hdict.get("max_size"),
+            desired_size=hdict.get("desired_size"), testing=testing,
+            termination_policies=termination_policies.split() if termination_policies else None,
+            chaos=hdict.get("chaos"),
+            create_if_exists=create_if_exists,
+            group_name=group_name)
+
+    def _provision_sequence_group(self, hostclass_dicts, max_concurrency=PROVISION_CONCURRENCY, **kwargs):
+        """
+        Provisions the pipeline entries of one sequence group, at most max_concurrency at a time.
+        Returns the provision metadata of each entry.
+
+        Failures are collected rather than aborting the other entries. If any entry fails, what was
+        provisioned for the rest of the sequence group is rolled back, see _roll_back_provisioned, and
+        a ProvisioningError describing every failure is raised.
+        """
+        if len(hostclass_dicts) == 1:
+            return [self._provision_hostclass_dict(hostclass_dicts[0], **kwargs)]
+
+        pre_existing_groups = set([group.name for group in self.autoscale.get_existing_groups()])
+
+        def _provision(hdict):
+            try:
+                return hdict, self._provision_hostclass_dict(hdict, **kwargs), None
+            except Exception as err:
+                logger.exception("Failed to provision hostclass %s", hdict["hostclass"])
+                return hdict, None, err
+
+        workers = min(max_concurrency, len(hostclass_dicts))
+        if workers > 1:
+            # Create the lazily initialized helpers up front so the worker threads share one of each,
+            # the helpers get a boto2 connection of each thread's own from the client registry
+            _ = (self.vpc, self.autoscale, self.elb, self.alarms, self.log_metrics, self.disco_storage)
+            pool = ThreadPool(processes=workers)
+            try:
+                results = pool.map(_provision, hostclass_dicts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_provision(hdict) for hdict in hostclass_dicts]
+
+        failures = [(hdict, error) for hdict, _, error in results if error]
+        metadata = [meta for _, meta, error in results if not error]
+        if failures:
+            self._roll_back_provisioned(metadata, pre_existing_groups, testing=kwargs.get("testing", False))
+            raise ProvisioningError(
+                "Failed to provision {0}: {1}".format(
+                    ", ".join([hdict["hostclass"] for hdict, _ in failures]),
+                    "; ".join(["{0}: {1}".format(hdict["hostclass"], error) for hdict, error in failures])))
+
+        return metadata
+
+    def _roll_back_provisioned(self, metadata_list, pre_existing_groups, testing=False):
+        """
+        Deletes what provisioning created for the hostclasses of metadata_list, after a failed spinup.
+
+        The autoscaling groups that aren't in pre_existing_groups are deleted. Their launch configurations
+        aren't deleted here, DiscoAutoscale.delete_groups deletes the ones no other group uses along with
+        each group (see DiscoAutoscale._delete_config_if_unused). Hostclasses that had no autoscaling
+        group before are new to the environment, so their ELB, alarms and log groups, with their metric
+        filters, are deleted too. Hostclasses that already had a group keep those, since that group still
+        uses them. Failing to delete something is logged and doesn't stop the rest of the rollback.
+        """
+        pre_existing_hostclasses = set([self.autoscale.get_hostclass(name) for name in pre_existing_groups])
+        new_hostclasses = sorted(
+            set([meta["hostclass"] for meta in metadata_list]) - pre_existing_hostclasses)
+
+        for meta in metadata_list:
+            if meta["group_name"] not in pre_existing_groups:
+                logger.warning("Rolling back autoscaling group %s of hostclass %s",
+                               meta["group_name"], meta["hostclass"])
+                try:
+                    self.autoscale.delete_groups(group_name=meta["group_name"], force=True)
+                except Exception:
+                    logger.exception("Failed to roll back autoscaling group %s", meta["group_name"])
+
+        if not new_hostclasses:
+            return
+        logger.warning("Rolling back ELBs, alarms and log groups of %s", ", ".join(new_hostclasses))
+        rollbacks = [lambda: self.elb.delete_elbs(new_hostclasses, testing=testing),
+                     lambda: self.log_metrics.delete_hostclasses_log_groups(new_hostclasses)]
+        if not testing:
+            # Alarms are only created for hostclasses that aren't provisioned for testing
+            rollbacks.append(
+                lambda: self.alarms.delete_hostclasses_environment_alarms(self.environment_name,
+                                                                          new_hostclasses))
+        for rollback in rollbacks:
+            try:
+                rollback()
+            except Exception:
+                logger.exception("Failed to roll back %s", ", ".join(new_hostclasses))
 
     @staticmethod
-    def _instance_count_lt_min_size(group, all_instances):
-        group_instances = [_i for _i in all_instances if _i.group_name == group.name]
-        return len(group_instances) < group.min_size
+    def _pipeline_dependencies(hostclass_dicts):
+        """
+        Returns a dict mapping each hostclass of the pipeline to the set of hostclasses it depends on.
+        Raises ProvisioningError if a dependency is not part of the pipeline or the dependencies form a cycle.
+        """
+        dependencies = {
+            hdict["hostclass"]: set((hdict.get("depends_on") or "").split())
+            for hdict in hostclass_dicts
+        }
 
-    def wait_for_autoscaling_instances(self, metadata_list, timeout=AUTOSCALE_TIMEOUT):
+        for hostclass, depends_on in dependencies.iteritems():
+            unknown = depends_on - set(dependencies.keys())
+            if unknown:
+                raise ProvisioningError(
+                    "Hostclass {0} depends on {1} which are not in the pipeline".format(
+                        hostclass, " ".join(sorted(unknown))))
+
+        resolved = set()
+        unresolved = set(dependencies.keys())
+        while unresolved:
+            ready = set([hostclass for hostclass in unresolved if dependencies[hostclass] <= resolved])
+            if not ready:
+                raise ProvisioningError(
+                    "Pipeline dependencies form a cycle between {0}".format(" ".join(sorted(unresolved))))
+            resolved |= ready
+            unresolved -= ready
+
+        return dependencies
+
+    def _spinup_dependency_graph(self, hostclass_dicts, flammable, max_concurrency=PROVISION_CONCURRENCY,
+                                 **kwargs):
+        # pylint: disable=R0914
         """
-        Wait for autoscaling groups to spinup, returns instance id's of spun up machines
+        Spins up the pipeline entries in dependency order, at most max_concurrency at a time.
+
+        Each hostclass is provisioned as soon as all the hostclasses it depends on are healthy. A
+        hostclass is healthy once it has been provisioned and, if it is in flammable, its autoscaling
+        group has reached min_size and its instances have passed smoke tests.
+
+        After the first failure no new hostclasses are started. Once the ones already started have
+        finished, everything provisioned by this spinup is rolled back like a failed sequence group,
+        see _roll_back_provisioned, and a ProvisioningError listing the failed and never started
+        hostclasses is raised.
+        """
+        dependencies = DiscoAWS._pipeline_dependencies(hostclass_dicts)
+        hostclass_to_dict = {hdict["hostclass"]: hdict for hdict in hostclass_dicts}
+        pre_existing_groups = set([group.name for group in self.autoscale.get_existing_groups()])
+        finished = Queue()
+
+        def _spinup_node(hostclass):
+            metadata = None
+            try:
+                metadata = self._provision_hostclass_dict(hostclass_to_dict[hostclass], **kwargs)
+                if hostclass in flammable:
+                    self.smoketest(self.wait_for_autoscaling_instances([metadata]))
+                finished.put((hostclass, metadata, None))
+            except Exception as err:
+                logger.exception("Failed to spin up hostclass %s", hostclass)
+                finished.put((hostclass, metadata, err))
+
+        # Create the lazily initialized helpers up front so the worker threads share one of each,
+        # the helpers get a boto2 connection of each thread's own from the client registry
+        _ = (self.vpc, self.autoscale, self.elb, self.alarms, self.log_metrics, self.disco_storage)
+
+        pending = set(hostclass_to_dict.keys())
+        running = set()
+        healthy = set()
+        failures = {}
+        provisioned = []
+        pool = ThreadPool(processes=max(1, min(max_concurrency, len(pending))))
+        try:
+            while True:
+                if not failures:
+                    ready = sorted([hostclass for hostclass in pending if dependencies[hostclass] <= healthy])
+                    for hostclass in ready:
+                        logger.info("Starting spinup of %s", hostclass)
+                        pending.remove(hostclass)
+                        running.add(hostclass)
+                        pool.apply_async(_spinup_node, (hostclass,))
+                if not running:
+                    break
+                hostclass, metadata, error = DiscoAWS._next_finished(finished)
+                running.remove(hostclass)
+                if metadata:
+                    provisioned.append(metadata)
+                if error:
+                    failures[hostclass] = error
+                else:
+                    healthy.add(hostclass)
+        finally:
+            pool.close()
+            pool.join()
+
+        if failures:
+            self._roll_back_provisioned(provisioned, pre_existing_groups,
+                                        testing=kwargs.get("testing", False))
+            raise ProvisioningError(
+                "Failed to spin up {0}: {1}. Not started: {2}".format(
+                    ", ".join(sorted(failures.keys())),
+                    "; ".join(["{0}: {1}".format(hostclass, failures[hostclass])
+                               for hostclass in sorted(failures.keys())]),
+                    ", ".join(sorted(pending)) or "none"))
+
+    @staticmethod
+    def _next_finished(finished):
+        """
+        Returns the next item of a queue. Waits with a timeout, since under Python 2 a thread blocked
+        in Queue.get without one doesn't see KeyboardInterrupt.
+        """
+        while True:
+            try:
+                return finished.get(timeout=SPINUP_POLL_INTERVAL)
+            except Empty:
+                pass
+
+    @staticmethod
+    def _group_reached_min_size(group):
+        return len(group.instances or []) >= group.min_size
+
+    def iter_autoscaling_instances(self, metadata_list, timeout=AUTOSCALE_TIMEOUT):
+        """
+        Waits for autoscaling groups to spinup, yielding the name and the instances of each group as
+        soon as the group reaches its min_size, so that callers can get to work on the groups that are
+        ready while the others are still scaling. Time spent by the caller between groups doesn't
+        count towards the timeout. Raises TimeoutError for the groups that don't reach their min_size.
+
+        Each poll describes just the groups still being waited for, which includes their instances.
         """
         start_time = time.time()
         max_time = start_time + timeout
+        yet_to_scale = set([meta["group_name"] for meta in metadata_list])
 
-        name_to_group = {group.name: group for group in self.autoscale.get_existing_groups()}
-        yet_to_scale = group_names = set([meta["group_name"] for meta in metadata_list])
-
-        while True:
-            auto_instances = self.autoscale.get_instances()
+        while yet_to_scale:
             logger.debug("yet_to_scale: %s", yet_to_scale)
-            yet_to_scale = [gname for gname in yet_to_scale
-                            if DiscoAWS._instance_count_lt_min_size(name_to_group[gname], auto_instances)]
+            for group in self.autoscale.get_groups(sorted(yet_to_scale)):
+                if group.name in yet_to_scale and DiscoAWS._group_reached_min_size(group):
+                    yet_to_scale.remove(group.name)
+                    instance_ids = [instance.instance_id for instance in group.instances or []]
+                    yield_time = time.time()
+                    yield group.name, self.instances(instance_ids=instance_ids) if instance_ids else []
+                    max_time += time.time() - yield_time
             if not yet_to_scale or (time.time() >= max_time):
                 break
             logger.info("Waiting for %s autoscaling groups to reach min_size", len(yet_to_scale))
@@ -712,16 +1033,19 @@ class DiscoAWS(object):
         if yet_to_scale:
             raise TimeoutError(
                 "Timed out waiting for {0} to reach autoscale min_size after {1}s."
-                .format(" ".join([gname for gname in yet_to_scale]), timeout))
+                .format(" ".join(sorted(yet_to_scale)), timeout))
 
         if metadata_list:
             logger.info("Waited for %s autoscaling groups to reach min_size in %s seconds",
                         len(metadata_list), int(0.5 + time.time() - start_time))
 
-        instance_ids = [instance.instance_id for instance in auto_instances
-                        if instance.group_name in group_names]
-
-        return self.instances(instance_ids=instance_ids) if instance_ids else []
+    def wait_for_autoscaling_instances(self, metadata_list, timeout=AUTOSCALE_TIMEOUT):
+        """
+        Wait for autoscaling groups to spinup, returns the instances of the spun up groups
+        """
+        return [instance
+                for _, instances in self.iter_autoscaling_instances(metadata_list, timeout=timeout)
+                for instance in instances]
 
     def wait_for_autoscaling(self, ami_id, min_count, timeout=AUTOSCALE_TIMEOUT):
         """
@@ -742,10 +1066,34 @@ class DiscoAWS(object):
             "Timed out waiting for {} {} to hosts to spin up after {}s."
             .format(min_count, ami_id, timeout))
 
+    def describe_instances_by_id(self, instance_ids):
+        """
+        Returns the current state of instances as a dict of instance objects keyed by id.
+
+        This makes one DescribeInstances call per DESCRIBE_INSTANCES_MAX_IDS instances. The ids are
+        passed as an instance-id filter so that instances AWS doesn't know about yet are left out of
+        the result instead of failing the whole call.
+        """
+        instances = {}
+        for index in range(0, len(instance_ids), DESCRIBE_INSTANCES_MAX_IDS):
+            reservations = throttled_call(
+                self.connection.get_all_instances,
+                filters={"instance-id": instance_ids[index:index + DESCRIBE_INSTANCES_MAX_IDS]}
+            )
+            instances.update({
+                instance.id: instance
+                for reservation in reservations
+                for instance in reservation.instances
+            })
+        return instances
+
     def smoketest(self, instance_list, timeout=SMOKETEST_TIMEOUT):
         """
         Repeatedly smoketests instances in list until they all pass.
         raises TimeoutError if all hosts do not pass by timeout seconds
+
+        Each round refreshes all instances still to pass with batched describe calls
+        rather than updating every instance on its own.
         """
         yet_to_pass = instance_list
         start_time = time.time()
@@ -754,10 +1102,17 @@ class DiscoAWS(object):
         while True:
             smokey = []
             logger.debug("yet_to_pass: %s", yet_to_pass)
+            current_instances = self.describe_instances_by_id([instance.id for instance in yet_to_pass])
             for instance in yet_to_pass:
-                try:
-                    self.smoketest_once(instance)
-                except TimeoutError:
+                current_instance = current_instances.get(instance.id)
+                if not current_instance:
+                    logger.debug("AWS doesn't think %s exists yet", instance.id)
+                    smokey.append(instance)
+                elif current_instance.state in (u'failed', u'terminated'):
+                    raise SmokeTestError(
+                        "Terminal smoketest error, {0} is in terminal state {1}."
+                        .format(current_instance, current_instance.state))
+                elif not current_instance.tags.get("smoketest"):
                     smokey.append(instance)
             yet_to_pass = smokey
             if not yet_to_pass or (time.time() >= max_time):
@@ -836,7 +1191,7 @@ class DiscoAWS(object):
             logger.warning("No running instances with sufficient uptime, to promote AMIs.")
             return
 
-        disco_bake = DiscoBake()
+        disco_bake = DiscoBake(self._config, self._connection, describe_cache=self.describe_cache)
         amis = disco_bake.get_amis(long_running_ami_ids)
         for ami in amis:
             logger.debug("ami: %s", ami.id)
@@ -7,8 +7,11 @@ from subprocess import check_output
 import datetime
 import logging
 import getpass
+import itertools
 import re
+import threading
 import time
+from multiprocessing.pool import ThreadPool
 from os import path
 
 import boto
@@ -18,7 +21,10 @@ import dateutil.parser
 from pytz import UTC
 
 from . import normalize_path, read_config
-from .resource_helper import wait_for_sshable, keep_trying, wait_for_state
+from .client_registry import get_boto2_connection
+from .config_index import get_config_index
+from .resource_helper import wait_for_sshable, keep_trying, BatchWaiter
+from .describe_cache import DescribeCache
 from .disco_storage import DiscoStorage
 from .disco_remote_exec import DiscoRemoteExec, SSH_DEFAULT_OPTIONS
 from .disco_vpc import DiscoVPC
@@ -30,23 +36,88 @@ logger = logging.getLogger(__name__)
 
 AMI_NAME_PATTERN = re.compile(r"^\w+\s(?:[0-9]+\s)?[0-9]{10,50}")
 AMI_TAG_LIMIT = 10
+BAKE_CONCURRENCY = 4  # hostclasses baked at the same time by bake_amis
+BAKE_LOG_FORMAT = '%(asctime)s %(name)s %(levelname)s %(message)s'
+
+
+class _ThreadLogFilter(logging.Filter):
+    """Passes only the log records of one thread"""
+
+    def __init__(self, thread_id):
+        logging.Filter.__init__(self)
+        self.thread_id = thread_id
+
+    def filter(self, record):
+        return record.thread == self.thread_id
+
+
+class AmiIndex(object):
+    """
+    In memory index of images, built from a single listing of all of them, that finds the images of
+    a hostclass with a given stage and productline, oldest first, without further AWS calls.
+    """
+
+    def __init__(self, amis):
+        self._by_id = {}
+        self._positions = {}  # id() of each image -> its position in the listing
+        self._by_key = defaultdict(list)  # (hostclass, stage, productline), each may be None -> amis
+        for position, ami in enumerate(amis):
+            self._by_id[ami.id] = ami
+            self._positions[id(ami)] = position
+            hostclass = DiscoBake.ami_hostclass(ami) if ami.name else None
+            stage = ami.tags.get("stage")
+            product_line = ami.tags.get("productline")
+            # None stands for any hostclass, stage or productline, so every image is also indexed
+            # under those keys
+            for key in set(itertools.product((hostclass, None), (stage, None), (product_line, None))):
+                self._by_key[key].append(ami)
+        for indexed_amis in self._by_key.itervalues():
+            indexed_amis.sort(key=DiscoBake.ami_timestamp)
+
+    def get(self, ami_id):
+        """Returns the image with an id, or None if it wasn't listed"""
+        return self._by_id.get(ami_id)
+
+    def hostclasses(self):
+        """Returns the set of hostclasses that have images"""
+        return set(key[0] for key in self._by_key if key[0])
+
+    def find(self, hostclass, stage=None, product_line=None):
+        """Returns the images of a hostclass, only those of a stage and productline if given, oldest first"""
+        return list(self._by_key.get((hostclass, stage or None, product_line or None), []))
+
+    def latest(self, hostclass, stage=None, product_line=None):
+        """Returns the newest image of a hostclass with a stage and productline, None if there is none"""
+        amis = self._by_key.get((hostclass, stage or None, product_line or None))
+        return amis[-1] if amis else None
+
+    def select(self, hostclass=None, stage=None, product_line=None, state=None):
+        """
+        Returns the images of a hostclass, stage, productline and state, each of which matches any
+        value if not given, in the order they were listed in
+        """
+        amis = self._by_key.get((hostclass or None, stage or None, product_line or None), [])
+        return sorted([ami for ami in amis if not state or ami.state == state],
+                      key=lambda ami: self._positions[id(ami)])
 
 
 class DiscoBake(object):
     """Class orchestrating baking in AWS"""
 
-    def __init__(self, config=None, connection=None, use_local_ip=False):
+    def __init__(self, config=None, connection=None, use_local_ip=False, describe_cache=None):
         """
         :param config: Configuration object to use.
         :param connection: Boto ec2 connection to use.
         :param use_local_ip: Use local ip of instances for remote exec instead of public.
+        :param describe_cache: DescribeCache to share with other objects, a new one is made if None.
         """
         if config:
             self._config = config
         else:
             self._config = read_config()
 
-        self.connection = connection or boto.connect_ec2()
+        self._connection = connection
+        self.describe_cache = describe_cache or DescribeCache()
 
         self.disco_storage = DiscoStorage(self.connection)
 
@@ -58,6 +129,11 @@ class DiscoBake(object):
         self._use_local_ip = use_local_ip
         self._final_stage = None
 
+    @property
+    def connection(self):
+        """The boto2 ec2 connection passed in, or else the calling thread's own one"""
+        return self._connection or get_boto2_connection('ec2')
+
     @property
     def vpc(self):
         """Bake VPC"""
@@ -123,12 +199,8 @@ class DiscoBake(object):
         otherwise it returns that value from the [bake] section if it is set,
         otherwise it returns that value from the DEFAULT_CONFIG_SECTION if it is set.
         '''
-        if self._config.has_option(hostclass, key):
-            return self._config.get(hostclass, key)
-        elif self._config.has_option("bake", key):
-            return self.option(key)
-        else:
-            return self._config.get(DEFAULT_CONFIG_SECTION, "default_{0}".format(key))
+        return get_config_index(self._config).lookup(
+            [(hostclass, key), ("bake", key), (DEFAULT_CONFIG_SECTION, "default_{0}".format(key))])
 
     def hc_option_default(self, hostclass, key, default=None):
         """Fetch a hostclass configuration option if it exists, otherwise return value passed in as default"""
@@ -264,6 +336,7 @@ class DiscoBake(object):
         if stage not in self.ami_stages():
             raise AMIError("Unknown ami stage: {0}, check config option 'ami_stage'".format(stage))
         self._tag_ami(ami, {"stage": stage})
+        self.describe_cache.invalidate("images")
 
     def get_image(self, ami_id):
         """
@@ -325,7 +398,7 @@ class DiscoBake(object):
                     user
                 )
 
-    def bake_ami(self, hostclass, no_destroy, source_ami_id=None, stage=None):
+    def bake_ami(self, hostclass, no_destroy, source_ami_id=None, stage=None, check_repo=True):
         # Pylint thinks this function has too many local variables and too many statements and branches
         # pylint: disable=R0914, R0915, R0912
         """
@@ -336,6 +409,7 @@ class DiscoBake(object):
         a hostclass by specifying an explicit phase.
 
         If no_destroy is True then the instance used to perform baking is not terminated at the end.
+        If check_repo is False the caller has already made sure that the repo is running.
         """
         config_path = normalize_path(self.option("config_data_source") + "/discoroot")
         if not path.exists(config_path):
@@ -360,7 +434,8 @@ class DiscoBake(object):
 
         image_name = "{0} {1}".format(base_image_name, int(time.time()))
 
-        if hostclass not in self.option("no_repo_hostclasses").split() and not self.is_repo_ready():
+        if check_repo and hostclass not in self.option("no_repo_hostclasses").split() \
+                and not self.is_repo_ready():
             raise Exception("A {0} must be running to bake {1}"
                             .format(self.option("repo_hostclass"), hostclass))
 
@@ -395,7 +470,7 @@ class DiscoBake(object):
             # sure the snapshot is of a clean filesystem that won't trigger fsck on start.
             # We use nothrow to ignore ssh's 255 exit code on shutdown of centos7
             self.remotecmd(instance, ["rm -Rf /root/.ssh/authorized_keys ; shutdown now -h"], nothrow=True)
-            wait_for_state(instance, u'stopped', 300)
+            BatchWaiter(self.connection, "instance", timeout=300).wait([instance.id], u'stopped')
             logger.info("Creating snapshot from instance")
 
             # Check whether or not enhanced networking should be enabled for this hostclass
@@ -416,8 +491,11 @@ class DiscoBake(object):
 
             DiscoBake._tag_ami_with_metadata(image, stage, source_ami_id, productline)
 
-            wait_for_state(image, u'available',
-                           int(self.hc_option_default(hostclass, "ami_available_wait_time", "600")))
+            BatchWaiter(
+                self.connection, "image",
+                timeout=int(self.hc_option_default(hostclass, "ami_available_wait_time", "600"))
+            ).wait([image_id], u'available')
+            self.describe_cache.invalidate("images")
             logger.info("Created %s AMI %s", image_name, image_id)
         except EarlyExitException as early_exit:
             logger.info(str(early_exit))
@@ -434,6 +512,92 @@ class DiscoBake(object):
 
         return image
 
+    def _bake_logged(self, hostclass, log_dir, *args, **kwargs):
+        """Calls bake_ami, also writing the log messages of this thread to log_dir/<hostclass>.log"""
+        handler = None
+        if log_dir:
+            handler = logging.FileHandler(path.join(log_dir, "{0}.log".format(hostclass)))
+            handler.setFormatter(logging.Formatter(BAKE_LOG_FORMAT))
+            handler.addFilter(_ThreadLogFilter(threading.current_thread().ident))
+            logging.getLogger().addHandler(handler)
+        try:
+            return self.bake_ami(hostclass, *args, **kwargs)
+        except Exception:
+            logger.exception("Baking %s failed", hostclass)
+            raise
+        finally:
+            if handler:
+                logging.getLogger().removeHandler(handler)
+                handler.close()
+
+    def bake_amis(self, hostclasses, no_destroy=False, source_ami_id=None, stage=None,
+                  max_concurrency=BAKE_CONCURRENCY, log_dir=None):
+        # Pylint thinks this function has too many local variables
+        # pylint: disable=R0914
+        """
+        Bakes the AMIs of several hostclasses like bake_ami, at most max_concurrency at the same time.
+
+        The phase 1 AMI of every phase 2 hostclass is looked up before any bake starts, so all of them
+        are baked from the same phase 1 AMI even if a new one shows up meanwhile, and whether the repo
+        is running is only checked once. If log_dir is given, the log messages of each bake are also
+        written to log_dir/<hostclass>.log.
+
+        A failed bake doesn't stop the others. Returns a list of dicts with the hostclass, ami (None if
+        no AMI was created, which is always the case with no_destroy) and error (None if the bake
+        didn't fail) of each hostclass, in order.
+        """
+        no_repo_hostclasses = self.option("no_repo_hostclasses").split()
+        repo_ready = None
+        bakes = []  # (hostclass, source AMI id, error that prevents baking)
+        for hostclass in hostclasses:
+            try:
+                phase = int(self.hc_option(hostclass, "phase"))
+                bake_hostclass = hostclass if phase != 1 else self.option("phase1_hostclass")
+                if bake_hostclass not in no_repo_hostclasses:
+                    repo_ready = self.is_repo_ready() if repo_ready is None else repo_ready
+                    if not repo_ready:
+                        raise Exception("A {0} must be running to bake {1}"
+                                        .format(self.option("repo_hostclass"), hostclass))
+                source = source_ami_id or (self._get_phase1_ami_id(hostclass) if phase != 1 else None)
+                bakes.append((hostclass, source, None))
+            except Exception as err:
+                logger.error("Unable to bake %s: %s", hostclass, err)
+                bakes.append((hostclass, None, err))
+
+        def _bake(bake):
+            hostclass, source, error = bake
+            if error:
+                return {"hostclass": hostclass, "ami": None, "error": error}
+            try:
+                image = self._bake_logged(hostclass, log_dir, no_destroy, source_ami_id=source, stage=stage,
+                                          check_repo=False)
+                return {"hostclass": hostclass, "ami": image.id if image else None, "error": None}
+            except Exception as err:
+                return {"hostclass": hostclass, "ami": None, "error": err}
+
+        workers = min(max_concurrency, len([bake for bake in bakes if not bake[2]]))
+        if workers > 1:
+            # Create the lazily initialized helpers up front so the worker threads share one of each
+            _ = (self.vpc, self.disco_remote_exec)
+            pool = ThreadPool(processes=workers)
+            try:
+                results = pool.map(_bake, bakes, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_bake(bake) for bake in bakes]
+
+        for result in results:
+            if result["error"]:
+                outcome = "failed: {0}".format(result["error"])
+            elif result["ami"]:
+                outcome = "created {0}".format(result["ami"])
+            else:
+                outcome = "did not create an AMI"
+            logger.info("Bake of %s %s", result["hostclass"], outcome)
+        return results
+
     @staticmethod
     def _tag_ami_with_metadata(ami, stage, source_ami_id, productline=None):
         """
@@ -481,13 +645,38 @@ class DiscoBake(object):
             amis, key=DiscoBake._ami_sort_key, reverse=True)
         return set(amis_sorted_by_creation_time_desc[max_count:])
 
-    def get_amis(self, image_ids=None, filters=None):
+    def get_amis(self, image_ids=None, filters=None, skip_missing=False):
         """
         Returns images owned by a trusted account (including ourselves)
+
+        If skip_missing is set, image ids that don't exist anymore are left out rather than failing
+        the whole lookup with InvalidAMIID.NotFound.
         """
+        if skip_missing and image_ids:
+            try:
+                return self.get_amis(image_ids, filters)
+            except boto.exception.EC2ResponseError as err:
+                if err.code != "InvalidAMIID.NotFound":
+                    raise
+            if len(image_ids) == 1:
+                logger.warning("Unable to find AMI %s, it was probably deleted", image_ids[0])
+                return []
+            # Some image was deregistered, look up each one on its own to skip it
+            return [ami for image_id in image_ids
+                    for ami in self.get_amis([image_id], filters, skip_missing=True)]
         trusted_accounts = list(set(self.option_default("trusted_account_ids", "").split()) | set(['self']))
-        return self.connection.get_all_images(
-            image_ids=image_ids, owners=trusted_accounts, filters=filters)
+        return list(self.describe_cache.get(
+            "images",
+            lambda: self.connection.get_all_images(
+                image_ids=image_ids, owners=trusted_accounts, filters=filters),
+            image_ids=image_ids, owners=sorted(trusted_accounts), filters=filters))
+
+    def ami_index(self):
+        """
+        Returns an AmiIndex of the images get_amis returns, which is cached and invalidated along
+        with the images themselves
+        """
+        return self.describe_cache.get("images", lambda: AmiIndex(self.get_amis()), index=True)
 
     def cleanup_amis(self, restrict_hostclass, product_line, stage, min_age, min_count, dry_run):
         """
@@ -537,6 +726,8 @@ class DiscoBake(object):
                                                 if bdm.snapshot_id])
                     ami.deregister()
 
+                self.describe_cache.invalidate("images")
+
                 # Delete snapshots of all the images we deleted
                 for orphan_snapshot_id in orphan_snapshot_ids:
                     keep_trying(10, self.connection.delete_snapshot, orphan_snapshot_id)
@@ -574,7 +765,8 @@ class DiscoBake(object):
                 ami_ids = list(instance_amis.intersection(ami_ids))
             else:
                 ami_ids = list(instance_amis)
-        return self.ami_filter(self.get_amis(ami_ids), stage, product_line, state, hostclass)
+        amis = self.get_amis(ami_ids) if ami_ids is not None else None
+        return self.ami_filter(amis, stage, product_line, state, hostclass)
 
     def list_stragglers(self, days=1, stage=None):
         """
@@ -588,17 +780,15 @@ class DiscoBake(object):
         Stage   -- Minimum stage to which the AMI should have been promoted.
                    (default 'None', the second stage of promotion)
         """
-        amis = self.get_amis()
-        hostclasses = set([DiscoBake.ami_hostclass(ami) for ami in amis])
+        index = self.ami_index()
         first_stage = self.ami_stages()[0]
         stage = stage or self.ami_stages()[1]
         cutoff_time = int(time.time()) - days * 60 * 60 * 24
         stragglers = dict()
-        for hostclass in hostclasses:
-            latest_promoted = self.find_ami(stage, hostclass)
+        for hostclass in index.hostclasses():
+            latest_promoted = index.latest(hostclass, stage)
             if not latest_promoted or DiscoBake.ami_timestamp(latest_promoted) < cutoff_time:
-                latest = self.find_ami(first_stage, hostclass)
-                stragglers[hostclass] = latest
+                stragglers[hostclass] = index.latest(hostclass, first_stage)
         return stragglers
 
     def delete_ami(self, ami):
@@ -607,6 +797,7 @@ class DiscoBake(object):
         """
         logger.info("Deleting AMI %s", ami)
         self.connection.deregister_image(ami, delete_snapshot=True)
+        self.describe_cache.invalidate("images")
 
     def get_snapshots(self, ami):
         """Returns a snapshot object for an AMI object
@@ -633,6 +824,34 @@ class DiscoBake(object):
         return (DiscoBake.extract_ami_creation_time_from_ami_name(ami) or
                 self.get_ami_creation_time_from_snapshots(ami))
 
+    def get_ami_creation_times(self, amis):
+        """
+        Returns the creation times of AMIs keyed by AMI id, like get_ami_creation_time does for one
+        AMI, but looking up the snapshots of all AMIs without a timestamp in their name at once
+        """
+        creation_times = {ami.id: DiscoBake.extract_ami_creation_time_from_ami_name(ami) for ami in amis}
+        untimed_amis = [ami for ami in amis if not creation_times[ami.id]]
+        snapshot_amis = defaultdict(list)
+        for ami in untimed_amis:
+            for _key, value in ami.block_device_mapping.iteritems():
+                if value.snapshot_id:
+                    snapshot_amis[value.snapshot_id].append(ami.id)
+        if not snapshot_amis:
+            return creation_times
+
+        try:
+            snapshots = self.connection.get_all_snapshots(snapshot_ids=snapshot_amis.keys())
+        except boto.exception.EC2ResponseError:
+            # Some snapshot is gone, fall back to looking up the snapshots of each AMI on its own
+            creation_times.update({ami.id: self.get_ami_creation_time_from_snapshots(ami)
+                                   for ami in untimed_amis})
+            return creation_times
+        for snapshot in snapshots:
+            start_time = dateutil.parser.parse(snapshot.start_time).replace(tzinfo=None)
+            for ami_id in snapshot_amis[snapshot.id]:
+                creation_times[ami_id] = max(creation_times[ami_id] or start_time, start_time)
+        return creation_times
+
     @staticmethod
     def ami_timestamp(ami):
         """Return creation timestamp from ami name, returns 0 if one is not found"""
@@ -659,36 +878,39 @@ class DiscoBake(object):
 
     def ami_filter(self, amis, stage=None, product_line=None, state=None, hostclass=None):
         """
-        Returns a filtered subset of amis. Optionally filtered by their productline,
-        stage, state, and hostclass.
+        Returns a filtered subset of amis, in their order. Optionally filtered by their productline,
+        stage, state, and hostclass. If amis is None the images get_amis returns are filtered,
+        through their cached AmiIndex.
         """
-        filtered_amis = []
-        for ami in amis:
-            filters = [
-                not stage or ami.tags.get("stage", None) == stage,
-                not product_line or ami.tags.get("productline", None) == product_line,
-                not state or ami.state == state,
-                not hostclass or self.ami_hostclass(ami) == hostclass]
-            if all(filters):
-                filtered_amis.append(ami)
-        return filtered_amis
+        index = self.ami_index() if amis is None else AmiIndex(amis)
+        return index.select(hostclass, stage, product_line, state)
 
-    def find_ami(self, stage, hostclass=None, ami_id=None, product_line=None):
+    def find_ami(self, stage, hostclass=None, ami_id=None, product_line=None, index=None):
         """
         Find latest AMI of compatible stage, filtered on AMI's hostclass, id, or product_line
         Note that id overrides stage, product_line, and hostclass options.
+
+        Callers that look up the AMIs of many hostclasses should pass the AmiIndex from ami_index,
+        which costs a single listing of all images, otherwise each lookup lists just the images
+        needed.
         """
 
         if ami_id:
+            ami = index.get(ami_id) if index else None
+            if ami:
+                return ami
+            # Images registered since the index was built are looked up on their own
             amis = self.get_amis([ami_id])
             return amis[0] if amis else None
         elif hostclass:
-            filters = {}
-            filters["name"] = "{0} *".format(hostclass)
-            amis = self.get_amis(filters=filters)
-            logger.debug("AMI search for %s found %s", filters, amis)
-            amis = self.ami_filter(amis, stage, product_line)
-            return max(amis, key=self.ami_timestamp) if amis else None
+            if index:
+                ami = index.latest(hostclass, stage, product_line)
+            else:
+                amis = self.ami_filter(self.get_amis(filters={"name": "{0} *".format(hostclass)}),
+                                       stage, product_line, hostclass=hostclass)
+                ami = max(amis, key=self.ami_timestamp) if amis else None
+            logger.debug("AMI search for %s %s %s found %s", hostclass, stage, product_line, ami)
+            return ami
         else:
             raise ValueError("Must specify either hostclass or AMI")
 
@@ -8,6 +8,8 @@ SMOKETEST_POLL_INTERVAL = 15  # seconds
 SMOKETEST_TIMEOUT = 600
 AUTOSCALE_POLL_INTERVAL = 15  # seconds
 AUTOSCALE_TIMEOUT = 300
+DESCRIBE_INSTANCES_MAX_IDS = 200  # AWS limit on the number of values of a DescribeInstances filter
+PROVISION_CONCURRENCY = 8  # hostclasses of one spinup sequence group provisioned at the same time
 DEPLOYMENT_STRATEGY_BLUE_GREEN = "blue_green"
 DEPLOYMENT_STRATEGY_CLASSIC = "classic"
 
@@ -5,10 +5,10 @@ import logging
 from ConfigParser import ConfigParser
 from StringIO import StringIO
 
-from boto.s3.connection import S3Connection
 from boto.exception import S3ResponseError
 
 from disco_aws_automation.exceptions import S3WritingError
+from .client_registry import get_boto2_connection
 from .resource_helper import check_written_s3
 
 SSH_PRIVATE_KEY_BUCKET_PREFIX = 'private_keys/ssh/'
@@ -29,7 +29,8 @@ class DiscoS3Bucket(object):
     def bucket(self):
         '''Lazily initialized boto.s3.bucket instance'''
         if not self._bucket:
-            connection = S3Connection()  # by default will use access key id and secret from ~/.boto
+            # by default will use access key id and secret from ~/.boto
+            connection = get_boto2_connection('s3')
             self._bucket = connection.get_bucket(self._bucket_name)
             logger.debug("established connection to bucket '%s'", self._bucket_name)
         return self._bucket
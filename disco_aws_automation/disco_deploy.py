@@ -1,9 +1,13 @@
 'Contains DiscoDeploy class'
 
 import copy
+import functools
 import logging
 import random
 import sys
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 from ConfigParser import NoOptionError, NoSectionError
 from boto.exception import EC2ResponseError
@@ -16,6 +20,8 @@ from .exceptions import (
     SmokeTestError,
     TooManyAutoscalingGroups
 )
+from .config_index import get_config_index
+from .deploy_timeline import deploy_phase
 from .disco_aws_util import is_truthy, size_as_minimum_int_or_none, size_as_maximum_int_or_none
 from .disco_constants import (DEFAULT_CONFIG_SECTION, DEPLOYMENT_STRATEGY_BLUE_GREEN,
                               DEPLOYMENT_STRATEGY_CLASSIC)
@@ -28,10 +34,29 @@ def snap_to_range(val, mini, maxi):
     return min(max(int(val), int(mini)), int(maxi))
 
 
+def _timed_phase(name):
+    '''
+    Decorates a DiscoDeploy method whose first argument is an AMI or AMI id so that each call is
+    recorded as a span of the named deploy phase. A True result passes the span, False fails it.
+    '''
+    def _decorator(method):
+        @functools.wraps(method)
+        def _wrapper(self, ami, *args, **kwargs):
+            hostclass = DiscoBake.ami_hostclass(ami) if hasattr(ami, "name") else None
+            with deploy_phase(name, hostclass, getattr(ami, "id", ami)) as span:
+                result = method(self, ami, *args, **kwargs)
+                if result is True or result is False:
+                    span["outcome"] = "passed" if result else "failed"
+                return result
+        return _wrapper
+    return _decorator
+
+
 class DiscoDeploy(object):
     '''DiscoDeploy takes care of testing, promoting and deploying the latests AMIs'''
 
-    # pylint: disable=too-many-arguments
+    # The AMI caches shared by the deploy threads add to the collaborators we take in.
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
     def __init__(self, aws, test_aws, bake, autoscale, elb, pipeline_definition,
                  ami=None, hostclass=None, allow_any_hostclass=False, config=None):
         '''
@@ -56,6 +81,10 @@ class DiscoDeploy(object):
         self._disco_autoscale = autoscale
         self._disco_elb = elb
         self._all_stage_amis = None
+        self._ami_creation_times = {}  # AMI id -> creation time, looked up once per run
+        self._amis_by_id = {}  # AMI id -> AMI, looked up once per run
+        self._cache_lock = threading.RLock()  # guards the caches above across deploy threads
+        self._partitions = {}  # new AMI id -> instance partition reused within a phase
         self._hostclasses = self._get_hostclasses_from_pipeline_definition(pipeline_definition)
         self._allow_any_hostclass = allow_any_hostclass
 
@@ -76,10 +105,28 @@ class DiscoDeploy(object):
     @property
     def all_stage_amis(self):
         '''Returns AMIs filtered on AMI ids, hostclass and state == available'''
-        if not self._all_stage_amis:
-            self._all_stage_amis = [ami for ami in self._filter_amis(
-                self._disco_bake.list_amis(ami_ids=self._restrict_amis)) if ami.state == u'available']
-        return self._all_stage_amis
+        with self._cache_lock:
+            if not self._all_stage_amis:
+                all_stage_amis = [ami for ami in self._filter_amis(
+                    self._disco_bake.list_amis(ami_ids=self._restrict_amis)) if ami.state == u'available']
+                self._index_ami_creation_times(all_stage_amis)
+                self._amis_by_id.update((ami.id, ami) for ami in all_stage_amis)
+                self._all_stage_amis = all_stage_amis
+            return self._all_stage_amis
+
+    def _index_ami_creation_times(self, amis):
+        '''Looks up the creation times of the AMIs that aren't indexed yet, all snapshots at once'''
+        with self._cache_lock:
+            unindexed_amis = [ami for ami in amis if ami.id not in self._ami_creation_times]
+            if unindexed_amis:
+                self._ami_creation_times.update(self._disco_bake.get_ami_creation_times(unindexed_amis))
+
+    def _ami_creation_time(self, ami):
+        '''Returns the creation time of an AMI, looking it up only if it isn't indexed yet'''
+        with self._cache_lock:
+            if ami.id not in self._ami_creation_times:
+                self._ami_creation_times[ami.id] = self._disco_bake.get_ami_creation_time(ami)
+            return self._ami_creation_times[ami.id]
 
     def get_latest_ami_in_stage_dict(self, stage):
         '''Returns latest AMI for each hostclass in a specific stage
@@ -94,13 +141,13 @@ class DiscoDeploy(object):
                 continue
             hostclass = DiscoBake.ami_hostclass(ami)
             old_ami = latest_ami.get(hostclass)
-            new_time = self._disco_bake.get_ami_creation_time(ami)
+            new_time = self._ami_creation_time(ami)
             if not new_time:
                 continue
             if not old_ami:
                 latest_ami[hostclass] = ami
                 continue
-            old_time = self._disco_bake.get_ami_creation_time(old_ami)
+            old_time = self._ami_creation_time(old_ami)
             if old_time and (new_time > old_time):
                 latest_ami[hostclass] = ami
         return latest_ami
@@ -125,8 +172,7 @@ class DiscoDeploy(object):
         '''Returns AMIs from second dict which are newer than the corresponding item in the first dict'''
         return [ami for (hostclass, ami) in second.iteritems()
                 if (first.get(hostclass) is None) or (
-                    self._disco_bake.get_ami_creation_time(ami) >
-                    self._disco_bake.get_ami_creation_time(first[hostclass]))]
+                    self._ami_creation_time(ami) > self._ami_creation_time(first[hostclass]))]
 
     def get_newest_in_either_map(self, first, second):
         '''Returns AMIs which are newest for each hostclass'''
@@ -134,8 +180,7 @@ class DiscoDeploy(object):
         for (hostclass, ami) in second.iteritems():
             if hostclass not in newest_for_hostclass:
                 newest_for_hostclass[hostclass] = ami
-            elif (self._disco_bake.get_ami_creation_time(ami) >
-                  self._disco_bake.get_ami_creation_time(first[hostclass])):
+            elif self._ami_creation_time(ami) > self._ami_creation_time(first[hostclass]):
                 newest_for_hostclass[hostclass] = ami
         return newest_for_hostclass
 
@@ -153,7 +198,8 @@ class DiscoDeploy(object):
         '''Retuns hostclass: ami mapping with latest running AMIs'''
         running_ami_ids = list({instance.image_id for instance in self._disco_aws.instances()})
         running_amis = self._disco_bake.get_amis(running_ami_ids)
-        sorted_amis = sorted(running_amis, key=self._disco_bake.get_ami_creation_time)
+        self._index_ami_creation_times(running_amis)
+        sorted_amis = sorted(running_amis, key=self._ami_creation_time)
         return {DiscoBake.ami_hostclass(ami): ami for ami in sorted_amis}
 
     def get_update_amis(self):
@@ -181,6 +227,7 @@ class DiscoDeploy(object):
         return (hostclass in self._hostclasses and
                 self._hostclasses[hostclass].get("integration_test")) or None
 
+    @_timed_phase("smoketests")
     def wait_for_smoketests(self, ami_id, min_count):
         '''
         Waits for smoketests to complete for an AMI.
@@ -188,20 +235,25 @@ class DiscoDeploy(object):
         Returns True on success, False on failure.
         '''
 
-        try:
-            self._disco_aws.wait_for_autoscaling(ami_id, min_count)
-        except TimeoutError:
-            logger.info("autoscaling timed out")
-            return False
+        with deploy_phase("autoscaling_min_size") as span:
+            try:
+                self._disco_aws.wait_for_autoscaling(ami_id, min_count)
+            except TimeoutError:
+                logger.info("autoscaling timed out")
+                span["outcome"] = "timeout"
+                return False
 
-        try:
-            self._disco_aws.smoketest(self._disco_aws.instances_from_amis([ami_id]))
-        except TimeoutError:
-            logger.info("smoketest timed out")
-            return False
-        except SmokeTestError:
-            logger.info("smoketest instance was terminated")
-            return False
+        with deploy_phase("smoketest") as span:
+            try:
+                self._disco_aws.smoketest(self._disco_aws.instances_from_amis([ami_id]))
+            except TimeoutError:
+                logger.info("smoketest timed out")
+                span["outcome"] = "timeout"
+                return False
+            except SmokeTestError:
+                logger.info("smoketest instance was terminated")
+                span["outcome"] = "failed"
+                return False
 
         return True
 
@@ -227,6 +279,7 @@ class DiscoDeploy(object):
         except:
             logger.exception("promotion failed")
 
+    @_timed_phase("nodeploy_deploy")
     def handle_nodeploy_ami(self, ami, pipeline_dict=None, dry_run=False, old_group=None):
         '''Promotes a non-deployable host and updates the autoscaling group to use it next time
 
@@ -265,7 +318,8 @@ class DiscoDeploy(object):
             ami=ami
         )
 
-        self._disco_aws.spinup([new_hostclass_dict], testing=True)
+        with deploy_phase("asg_creation"):
+            self._disco_aws.spinup([new_hostclass_dict], testing=True)
 
         if self.wait_for_smoketests(ami.id, rollback_hostclass_dict["desired_size"]):
             self._promote_ami(ami, "tested")
@@ -273,26 +327,57 @@ class DiscoDeploy(object):
             self._promote_ami(ami, "failed")
             rollback_hostclass_dict.pop("ami", None)
 
-        if old_group:
-            self._disco_aws.terminate(self._get_new_instances(ami.id), use_autoscaling=True)
-            self._disco_aws.spinup([rollback_hostclass_dict])
-            # Create scheduled actions on the ASG.
-            self._create_scaling_schedule(pipeline_dict, hostclass=hostclass)
-        else:
-            self._disco_autoscale.delete_groups(hostclass=hostclass, force=True)
+        with deploy_phase("testing_instances_teardown"):
+            if old_group:
+                self._disco_aws.terminate(self._get_new_instances(ami.id), use_autoscaling=True)
+                self._disco_aws.spinup([rollback_hostclass_dict])
+                # Create scheduled actions on the ASG.
+                self._create_scaling_schedule(pipeline_dict, hostclass=hostclass)
+            else:
+                self._disco_autoscale.delete_groups(hostclass=hostclass, force=True)
+
+    def _get_image(self, ami_id):
+        '''Returns the AMI with an id, looking it up only the first time it is asked for'''
+        with self._cache_lock:
+            if ami_id not in self._amis_by_id:
+                self._amis_by_id[ami_id] = self._disco_bake.connection.get_image(ami_id)
+            return self._amis_by_id[ami_id]
+
+    @contextmanager
+    def _reusing_partition(self, new_ami_id):
+        '''
+        Within this context the instances of the hostclass of new_ami_id are only described once,
+        for steps of a phase that don't change them between looking up old and new instances
+        '''
+        self._partitions[new_ami_id] = None
+        try:
+            yield
+        finally:
+            self._partitions.pop(new_ami_id, None)
+
+    def _partition_instances(self, new_ami_id):
+        '''
+        Returns the instances of the autoscaling groups of the hostclass of new_ami_id that are not
+        running new_ami_id and those that are, both from a single describe of the hostclass instances
+        '''
+        partition = self._partitions.get(new_ami_id)
+        if partition is None:
+            hostclass = DiscoBake.ami_hostclass(self._get_image(new_ami_id))
+            all_ids = [inst.instance_id for inst in self._disco_autoscale.get_instances(hostclass=hostclass)]
+            all_instances = self._disco_aws.instances(instance_ids=all_ids) if all_ids else []
+            partition = ([inst for inst in all_instances if inst.image_id != new_ami_id],
+                         [inst for inst in all_instances if inst.image_id == new_ami_id])
+            if new_ami_id in self._partitions:
+                self._partitions[new_ami_id] = partition
+        return partition
 
     def _get_old_instances(self, new_ami_id):
         '''Returns instances of the hostclass of new_ami_id that are not running new_ami_id'''
-        hostclass = DiscoBake.ami_hostclass(self._disco_bake.connection.get_image(new_ami_id))
-        all_ids = [inst.instance_id for inst in self._disco_autoscale.get_instances(hostclass=hostclass)]
-        all_instances = self._disco_aws.instances(instance_ids=all_ids)
-        return [inst for inst in all_instances if inst.image_id != new_ami_id]
+        return self._partition_instances(new_ami_id)[0]
 
     def _get_new_instances(self, new_ami_id):
         '''Returns instances running new_ami_id'''
-        hostclass = DiscoBake.ami_hostclass(self._disco_bake.connection.get_image(new_ami_id))
-        all_ids = [inst.instance_id for inst in self._disco_autoscale.get_instances(hostclass=hostclass)]
-        return self._disco_aws.instances(filters={"image_id": [new_ami_id]}, instance_ids=all_ids)
+        return self._partition_instances(new_ami_id)[1]
 
     def _get_latest_other_image_id(self, new_ami_id):
         '''
@@ -311,7 +396,8 @@ class DiscoDeploy(object):
                     logger.warning("Unable to find old AMI %s, it was probably deleted", ami_id)
                 else:
                     raise
-        return max(images, key=self._disco_bake.get_ami_creation_time).id if len(images) else None
+        self._index_ami_creation_times(images)
+        return max(images, key=self._ami_creation_time).id if len(images) else None
 
     def run_tests_with_maintenance_mode(self, ami):
         '''
@@ -321,12 +407,15 @@ class DiscoDeploy(object):
         If tests pass the old instances are left in maintenance mode, otherwise they are returned to normal.
         '''
         hostclass = DiscoBake.ami_hostclass(ami)
-        self._set_maintenance_mode(hostclass, self._get_old_instances(ami.id), True)
-        ret = self.run_integration_tests(ami)
-        if not ret:
-            self._set_maintenance_mode(hostclass, self._get_old_instances(ami.id), False)
+        # The instances put into maintenance mode are the ones to take out of it again
+        with self._reusing_partition(ami.id):
+            self._set_maintenance_mode(hostclass, self._get_old_instances(ami.id), True)
+            ret = self.run_integration_tests(ami)
+            if not ret:
+                self._set_maintenance_mode(hostclass, self._get_old_instances(ami.id), False)
         return ret
 
+    @_timed_phase("classic_deploy")
     def handle_tested_ami(self, ami, pipeline_dict=None, run_tests=False, dry_run=False, old_group=None):
         '''
         Tests hostclasses which we can deploy normally.
@@ -367,14 +456,16 @@ class DiscoDeploy(object):
             ami=ami
         )
 
-        self._disco_aws.spinup([new_hostclass_dict])
+        with deploy_phase("asg_creation"):
+            self._disco_aws.spinup([new_hostclass_dict])
 
         try:
             if (self.wait_for_smoketests(ami.id, post_hostclass_dict["desired_size"]) and
                     (not run_tests or self.run_tests_with_maintenance_mode(ami))):
                 # Roll forward with new configuration
-                self._disco_aws.terminate(self._get_old_instances(ami.id), use_autoscaling=True)
-                self._disco_aws.spinup([post_hostclass_dict])
+                with deploy_phase("old_instances_teardown"):
+                    self._disco_aws.terminate(self._get_old_instances(ami.id), use_autoscaling=True)
+                    self._disco_aws.spinup([post_hostclass_dict])
                 # Create scheduled actions on the ASG.
                 self._create_scaling_schedule(pipeline_dict, hostclass=hostclass)
                 self._promote_ami(ami, "tested")
@@ -389,18 +480,21 @@ class DiscoDeploy(object):
         post_hostclass_dict.pop("ami", None)
 
         # Revert to the latest tested AMI if possible
-        old_ami_id = self._get_latest_other_image_id(ami.id)
-        if old_ami_id:
-            post_hostclass_dict["ami"] = old_ami_id
-        else:
-            logger.error("Unable to rollback to old AMI. Autoscaling group will use new AMI on next event!")
+        with deploy_phase("rollback"), self._reusing_partition(ami.id):
+            old_ami_id = self._get_latest_other_image_id(ami.id)
+            if old_ami_id:
+                post_hostclass_dict["ami"] = old_ami_id
+            else:
+                logger.error("Unable to rollback to old AMI. "
+                             "Autoscaling group will use new AMI on next event!")
 
-        self._disco_aws.terminate(self._get_new_instances(ami.id), use_autoscaling=True)
-        self._disco_aws.spinup([post_hostclass_dict])
+            self._disco_aws.terminate(self._get_new_instances(ami.id), use_autoscaling=True)
+            self._disco_aws.spinup([post_hostclass_dict])
 
     # This method handles blue/green from end to end, so it has a lot of logic in it. We should at some point
     # look at breaking it up a bit and/or the feasibility of that.
     # pylint: disable=too-many-locals,too-many-branches,too-many-statements,too-many-return-statements
+    @_timed_phase("blue_green_deploy")
     def handle_blue_green_ami(self, ami, pipeline_dict=None, old_group=None,
                               deployable=False, run_tests=False, dry_run=False):
         '''
@@ -434,7 +528,8 @@ class DiscoDeploy(object):
 
         try:
             # Spinup our new autoscaling group in testing mode, making one even if one already exists.
-            self._disco_aws.spinup([new_group_config], create_if_exists=True, testing=True)
+            with deploy_phase("asg_creation"):
+                self._disco_aws.spinup([new_group_config], create_if_exists=True, testing=True)
         except TooManyAutoscalingGroups:
             logger.exception("Too many autoscaling groups exist. Unable to determine which ASG to delete,"
                              "so refusing to do anything. Manual cleanup probably required.")
@@ -487,13 +582,15 @@ class DiscoDeploy(object):
                 if deployable and self._set_testing_mode(hostclass, group_instances, False):
                     logger.info("Successfully left testing mode for group %s", new_group.name)
                     # Update ASG to exit testing mode and attach to the normal ELB if applicable.
-                    self._disco_aws.spinup([new_group_config], group_name=new_group.name)
+                    with deploy_phase("asg_update"):
+                        self._disco_aws.spinup([new_group_config], group_name=new_group.name)
 
                     if uses_elb:
                         try:
                             # Wait until the new ASG is registered and marked as healthy by ELB.
-                            self._disco_elb.wait_for_instance_health_state(hostclass=hostclass,
-                                                                           instance_ids=group_instance_ids)
+                            with deploy_phase("elb_health"):
+                                self._disco_elb.wait_for_instance_health_state(
+                                    hostclass=hostclass, instance_ids=group_instance_ids)
                         except TimeoutError:
                             logger.exception("Waiting for health of instances attached to ELB timed out")
                             # Destroy the testing ASG
@@ -508,11 +605,12 @@ class DiscoDeploy(object):
 
                     # we can destroy the old group
                     if old_group:
-                        # Empty the original ASG for connection draining purposes
-                        self._disco_autoscale.scaledown_groups(group_name=old_group.name, wait=True,
-                                                               noerror=True)
-                        # Destroy the original ASG
-                        self._disco_autoscale.delete_groups(group_name=old_group.name, force=True)
+                        with deploy_phase("old_group_teardown"):
+                            # Empty the original ASG for connection draining purposes
+                            self._disco_autoscale.scaledown_groups(group_name=old_group.name, wait=True,
+                                                                   noerror=True)
+                            # Destroy the original ASG
+                            self._disco_autoscale.delete_groups(group_name=old_group.name, force=True)
                     if uses_elb:
                         # Destroy the testing ELB
                         self._disco_elb.delete_elb(hostclass, testing=True)
@@ -546,11 +644,12 @@ class DiscoDeploy(object):
         except (MaintenanceModeError, IntegrationTestError):
             logger.exception("Failed to run integration test")
 
-        # Destroy the testing ASG
-        self._disco_autoscale.delete_groups(group_name=new_group.name, force=True)
-        if uses_elb:
-            # Destroy the testing ELB
-            self._disco_elb.delete_elb(hostclass, testing=True)
+        with deploy_phase("rollback"):
+            # Destroy the testing ASG
+            self._disco_autoscale.delete_groups(group_name=new_group.name, force=True)
+            if uses_elb:
+                # Destroy the testing ELB
+                self._disco_elb.delete_elb(hostclass, testing=True)
         return False
 
     def _create_scaling_schedule(self, pipeline_dict, group_name=None, hostclass=None):
@@ -663,6 +762,7 @@ class DiscoDeploy(object):
             return inst
         raise IntegrationTestError("Unable to find test host")
 
+    @_timed_phase("integration_tests")
     def run_integration_tests(self, ami, wait_for_elb=False):
         '''
         Runs integration tests for the hostclass belonging to the passed in AMI
@@ -676,16 +776,20 @@ class DiscoDeploy(object):
         test_name = self.get_integration_test(hostclass)
 
         if wait_for_elb:
-            try:
-                self._disco_elb.wait_for_instance_health_state(hostclass=hostclass, testing=True)
-            except TimeoutError:
-                logger.exception("Waiting for health of instances attached to testing ELB timed out")
-                return False
+            with deploy_phase("testing_elb_health") as span:
+                try:
+                    self._disco_elb.wait_for_instance_health_state(hostclass=hostclass, testing=True)
+                except TimeoutError:
+                    logger.exception("Waiting for health of instances attached to testing ELB timed out")
+                    span["outcome"] = "timeout"
+                    return False
 
         logger.info("running integration test %s on %s", test_name, test_hostclass)
-        exit_code, stdout = self._test_aws.remotecmd(
-            self.get_host(test_hostclass), [test_command, test_name],
-            user=test_user, nothrow=True)
+        with deploy_phase("integration_test_command") as span:
+            exit_code, stdout = self._test_aws.remotecmd(
+                self.get_host(test_hostclass), [test_command, test_name],
+                user=test_user, nothrow=True)
+            span["outcome"] = "passed" if exit_code == 0 else "failed"
         sys.stdout.write(stdout)
         return exit_code == 0
 
@@ -720,14 +824,14 @@ class DiscoDeploy(object):
                 dry_run=dry_run
             )
         elif not deployable:
-            self.handle_nodeploy_ami(
+            return self.handle_nodeploy_ami(
                 ami,
                 pipeline_dict=pipeline_hostclass_dict,
                 dry_run=dry_run,
                 old_group=group
             )
         elif testable:
-            self.handle_tested_ami(
+            return self.handle_tested_ami(
                 ami,
                 pipeline_dict=pipeline_hostclass_dict,
                 run_tests=True,
@@ -735,14 +839,14 @@ class DiscoDeploy(object):
                 old_group=group
             )
         elif pipeline_hostclass_dict:
-            self.handle_tested_ami(
+            return self.handle_tested_ami(
                 ami,
                 pipeline_dict=pipeline_hostclass_dict,
                 dry_run=dry_run,
                 old_group=group
             )
         else:
-            self.handle_nodeploy_ami(
+            return self.handle_nodeploy_ami(
                 ami,
                 pipeline_dict=None,
                 dry_run=dry_run,
@@ -754,7 +858,7 @@ class DiscoDeploy(object):
         hostclass = DiscoBake.ami_hostclass(ami)
         pipeline_dict = self._hostclasses.get(hostclass)
         if not pipeline_dict:
-            return
+            return None
 
         group = self._disco_autoscale.get_existing_group(hostclass)
         deployable = self.is_deployable(hostclass)
@@ -769,7 +873,7 @@ class DiscoDeploy(object):
             )
 
         if desired_deployment_strategy == DEPLOYMENT_STRATEGY_BLUE_GREEN:
-            self.handle_blue_green_ami(
+            return self.handle_blue_green_ami(
                 ami,
                 pipeline_dict=pipeline_dict,
                 old_group=group,
@@ -778,35 +882,108 @@ class DiscoDeploy(object):
                 dry_run=dry_run
             )
         elif not deployable:
-            self.handle_nodeploy_ami(
+            return self.handle_nodeploy_ami(
                 ami,
                 pipeline_dict=pipeline_dict,
                 dry_run=dry_run,
                 old_group=group
             )
         else:
-            self.handle_tested_ami(
+            return self.handle_tested_ami(
                 ami,
                 pipeline_dict=pipeline_dict,
                 dry_run=dry_run,
                 old_group=group
             )
 
-    def test(self, dry_run=False, deployment_strategy=None):
-        '''Tests a single untested AMI and marks it as tested or failed'''
-        amis = self.get_test_amis()
-        if len(amis):
-            self.test_ami(random.choice(amis), dry_run, deployment_strategy)
+    def _handle_amis(self, handler, amis, dry_run, deployment_strategy, max_concurrency):
+        '''
+        Calls handler on each AMI, handling at most max_concurrency AMIs at the same time. The AMIs
+        must be of different hostclasses, so that their deployments are independent.
+
+        An exception raised while handling one AMI is logged and doesn't stop the others, each
+        handler rolls back its own hostclass as it would when running on its own. Without
+        max_concurrency the AMIs are handled one after the other and exceptions are raised as is.
+
+        Returns a list of dicts with the hostclass, ami, stage and error of each AMI, ordered by
+        hostclass. The stage is the one the AMI was left in. The error is None only if the handler
+        didn't raise, didn't return False and didn't promote the AMI to failed.
+        '''
+        def _handle(ami):
+            hostclass = DiscoBake.ami_hostclass(ami)
+            try:
+                passed = handler(ami, dry_run, deployment_strategy)
+                error = None
+            except Exception as err:
+                if not max_concurrency:
+                    raise
+                logger.exception("Deploying %s %s failed", hostclass, ami.id)
+                passed = False
+                error = err
+            # Promotion tags the AMI object itself, so this is the stage the handler left it in
+            stage = ami.tags.get("stage")
+            if not error and stage == "failed":
+                error = "tests failed"
+            elif not error and passed is False:
+                error = "deployment failed"
+            return {"hostclass": hostclass, "ami": ami.id, "stage": stage, "error": error}
+
+        amis = sorted(amis, key=DiscoBake.ami_hostclass)
+        workers = min(max_concurrency or 1, len(amis))
+        if workers > 1:
+            # Create the lazily initialized helpers up front so the worker threads share one of each,
+            # the boto2 connections themselves are per thread
+            _ = (self._disco_aws.vpc, self._disco_aws.autoscale, self._disco_aws.elb, self.all_stage_amis)
+            pool = ThreadPool(processes=workers)
+            try:
+                if dry_run:
+                    results = pool.map(_handle, amis, chunksize=1)
+                else:
+                    # Each spinup would otherwise clean up launch configurations the others are using
+                    with self._disco_aws.autoscale.deferred_config_cleanup():
+                        results = pool.map(_handle, amis, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
         else:
+            results = [_handle(ami) for ami in amis]
+
+        for result in results:
+            logger.info("%s %s %s: %s", result["hostclass"], result["ami"], result["stage"] or "untagged",
+                        "failed ({0})".format(result["error"]) if result["error"] else "done")
+        return results
+
+    def test(self, dry_run=False, deployment_strategy=None, max_concurrency=None):
+        '''
+        Tests a single untested AMI and marks it as tested or failed.
+
+        If max_concurrency is set, the latest untested AMI of every hostclass is tested instead,
+        max_concurrency hostclasses at a time. Returns the results of the tested AMIs as
+        _handle_amis does, an empty list if there are none.
+        '''
+        amis = self.get_test_amis()
+        if not len(amis):
             logger.info("No 'untested' AMIs found.")
+            return []
+        if not max_concurrency:
+            amis = [random.choice(amis)]
+        return self._handle_amis(self.test_ami, amis, dry_run, deployment_strategy, max_concurrency)
+
+    def update(self, dry_run=False, deployment_strategy=None, max_concurrency=None):
+        '''
+        Updates a single autoscaling group with a newer AMI.
 
-    def update(self, dry_run=False, deployment_strategy=None):
-        '''Updates a single autoscaling group with a newer AMI'''
+        If max_concurrency is set, every hostclass with a newer AMI is updated instead,
+        max_concurrency hostclasses at a time. Returns the results of the updated AMIs as
+        _handle_amis does, an empty list if there are none.
+        '''
         amis = self.get_update_amis()
-        if len(amis):
-            self.update_ami(random.choice(amis), dry_run, deployment_strategy)
-        else:
+        if not len(amis):
             logger.info("No new 'tested' AMIs found.")
+            return []
+        if not max_concurrency:
+            amis = [random.choice(amis)]
+        return self._handle_amis(self.update_ami, amis, dry_run, deployment_strategy, max_concurrency)
 
     def hostclass_option(self, hostclass, key):
         '''
@@ -815,14 +992,11 @@ class DiscoDeploy(object):
         minus that prefix, otherwise it returns that value from the DEFAULT_CONFIG_SECTION if it is set.
         '''
         alt_key = key.split("test_").pop()
-        if self._config.has_option(hostclass, key):
-            return self._config.get(hostclass, key)
-        elif self._config.has_option("test", key):
-            return self._config.get("test", key)
-        elif alt_key != key and self._config.has_option("test", alt_key):
-            return self._config.get("test", alt_key)
-        else:
-            return self._config.get(DEFAULT_CONFIG_SECTION, "default_{0}".format(key))
+        candidates = [(hostclass, key), ("test", key)]
+        if alt_key != key:
+            candidates.append(("test", alt_key))
+        candidates.append((DEFAULT_CONFIG_SECTION, "default_{0}".format(key)))
+        return get_config_index(self._config).lookup(candidates)
 
     def hostclass_option_default(self, hostclass, key, default=None):
         """Fetch a hostclass configuration option if it exists, otherwise return value passed in as default"""
@@ -4,9 +4,8 @@ DynamoDB Module. Can be used to perform various DynamoDB operations
 
 import json
 
-import boto3
-
 from . import normalize_path
+from .client_registry import get_boto3_resource
 from .exceptions import DynamoDBEnvironmentError
 from .resource_helper import throttled_call
 
@@ -24,7 +23,7 @@ class DiscoDynamoDB(object):
 
         self.environment_name = environment_name
 
-        self.dynamodb = boto3.resource("dynamodb")
+        self.dynamodb = get_boto3_resource("dynamodb")
 
     def get_all_tables(self):
         """ Returns a list of existing DynamoDB table names."""
@@ -2,7 +2,7 @@
 Some code to manage elastic IP's.  Elastic IP's are fixed internet routable addresses
 that we can assign to our AWS instances.  We use them for certain hostclasses, such as Jenkins.
 """
-from boto.vpc import VPCConnection
+from .client_registry import get_boto2_connection
 
 
 class DiscoEIP(object):
@@ -11,7 +11,7 @@ class DiscoEIP(object):
     """
 
     def __init__(self):
-        self.vpc_conn = VPCConnection()
+        self.vpc_conn = get_boto2_connection('vpc')
 
     def list(self):
         """Returns all of our currently allocated EIPs"""
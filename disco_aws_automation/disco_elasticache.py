@@ -7,11 +7,11 @@ import logging
 import hashlib
 from ConfigParser import ConfigParser
 
-import boto3
 import botocore
 from semantic_version import Spec, Version
 
 from . import normalize_path
+from .client_registry import get_boto3_client
 from .disco_route53 import DiscoRoute53
 from .exceptions import CommandError
 from .resource_helper import throttled_call
@@ -31,7 +31,7 @@ class DiscoElastiCache(object):
 
     def __init__(self, vpc, config_file='disco_elasticache.ini', aws=None, route53=None):
         self.vpc = vpc
-        self.conn = boto3.client('elasticache')
+        self.conn = get_boto3_client('elasticache')
         self.config_file = config_file
         self._config = None  # lazily initialized
         self.route53 = route53 or DiscoRoute53()
@@ -4,13 +4,13 @@ Manage AWS ElasticSearch
 import logging
 import time
 import json
-from ConfigParser import NoOptionError
-
-import boto3
+from ConfigParser import NoOptionError, NoSectionError
 
 from boto3.exceptions import Boto3Error
 from botocore.exceptions import BotoCoreError
 from . import read_config
+from .client_registry import get_boto3_client, get_boto3_resource, get_boto3_session
+from .config_index import get_config_index
 from .disco_route53 import DiscoRoute53
 from .resource_helper import throttled_call
 from .disco_aws_util import is_truthy
@@ -53,21 +53,21 @@ class DiscoElasticsearch(object):
     def conn(self):
         """The boto3 elasticsearch connection object"""
         if not self._conn:
-            self._conn = boto3.client('es')
+            self._conn = get_boto3_client('es')
         return self._conn
 
     @property
     def session(self):
         """Boto3 session"""
         if not self._session:
-            self._session = boto3.session.Session()
+            self._session = get_boto3_session()
         return self._session
 
     @property
     def account_id(self):
         """Account id of the current IAM user"""
         if not self._account_id:
-            self._account_id = boto3.resource('iam').CurrentUser().arn.split(':')[4]
+            self._account_id = get_boto3_resource('iam').CurrentUser().arn.split(':')[4]
         return self._account_id
 
     @property
@@ -412,32 +412,22 @@ class DiscoElasticsearch(object):
         """Returns appropriate configuration for the current environment"""
         section = "{}:{}".format(self.environment_name, elasticsearch_name)
 
-        if self.config_es.has_option(section, option):
-            return self.config_es.get(section, option)
-        elif self.config_es.has_option('defaults', option):
+        try:
             # Get option from defaults section if it's not found in the cluster's section
-            return self.config_es.get('defaults', option)
-
-        raise RuntimeError("Could not find option, %s, in either the %s and the defaults sections "
-                           "of the ElasticSearch config.",
-                           option, section)
+            return get_config_index(self.config_es).lookup([(section, option), ('defaults', option)])
+        except (NoSectionError, NoOptionError):
+            raise RuntimeError("Could not find option, %s, in either the %s and the defaults sections "
+                               "of the ElasticSearch config.",
+                               option, section)
 
     def get_aws_option(self, option, section=DEFAULT_CONFIG_SECTION):
         """Get a value from the config"""
-        env_option = "{0}@{1}".format(option, self.environment_name)
-        default_option = "default_{0}".format(option)
-        default_env_option = "default_{0}".format(env_option)
-
-        if self.config_aws.has_option(section, env_option):
-            return self.config_aws.get(section, env_option)
-        if self.config_aws.has_option(section, option):
-            return self.config_aws.get(section, option)
-        elif self.config_aws.has_option(DEFAULT_CONFIG_SECTION, default_env_option):
-            return self.config_aws.get(DEFAULT_CONFIG_SECTION, default_env_option)
-        elif self.config_aws.has_option(DEFAULT_CONFIG_SECTION, default_option):
-            return self.config_aws.get(DEFAULT_CONFIG_SECTION, default_option)
-
-        raise NoOptionError(option, section)
+        try:
+            return get_config_index(self.config_aws).lookup(
+                [(section, option), (DEFAULT_CONFIG_SECTION, "default_{0}".format(option))],
+                self.environment_name)
+        except (NoSectionError, NoOptionError):
+            raise NoOptionError(option, section)
 
     def get_aws_option_default(self, option, section=DEFAULT_CONFIG_SECTION, default=None):
         """Get a value from the config"""
@@ -8,8 +8,6 @@ import datetime
 import logging
 import re
 
-import boto3
-from boto3.session import Session
 from elasticsearch import (
     Elasticsearch,
     NotFoundError,
@@ -19,6 +17,7 @@ from elasticsearch import (
 from requests_aws4auth import AWS4Auth
 
 from . import read_config, DiscoElasticsearch, DiscoIAM
+from .client_registry import get_boto3_client, get_boto3_session
 from .disco_aws_util import is_truthy
 from .exceptions import TimeoutError
 from .disco_constants import ES_CONFIG_FILE
@@ -86,7 +85,7 @@ class DiscoESArchive(object):
         Current region, based of boto connection.
         """
         if not self._region:
-            self._region = Session().region_name
+            self._region = get_boto3_session().region_name
         return self._region
 
     @property
@@ -107,7 +106,7 @@ class DiscoESArchive(object):
         Return authenticated ElasticSearch connection object
         """
         if not self._es_client:
-            session = Session()
+            session = get_boto3_session()
             credentials = session.get_credentials()
             aws_auth = AWS4Auth(
                 credentials.access_key,
@@ -153,7 +152,7 @@ class DiscoESArchive(object):
         Returns a boto3 S3 client object
         """
         if not self._s3_client:
-            self._s3_client = boto3.client("s3")
+            self._s3_client = get_boto3_client("s3")
 
         return self._s3_client
 
@@ -6,10 +6,11 @@ import re
 import logging
 import time
 import hashlib
+from multiprocessing.pool import ThreadPool
 
-import boto3
 import botocore
 
+from .client_registry import get_boto3_client
 from .disco_aws_util import get_tag_value, is_truthy
 from .disco_route53 import DiscoRoute53
 from .disco_acm import DiscoACM
@@ -22,6 +23,7 @@ logger = logging.getLogger(__name__)
 
 
 STICKY_POLICY_NAME = 'session-cookie-policy'
+ELB_DELETE_CONCURRENCY = 8
 
 
 class DiscoELB(object):
@@ -42,7 +44,7 @@ class DiscoELB(object):
         Lazily creates boto3 ELB Connection
         """
         if not self._elb_client:
-            self._elb_client = boto3.client('elb')
+            self._elb_client = get_boto3_client('elb')
         return self._elb_client
 
     def get_certificate_arn(self, dns_name):
@@ -320,6 +322,28 @@ class DiscoELB(object):
         self.route53.delete_records_by_value('CNAME', elb['DNSName'])
         throttled_call(self.elb_client.delete_load_balancer, LoadBalancerName=elb['LoadBalancerName'])
 
+    def delete_elbs(self, hostclasses, testing=False, max_concurrency=ELB_DELETE_CONCURRENCY):
+        """
+        Delete the existing ELBs of several hostclasses, at most max_concurrency at the same time.
+        The CNAME records pointing to any of them are deleted in a single pass over our DNS records.
+        """
+        if not hostclasses:
+            return
+        pool = ThreadPool(processes=min(max_concurrency, len(hostclasses)))
+        try:
+            elbs = [elb for elb in pool.map(lambda hostclass: self.get_elb(hostclass, testing=testing),
+                                            hostclasses) if elb]
+            if not elbs:
+                return
+            logger.info("Deleting ELBs %s", ", ".join(elb['LoadBalancerName'] for elb in elbs))
+            self.route53.delete_records_by_values('CNAME', [elb['DNSName'] for elb in elbs])
+            pool.map(lambda elb: throttled_call(self.elb_client.delete_load_balancer,
+                                                LoadBalancerName=elb['LoadBalancerName']),
+                     elbs)
+        finally:
+            pool.close()
+            pool.join()
+
     @staticmethod
     def get_elb_id(environment_name, hostclass, testing=False):
         """Returns the elb name for a given hostclasses, hashed with SHA-256 and truncated to 32 characters"""
@@ -345,8 +369,9 @@ class DiscoELB(object):
 
     def destroy_all_elbs(self):
         """Destroy all ELB for current environment"""
-        for elb in self.list():
-            self.route53.delete_records_by_value('CNAME', elb['DNSName'])
+        elbs = self.list()
+        self.route53.delete_records_by_values('CNAME', [elb['DNSName'] for elb in elbs])
+        for elb in elbs:
             throttled_call(self.elb_client.delete_load_balancer, LoadBalancerName=elb['LoadBalancerName'])
 
     def _describe_instance_health(self, elb_id, instance_ids=None):
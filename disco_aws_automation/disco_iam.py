@@ -10,12 +10,10 @@ import urllib2
 from collections import defaultdict
 import logging
 from datetime import datetime
-import boto
-import boto.iam
-import boto3
 import botocore
 
 from . import read_config
+from .client_registry import get_boto2_connection, get_boto3_client, get_boto3_resource
 from .disco_aws_util import is_truthy
 
 logger = logging.getLogger(__name__)
@@ -54,7 +52,7 @@ class DiscoIAM(object):
         Lazily creates boto2 IAM connection
         """
         if not self._boto2_connection:
-            self._boto2_connection = boto.connect_iam()
+            self._boto2_connection = get_boto2_connection('iam')
         return self._boto2_connection
 
     @property
@@ -63,7 +61,7 @@ class DiscoIAM(object):
         Lazily creates boto3 IAM connection
         """
         if not self._boto3_connection:
-            self._boto3_connection = boto3.client('iam')
+            self._boto3_connection = get_boto3_client('iam')
         return self._boto3_connection
 
     def set_environment(self, environment):
@@ -166,7 +164,7 @@ class DiscoIAM(object):
         logger.debug("Removing user %s.", user_name)
         for key in self.list_access_keys(user_name):
             self.remove_access_key(user_name, key.access_key_id)
-        iam = boto3.resource('iam')
+        iam = get_boto3_resource('iam')
         user = iam.User(user_name)
         attached_policies = user.attached_policies.all()
         for policy in attached_policies:
@@ -319,8 +317,7 @@ class DiscoIAM(object):
 
     def decode_message(self, message):
         '''Decodes an any encrypted AWS Error message'''
-        from boto.sts import STSConnection
-        sts_connection = STSConnection()
+        sts_connection = get_boto2_connection('sts')
         print("---------- Decoded message ----------")
         print((sts_connection.decode_authorization_message(message).decoded_message))
 
@@ -4,14 +4,16 @@ cloudwatch logs allow us to create metrics/alarms from log files
 """
 import logging
 from ConfigParser import ConfigParser
-
-import boto3
+from multiprocessing.pool import ThreadPool
 
 from . import normalize_path
+from .client_registry import get_boto3_client
 from .resource_helper import throttled_call
 
 logger = logging.getLogger(__name__)
 
+LOG_GROUP_DELETE_CONCURRENCY = 8
+
 
 class DiscoLogMetrics(object):
     """
@@ -19,7 +21,7 @@ class DiscoLogMetrics(object):
     """
 
     def __init__(self, environment, config_file='disco_log_metrics.ini'):
-        self.logs = boto3.client('logs')
+        self.logs = get_boto3_client('logs')
         self.environment = environment
         self.config_file = config_file
         self._config = None  # lazily initialized
@@ -116,6 +118,40 @@ class DiscoLogMetrics(object):
         for log_group in self.list_log_groups(hostclass):
             throttled_call(self.logs.delete_log_group, logGroupName=log_group['logGroupName'])
 
+    def _list_environment_log_groups(self):
+        """Lists all log groups in the current environment, all pages of them"""
+        log_groups = []
+        kwargs = {"logGroupNamePrefix": self.environment + "/"}
+        while True:
+            response = throttled_call(self.logs.describe_log_groups, **kwargs)
+            log_groups.extend(response.get('logGroups', []))
+            if not response.get('nextToken'):
+                return log_groups
+            kwargs['nextToken'] = response['nextToken']
+
+    def delete_hostclasses_log_groups(self, hostclasses, max_concurrency=LOG_GROUP_DELETE_CONCURRENCY):
+        """
+        Delete the log groups of several hostclasses, listing the log groups of the environment only
+        once and deleting at most max_concurrency log groups at the same time. Deleting a log group
+        also deletes its metric filters, so they don't need to be deleted one by one beforehand.
+        """
+        prefixes = tuple(self.environment + "/" + hostclass for hostclass in hostclasses)
+        log_group_names = [log_group['logGroupName'] for log_group in self._list_environment_log_groups()
+                           if log_group['logGroupName'].startswith(prefixes)]
+        if not log_group_names:
+            return
+
+        def _delete(log_group_name):
+            logger.info("Deleting log group %s", log_group_name)
+            throttled_call(self.logs.delete_log_group, logGroupName=log_group_name)
+
+        pool = ThreadPool(processes=min(max_concurrency, len(log_group_names)))
+        try:
+            pool.map(_delete, log_group_names)
+        finally:
+            pool.close()
+            pool.join()
+
     def delete_all_log_groups(self):
         """Delete all log groups in the current environment"""
         response = throttled_call(self.logs.describe_log_groups, logGroupNamePrefix=self.environment + "/")
@@ -11,10 +11,9 @@ from boto.ec2.networkinterface import (
     NetworkInterfaceCollection
 )
 from boto.exception import EC2ResponseError
-from boto.vpc import VPCConnection
-import boto3
 
 from disco_aws_automation.network_helper import calc_subnet_offset
+from .client_registry import get_boto2_connection, get_boto3_client
 from .disco_subnet import DiscoSubnet
 from .resource_helper import (
     keep_trying,
@@ -46,7 +45,7 @@ class DiscoMetaNetwork(object):
         self._centralized_route_table_loaded = False
         self._centralized_route_table = None  # lazily initialized
         self._security_group = None  # lazily initialized
-        self._connection = VPCConnection()
+        self._connection = get_boto2_connection('vpc')
         self._disco_subnets = None  # lazily initialized
         self._boto3_connection = boto3_connection  # Lazily initialized if parameter is None
 
@@ -76,7 +75,7 @@ class DiscoMetaNetwork(object):
         Lazily creates boto3 EC2 connection
         """
         if not self._boto3_connection:
-            self._boto3_connection = boto3.client('ec2')
+            self._boto3_connection = get_boto3_client('ec2')
         return self._boto3_connection
 
     def _resource_name(self, suffix=None):
@@ -8,8 +8,8 @@ import re
 from subprocess import check_output, CalledProcessError
 
 import boto.utils
-from boto.ec2 import cloudwatch
 
+from disco_aws_automation.client_registry import get_boto2_connection
 from disco_aws_automation.resource_helper import keep_trying
 
 logger = logging.getLogger(__name__)
@@ -39,7 +39,7 @@ class DiscoMetrics(object):
             self._hostclass = userdata["hostclass"]
             self._environment_name = userdata["environment_name"]
 
-        self._connection = cloudwatch.connect_to_region(self._region)
+        self._connection = get_boto2_connection('cloudwatch', self._region)
         self._dimensions = {
             "env_hostclass": "_".join((self._environment_name, self._hostclass))
         }
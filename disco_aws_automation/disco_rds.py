@@ -11,11 +11,11 @@ import sys
 import threading
 from ConfigParser import ConfigParser, NoOptionError, NoSectionError
 
-import boto3
 import botocore
 import pytz
 
 from . import read_config, ASIAQ_CONFIG
+from .client_registry import get_boto3_client
 from .disco_alarm import DiscoAlarm
 from .disco_aws_util import is_truthy
 from .disco_creds import DiscoS3Bucket
@@ -48,7 +48,7 @@ class RDS(threading.Thread):
     def __init__(self, env_name, database_identifier, rds_security_group_id, subnet_ids, domain_name):
         """Initialize class"""
         threading.Thread.__init__(self, name=database_identifier)
-        self.client = boto3.client('rds')
+        self.client = get_boto3_client('rds')
         self.vpc_name = env_name
         self.database_name = RDS.get_database_name(env_name, database_identifier)
         self.config_aws = read_config()
@@ -464,7 +464,7 @@ class DiscoRDS(object):
         """Initialize class"""
         self.config_aws = read_config()
         self.config_rds = read_config(config_file=DEFAULT_CONFIG_FILE_RDS)
-        self.client = boto3.client('rds')
+        self.client = get_boto3_client('rds')
         self.vpc = vpc
         self.disco_vpc_sg_rules = DiscoVPCSecurityGroupRules(vpc, vpc.boto3_ec2)
         self.vpc_name = vpc.environment_name
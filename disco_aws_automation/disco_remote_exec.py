@@ -2,22 +2,186 @@
 ssh and rsync code
 """
 from __future__ import print_function
+import atexit
+import hashlib
 import logging
 import subprocess
 import os
 import stat
 import shutil
 import tempfile
+import threading
+import time
 import socket
+from Queue import Queue, Empty
 
 from boto.exception import S3ResponseError
 
+from .disco_aws_util import is_truthy
 from .disco_creds import DiscoS3Bucket, SSH_PRIVATE_KEY_BUCKET_PREFIX
 from .exceptions import CommandError
 
 logger = logging.getLogger(__name__)
 
 SSH_DEFAULT_OPTIONS = ["-oBatchMode=yes", "-oStrictHostKeyChecking=no", '-oUserKnownHostsFile=/dev/null']
+SSH_PROBE_TIMEOUT = 2  # seconds
+SSH_REACHABLE_TTL = 60  # seconds a successful probe is remembered
+SSH_UNREACHABLE_TTL = 15  # seconds a failed probe is remembered
+SSH_CONTROL_PERSIST = 300  # seconds an idle master connection is kept open
+SSH_MULTIPLEXING_ENV = "ASIAQ_SSH_MULTIPLEXING"
+SSH_TIMEOUT_RETURN_CODE = 124  # returned for commands that were killed for taking too long, like timeout(1)
+STREAM_DRAIN_TIMEOUT = 1  # seconds to wait for the end of the output of a command that has exited
+
+
+class SshControlMasters(object):
+    """
+    Keeps track of the persistent ssh master connections that our ssh and rsync commands share.
+
+    There is one master connection per user and host that we ssh to directly, which is the jump
+    host for instances that are only reachable through it, listening on a socket in a private
+    directory. The first command to a host opens the master connection and the following ones
+    reuse it, skipping the TCP and ssh handshakes. All master connections are closed when the
+    process exits.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._directory = None
+        self._paths = set()
+        self._lock = threading.Lock()
+
+    def control_path(self, user, address):
+        """Returns the master connection socket to use for a host, or None if multiplexing is disabled"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if not self._directory:
+                # mkdtemp creates a directory only we can read
+                self._directory = tempfile.mkdtemp(prefix="asiaq-ssh-")
+                atexit.register(self.close_all)
+            # Hash the name, unix socket paths are limited to about a hundred characters
+            name = hashlib.sha1("{0}@{1}".format(user, address)).hexdigest()[:16]
+            path = os.path.join(self._directory, name)
+            self._paths.add(path)
+            return path
+
+    @staticmethod
+    def ssh_options(control_path):
+        """Returns the ssh options that share the master connection listening on control_path"""
+        return ["-oControlMaster=auto",
+                "-oControlPath={0}".format(control_path),
+                "-oControlPersist={0}".format(SSH_CONTROL_PERSIST)]
+
+    def close_all(self):
+        """Closes all master connections and removes their socket directory"""
+        with self._lock:
+            with open(os.devnull, "w") as devnull:
+                for path in self._paths:
+                    if os.path.exists(path):
+                        subprocess.call(["ssh", "-O", "exit", "-oControlPath={0}".format(path), "master"],
+                                        stdout=devnull, stderr=devnull)
+            if self._directory:
+                shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+            self._paths = set()
+
+
+SSH_CONTROL_MASTERS = SshControlMasters(enabled=is_truthy(os.environ.get(SSH_MULTIPLEXING_ENV, "yes")))
+
+
+def disable_ssh_multiplexing():
+    """Makes ssh and rsync open a new connection for each command, closing open master connections"""
+    SSH_CONTROL_MASTERS.enabled = False
+    SSH_CONTROL_MASTERS.close_all()
+
+
+_PROBES = {}  # address -> (expiry time, reachable)
+_PROBES_LOCK = threading.Lock()
+
+
+def _cached_probe(address):
+    """Returns the remembered result of probing an address, or None if there is none"""
+    with _PROBES_LOCK:
+        entry = _PROBES.get(address)
+    if entry and entry[0] > time.time():
+        return entry[1]
+    return None
+
+
+def _probe(address, timeout):
+    logger.info("Probing %s", address)
+    try:
+        sock = socket.create_connection((address, 22), timeout=timeout)
+        sock.close()
+        reachable = True
+    except (socket.timeout, socket.error):
+        reachable = False
+    ttl = SSH_REACHABLE_TTL if reachable else SSH_UNREACHABLE_TTL
+    with _PROBES_LOCK:
+        _PROBES[address] = (time.time() + ttl, reachable)
+    return reachable
+
+
+def forget_ssh_reachability(address=None):
+    """Forgets the probe results for an address, or for all addresses if none is given"""
+    with _PROBES_LOCK:
+        if address:
+            _PROBES.pop(address, None)
+        else:
+            _PROBES.clear()
+
+
+def is_ssh_reachable(address, timeout=SSH_PROBE_TIMEOUT):
+    """
+    Returns True if we can connect to port 22 at the given address. Results are remembered for a
+    short while, so that hosts which are only reachable through a jump host aren't probed again
+    by every command.
+    """
+    if not address:
+        return False
+    reachable = _cached_probe(address)
+    if reachable is None:
+        reachable = _probe(address, timeout)
+    return reachable
+
+
+def first_ssh_reachable(addresses, timeout=SSH_PROBE_TIMEOUT):
+    """
+    Returns the first of the given addresses, in the order given, that accepts a connection on
+    port 22, or None if none of them does. Addresses with a recent probe result aren't probed
+    again, the others are all probed at the same time, and an address is returned as soon as
+    all the addresses before it are known to be unreachable.
+    """
+    addresses = [address for address in addresses if address]
+    known = {}  # address -> whether it is reachable
+    to_probe = []
+    for address in addresses:
+        reachable = _cached_probe(address)
+        if reachable is not None:
+            known[address] = reachable
+        elif address not in to_probe:
+            to_probe.append(address)
+
+    results = Queue()
+    for address in to_probe:
+        thread = threading.Thread(
+            target=lambda address=address: results.put((address, _probe(address, timeout))))
+        thread.daemon = True
+        thread.start()
+
+    deadline = time.time() + timeout + 1
+    for address in addresses:
+        while address not in known:
+            try:
+                probed_address, reachable = results.get(timeout=max(deadline - time.time(), 0))
+            except Empty:
+                # A probe that hasn't answered by now counts as unreachable
+                known[address] = False
+                break
+            known[probed_address] = reachable
+        if known[address]:
+            return address
+    return None
 
 
 class DiscoRemoteExec(object):
@@ -76,16 +240,20 @@ class DiscoRemoteExec(object):
             # Remove the temporary directory
             shutil.rmtree(tempdir)
 
-    # R0914 Allow more than 15 local variables so we can pass a lot of options to ssh
-    # pylint: disable=R0914
+    # R0913, R0914 Allow more than 10 arguments and 15 local variables so we can pass a lot of options to ssh
+    # pylint: disable=R0913,R0914
     @staticmethod
     def remotecmd(address, remote_command, user, stdin=None,
                   nothrow=False, jump_address=None, log_on_error=None,
-                  ssh_options=(), forward_agent=None):
+                  ssh_options=(), forward_agent=None, output_handler=None, timeout=None):
         """
         Runs the passed in command on a remote host, via a jump host if a jump_address
         is provided and if the address is not reachable without a jump host.
 
+        If an output_handler is given, it is called with each line of output as soon as the
+        line arrives. If a timeout in seconds is given, the command is killed once it runs for
+        longer than that and its return code is SSH_TIMEOUT_RETURN_CODE.
+
         Returns a tuple containing the return code and the standard output from the command.
         """
         is_reachable = DiscoRemoteExec._is_reachable(address)
@@ -94,12 +262,47 @@ class DiscoRemoteExec(object):
             raise CommandError('Unable to run command {0}. {1} host is not reachable'
                                .format(remote_command, address))
 
-        use_jump_address = jump_address and not is_reachable
-        command = DiscoRemoteExec._get_remote_exec_command(address, remote_command, user,
-                                                           jump_address if use_jump_address else None,
-                                                           ssh_options, forward_agent)
+        jump_address = jump_address if jump_address and not is_reachable else None
+        command = DiscoRemoteExec._get_remote_exec_command(
+            address, remote_command, user, jump_address, ssh_options, forward_agent,
+            control_path=SSH_CONTROL_MASTERS.control_path(user, jump_address or address))
         logger.debug("command: %s", command)
 
+        if output_handler:
+            returncode, stdout = DiscoRemoteExec._run_streaming(command, stdin, output_handler, timeout)
+        else:
+            returncode, stdout = DiscoRemoteExec._run_buffered(command, stdin, timeout)
+        logger.debug(stdout)
+        if (not nothrow) and (returncode != 0):
+            if log_on_error:
+                logger.error(stdout)
+            raise CommandError("command: {0} returned {1}".format(
+                " ".join(command), returncode))
+        return (returncode, stdout)
+
+    @staticmethod
+    def _start_timer(process, timeout):
+        """
+        Returns a started timer that kills the process after timeout seconds, and a list that
+        the timer appends True to when it does
+        """
+        killed = []
+
+        def _kill():
+            if process.poll() is None:
+                logger.warning("Killing command that ran for more than %s seconds", timeout)
+                killed.append(True)
+                process.kill()
+
+        timer = threading.Timer(timeout, _kill) if timeout else None
+        if timer:
+            timer.daemon = True
+            timer.start()
+        return timer, killed
+
+    @staticmethod
+    def _run_buffered(command, stdin, timeout):
+        """Runs a command and returns its return code and all of its output once it has exited"""
         # output subprocess into a file to bypass pipe buffer size limitation,
         # which might cause subprocess hanging, see
         # https://thraxil.org/users/anders/posts/2008/03/13/Subprocess-Hanging-PIPE-is-your-enemy/
@@ -108,19 +311,55 @@ class DiscoRemoteExec(object):
                                        stdin=subprocess.PIPE,
                                        stdout=output,
                                        stderr=subprocess.STDOUT)
-            process.communicate(stdin)
+            timer, killed = DiscoRemoteExec._start_timer(process, timeout)
+            try:
+                process.communicate(stdin)
+            finally:
+                if timer:
+                    timer.cancel()
             output.seek(0)
-            stdout = output.read()
-            logger.debug(stdout)
-            if (not nothrow) and (process.returncode != 0):
-                if log_on_error:
-                    logger.error(stdout)
-                raise CommandError("command: {0} returned {1}".format(
-                    " ".join(command), process.returncode))
-            return (process.returncode, stdout)
+            return (SSH_TIMEOUT_RETURN_CODE if killed else process.returncode, output.read())
 
     @staticmethod
-    def _get_remote_exec_command(address, remote_command, user, jump_address, ssh_options, forward_agent):
+    def _run_streaming(command, stdin, output_handler, timeout):
+        """
+        Runs a command, passing each line of its output to output_handler as it arrives, and
+        returns its return code and all of its output once it has exited
+        """
+        process = subprocess.Popen(command,
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        timer, killed = DiscoRemoteExec._start_timer(process, timeout)
+        lines = []
+
+        def _read():
+            for line in iter(process.stdout.readline, b''):
+                lines.append(line)
+                output_handler(line)
+
+        # Output is read by its own thread because a background ssh master connection started by
+        # the command may hold on to the pipe after the command itself has exited
+        reader = threading.Thread(target=_read)
+        reader.daemon = True
+        reader.start()
+        try:
+            if stdin:
+                process.stdin.write(stdin)
+            process.stdin.close()
+        except IOError:
+            pass  # the command exited without reading all of its input
+        try:
+            process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+        reader.join(STREAM_DRAIN_TIMEOUT)
+        return (SSH_TIMEOUT_RETURN_CODE if killed else process.returncode, b''.join(lines))
+
+    @staticmethod
+    def _get_remote_exec_command(address, remote_command, user, jump_address, ssh_options, forward_agent,
+                                 control_path=None):
         """
         Get the SSH command to use to run a remote command
         Args:
@@ -131,6 +370,8 @@ class DiscoRemoteExec(object):
             jump_address (str): Address of the jump box to use if unable to connect directly to the host
             ssh_options (List[str]): List of extra ssh options
             forward_agent (bool): Enable forwarding agent
+            control_path (str): Socket of the master connection to the host we ssh to locally, which
+                                is the jump box if there is one, None to connect directly
 
         Returns List[str]: The ssh command and its arguments in a list
         """
@@ -144,6 +385,8 @@ class DiscoRemoteExec(object):
         final_hop.extend(common_flags)
         if forward_agent:
             final_hop.extend(["-A"])
+        if control_path and not jump_address:
+            final_hop.extend(SshControlMasters.ssh_options(control_path))
         final_hop.append("-l{0}".format(user))
         final_hop.append(address)
         final_hop.extend(ssh_options)
@@ -157,6 +400,9 @@ class DiscoRemoteExec(object):
             # Build up command to get to tunnel host
             proxy_hop = ["ssh", "-A", "-t", "{0}@{1}".format(user, jump_address)]
             proxy_hop.extend(common_flags)
+            if control_path:
+                # The final hop still runs on the jump host, only the connection to it is shared
+                proxy_hop.extend(SshControlMasters.ssh_options(control_path))
 
             command = []
             command.extend(proxy_hop)
@@ -173,6 +419,9 @@ class DiscoRemoteExec(object):
 
         # config ssh call
         ssh_options = "ssh {0} -oConnectTimeout=10".format(" ".join(SSH_DEFAULT_OPTIONS))
+        control_path = SSH_CONTROL_MASTERS.control_path(user, address)
+        if control_path:
+            ssh_options += " " + " ".join(SshControlMasters.ssh_options(control_path))
         local_command.append("-e")
         local_command.append(ssh_options)
 
@@ -205,15 +454,7 @@ class DiscoRemoteExec(object):
     @staticmethod
     def _is_reachable(ip_address):
         """Returns True if we can connect to port 22 at the given ip address"""
-        if not ip_address:
-            return False
-        logger.info("Probing %s", ip_address)
-        try:
-            sock = socket.create_connection((ip_address, 22), timeout=2)
-            sock.close()
-            return True
-        except (socket.timeout, socket.error):
-            return False
+        return is_ssh_reachable(ip_address)
 
     if __name__ == "__main__":
         print("This is a library. Nothing to run.")
@@ -4,9 +4,9 @@ Route53 manages our domains and DNS records.
 """
 import logging
 
-from boto.route53 import Route53Connection
 from boto.route53.record import Record
 
+from disco_aws_automation.client_registry import get_boto2_connection
 from disco_aws_automation.resource_helper import throttled_call
 
 logger = logging.getLogger(__name__)
@@ -18,7 +18,7 @@ class DiscoRoute53(object):
     """
 
     def __init__(self):
-        self.route53 = Route53Connection()
+        self.route53 = get_boto2_connection('route53')
 
     def list_zones(self):
         """Returns a list of Hosted Zones in Route53"""
@@ -86,6 +86,23 @@ class DiscoRoute53(object):
         for record in self.get_records_by_value(record_type, value):
             self.delete_record(record['zone_name'], record['record_name'], record_type)
 
+    def delete_records_by_values(self, record_type, values):
+        """
+        Delete records across all zones that contain any of the specified values, going through the
+        records of each zone only once
+        Args:
+            record_type (str): the type of record (A, AAAA, CNAME, etc)
+            values: the values to search for
+        """
+        values = set(values)
+        if not values:
+            return
+        logger.info('Deleting %s records with values %s', record_type, ', '.join(sorted(values)))
+        for zone in self.list_zones():
+            for record in self.list_records(zone.name):
+                if record.type == record_type and values.intersection(record.resource_records):
+                    self.delete_record(zone.name, record.name, record_type)
+
     def get_records_by_value(self, record_type, value):
         """
         Get records across all zones that contain the specified value
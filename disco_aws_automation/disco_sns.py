@@ -5,6 +5,8 @@ import itertools
 import boto
 from boto.exception import BotoServerError
 
+from .client_registry import get_boto2_connection
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,14 +16,14 @@ class DiscoSNS(object):
     """
 
     def __init__(self, connection=None, account_id=None):
-        self.sns = connection or boto.connect_sns()
+        self.sns = connection or get_boto2_connection('sns')
 
         # account_id is useful for constructing topic ARNs
         # we get the account_id per https://groups.google.com/forum/#!topic/boto-users/QhASXlNBm40
         if not account_id:
             try:
                 # Attempt to look up ARN from user information.
-                arn = boto.connect_iam().get_user().arn
+                arn = get_boto2_connection('iam').get_user().arn
             except BotoServerError:
                 # Instance Roles have no user ID, so we fetch the instance profile arn
                 logger.debug(
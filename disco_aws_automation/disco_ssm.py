@@ -7,10 +7,10 @@ import time
 import json
 from ConfigParser import NoOptionError
 
-import boto3
 from botocore.exceptions import ClientError
 
 from . import read_config
+from .client_registry import get_boto3_client
 from .resource_helper import throttled_call, wait_for_state_boto3
 from .exceptions import TimeoutError
 from .disco_creds import DiscoS3Bucket
@@ -49,7 +49,7 @@ class DiscoSSM(object):
     def conn(self):
         """The boto3 ssm connection object"""
         if not self._conn:
-            self._conn = boto3.client('ssm')
+            self._conn = get_boto3_client('ssm')
         return self._conn
 
     def get_s3_bucket_name(self):
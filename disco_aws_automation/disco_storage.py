@@ -15,7 +15,8 @@ import logging
 
 import boto
 
-from .resource_helper import wait_for_state, TimeoutError
+from .client_registry import get_boto2_connection
+from .resource_helper import BatchWaiter, TimeoutError
 from .exceptions import VolumeError
 from .resource_helper import throttled_call
 
@@ -124,9 +125,14 @@ class DiscoStorage(object):
     """
 
     def __init__(self, environment_name, connection=None):
-        self.connection = connection if connection else boto.connect_ec2()
+        self._connection = connection
         self.environment_name = environment_name
 
+    @property
+    def connection(self):
+        """The boto2 ec2 connection passed in, or else the calling thread's own one"""
+        return self._connection or get_boto2_connection('ec2')
+
     def is_ebs_optimized(self, instance_type):
         """Returns true if the instance type is EBS Optimized"""
         return instance_type in EBS_OPTIMIZED
@@ -150,10 +156,11 @@ class DiscoStorage(object):
     def wait_for_snapshot(self, snapshot):
         """Wait for a snapshot to become available"""
         try:
-            wait_for_state(snapshot, 'completed', state_attr='status', timeout=TIME_BEFORE_SNAP_WARNING)
+            BatchWaiter(self.connection, "snapshot", timeout=TIME_BEFORE_SNAP_WARNING).wait(
+                [snapshot.id], 'completed')
         except TimeoutError:
             logger.warning("Waiting for snapshot to become available...")
-            wait_for_state(snapshot, 'completed', state_attr='status')
+            BatchWaiter(self.connection, "snapshot").wait([snapshot.id], 'completed')
             logger.warning("... done.")
 
     def create_snapshot_bdm(self, snapshot, iops):
@@ -260,7 +267,7 @@ class DiscoStorage(object):
             try:
                 volume = throttled_call(self.connection.create_volume, size=size, zone=zone)
                 logger.info("Created temporary volume %s in zone %s.", volume.id, zone.name)
-                wait_for_state(volume, 'available', state_attr='status')
+                BatchWaiter(self.connection, "volume").wait([volume.id], 'available')
                 snapshot = volume.create_snapshot()
                 snapshot.add_tag('hostclass', hostclass)
                 snapshot.add_tag('env', self.environment_name)
@@ -4,15 +4,14 @@ Subnet abstraction
 
 import logging
 
-import boto3
-
+from .client_registry import get_boto3_client
 from .disco_eip import DiscoEIP
 from .resource_helper import (
     keep_trying,
     find_or_create,
     create_filters,
     throttled_call,
-    wait_for_state_boto3
+    BatchWaiter
 )
 
 logger = logging.getLogger(__name__)
@@ -62,7 +61,7 @@ class DiscoSubnet(object):
         Lazily creates boto3 EC2 connection
         """
         if not self._boto3_connection:
-            self._boto3_connection = boto3.client('ec2')
+            self._boto3_connection = get_boto3_client('ec2')
         return self._boto3_connection
 
     @property
@@ -165,9 +164,7 @@ class DiscoSubnet(object):
 
             if self._is_using_dyno_nat():
                 # Need to wait for the NAT gateway to be deleted
-                wait_for_state_boto3(self.boto3_ec2.describe_nat_gateways,
-                                     {'NatGatewayIds': [nat_gateway_id]},
-                                     'NatGateways', 'deleted', 'State')
+                BatchWaiter(self.boto3_ec2, "nat_gateway").wait([nat_gateway_id], 'deleted', missing_ok=True)
 
                 self.disco_eip.release(eip)
                 self._delete_dyno_nat_tag()
@@ -11,12 +11,12 @@ import time
 from ConfigParser import ConfigParser
 
 from boto.exception import EC2ResponseError
-import boto3
 
 from netaddr import IPNetwork, IPSet
 
 from disco_aws_automation.network_helper import calc_subnet_offset
 from . import normalize_path
+from .client_registry import get_boto3_client, get_boto3_resource
 
 from .disco_alarm import DiscoAlarm
 from .disco_alarm_config import DiscoAlarmsConfig
@@ -63,7 +63,7 @@ class DiscoVPC(object):
         if boto3_ec2:
             self.boto3_ec2 = boto3_ec2
         else:
-            self.boto3_ec2 = boto3.client('ec2')
+            self.boto3_ec2 = get_boto3_client('ec2')
 
         self.rds = DiscoRDS(vpc=self)
         self.elb = DiscoELB(vpc=self)
@@ -165,7 +165,7 @@ class DiscoVPC(object):
         """
         Returns an instance of this class for the specified VPC, or None if it does not exist
         """
-        client = boto3.client('ec2')
+        client = get_boto3_client('ec2')
         if vpc_id:
             vpcs = throttled_call(
                 client.describe_vpcs,
@@ -332,7 +332,7 @@ class DiscoVPC(object):
         self.vpc = throttled_call(self.boto3_ec2.create_vpc, CidrBlock=str(vpc_cidr))['Vpc']
         waiter = self.boto3_ec2.get_waiter('vpc_available')
         waiter.wait(VpcIds=[self.vpc['VpcId']])
-        ec2 = boto3.resource('ec2')
+        ec2 = get_boto3_resource('ec2')
         vpc = ec2.Vpc(self.vpc['VpcId'])
         tags = vpc.create_tags(Tags=[{'Key': 'Name', 'Value': self.environment_name},
                                      {'Key': 'type', 'Value': self.environment_type}])
@@ -511,7 +511,7 @@ class DiscoVPC(object):
     @staticmethod
     def find_vpc_id_by_name(vpc_name):
         """Find VPC by name"""
-        client = boto3.client('ec2')
+        client = get_boto3_client('ec2')
         vpcs = throttled_call(
             client.describe_vpcs,
             Filters=create_filters({'tag:Name': [vpc_name]})
@@ -526,7 +526,7 @@ class DiscoVPC(object):
     @staticmethod
     def list_vpcs():
         """Returns list of boto.vpc.vpc.VPC classes, one for each existing VPC"""
-        client = boto3.client('ec2')
+        client = get_boto3_client('ec2')
         vpcs = throttled_call(client.describe_vpcs)
         return [{'id': vpc['VpcId'],
                  'tags': tag2dict(vpc['Tags'] if 'Tags' in vpc else None),
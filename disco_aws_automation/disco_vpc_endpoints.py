@@ -4,7 +4,7 @@ Create / Destroy VPC endpoints
 
 import json
 
-import boto3
+from .client_registry import get_boto3_client
 from .resource_helper import throttled_call
 
 S3_POLICY = {
@@ -34,7 +34,7 @@ class DiscoVPCEndpoints(object):
         Lazily creates boto3 EC2 connection
         """
         if not self._boto3_ec2:
-            self._boto3_ec2 = boto3.client('ec2')
+            self._boto3_ec2 = get_boto3_client('ec2')
         return self._boto3_ec2
 
     def service_name(self, service):
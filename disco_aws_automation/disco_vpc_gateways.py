@@ -8,7 +8,7 @@ import time
 from boto.exception import EC2ResponseError
 
 from .resource_helper import (
-    wait_for_state_boto3, find_or_create, create_filters, throttled_call)
+    BatchWaiter, find_or_create, create_filters, throttled_call)
 from .disco_eip import DiscoEIP
 from .disco_subnet import DYNO_NAT_TAG_KEY
 from .exceptions import (TimeoutError, EIPConfigError)
@@ -284,8 +284,8 @@ class DiscoVPCGateways(object):
             throttled_call(self.boto3_ec2.delete_nat_gateway, NatGatewayId=nat_gateway['NatGatewayId'])
 
         # Need to wait for all the NAT gateways to be deleted
-        wait_for_state_boto3(self.boto3_ec2.describe_nat_gateways, nat_filter,
-                             'NatGateways', 'deleted', 'State')
+        BatchWaiter(self.boto3_ec2, "nat_gateway").wait(
+            [nat_gateway['NatGatewayId'] for nat_gateway in nat_gateways], 'deleted', missing_ok=True)
 
         # Release EIPs of dynamically configured subnets
         subnet_filter = {'Filters': create_filters(
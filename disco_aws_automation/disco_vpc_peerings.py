@@ -5,9 +5,9 @@ This module contains logic that processes a VPC's peering connections
 import logging
 
 from boto.exception import EC2ResponseError
-import boto3
 
 from . import read_config
+from .client_registry import get_boto3_client
 from .resource_helper import tag2dict, create_filters, throttled_call
 from .exceptions import VPCPeeringSyntaxError
 # FIXME: Disabling complaint about relative-import. This seems to be the only
@@ -113,7 +113,7 @@ class DiscoVPCPeerings(object):
     @staticmethod
     def create_peering_connections(peering_configs):
         """ create vpc peering configuration from the peering config dictionary"""
-        client = boto3.client('ec2')
+        client = get_boto3_client('ec2')
         for peering in peering_configs.keys():
             vpc_map = peering_configs[peering]['vpc_map']
             vpc_metanetwork_map = peering_configs[peering]['vpc_metanetwork_map']
@@ -178,7 +178,7 @@ class DiscoVPCPeerings(object):
         """
         peerings = DiscoVPCPeerings._get_peering_lines()
 
-        client = boto3.client('ec2')
+        client = get_boto3_client('ec2')
         peering_configs = {}
         for peering in peerings:
             peering_config = DiscoVPCPeerings.parse_peering_connection_line(peering, client)
@@ -318,7 +318,7 @@ class DiscoVPCPeerings(object):
     @staticmethod
     def delete_peerings(vpc_id=None):
         """Delete peerings. If vpc_id is specified, delete all peerings of the VPCs only"""
-        client = boto3.client('ec2')
+        client = get_boto3_client('ec2')
         for peering in DiscoVPCPeerings.list_peerings(vpc_id):
             try:
                 logger.info('deleting peering connection %s', peering['VpcPeeringConnectionId'])
@@ -337,7 +337,7 @@ class DiscoVPCPeerings(object):
         If vpc_id is given, return only that vpcs peerings
         Peerings that cannot be manipulated are ignored.
         """
-        client = boto3.client('ec2')
+        client = get_boto3_client('ec2')
         if vpc_id:
             peerings = throttled_call(
                 client.describe_vpc_peering_connections,
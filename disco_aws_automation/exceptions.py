@@ -52,6 +52,11 @@ class SmokeTestError(RuntimeError):
     pass
 
 
+class ProvisioningError(RuntimeError):
+    """ Error provisioning one or more hostclasses """
+    pass
+
+
 class AMIError(RuntimeError):
     """ Amazon Machine Image Error """
     pass
@@ -0,0 +1,96 @@
+"""
+Process wide rate limiting of AWS API calls.
+
+Every AWS service and region gets one token bucket limiter that is shared by all threads. When AWS
+throttles a call the limiter halves its rate, and each successful call raises the rate again by a
+small step (additive increase, multiplicative decrease). Concurrent callers therefore settle on the
+rate AWS allows instead of all backing off and retrying at the same moment.
+"""
+import logging
+import threading
+import time
+
+from boto.connection import AWSAuthConnection
+
+logger = logging.getLogger(__name__)
+
+MAX_CALL_RATE = 20.0  # calls per second
+MIN_CALL_RATE = 0.5  # calls per second
+CALL_RATE_INCREASE = 0.1  # calls per second gained with each successful call
+CALL_RATE_DECREASE_FACTOR = 0.5  # rate multiplier applied when a call is throttled
+BURST_SIZE = 10  # calls that can be made at once after a quiet period
+
+
+class AdaptiveRateLimiter(object):
+    """Thread safe token bucket whose rate adapts to throttling"""
+
+    def __init__(self, name, max_rate=MAX_CALL_RATE, min_rate=MIN_CALL_RATE, burst=BURST_SIZE):
+        self.name = name
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.rate = max_rate
+        self._tokens = float(burst)
+        self._last_refill = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """Blocks until a call may be made. Returns the number of seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def throttled(self):
+        """Records that AWS throttled a call, multiplicatively decreasing the rate"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * CALL_RATE_DECREASE_FACTOR)
+            self._tokens = min(self._tokens, 0)
+        logger.debug("Throttled by %s, reduced call rate to %.2f/s", self.name, self.rate)
+
+    def succeeded(self):
+        """Records a successful call, additively increasing the rate"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + CALL_RATE_INCREASE)
+
+
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(service, region=None):
+    """Returns the rate limiter shared by all calls to an AWS service in a region"""
+    key = (service, region)
+    with _RATE_LIMITERS_LOCK:
+        if key not in _RATE_LIMITERS:
+            _RATE_LIMITERS[key] = AdaptiveRateLimiter(name="{0}/{1}".format(service, region or "default"))
+        return _RATE_LIMITERS[key]
+
+
+def get_rate_limiter_for_call(fun):
+    """
+    Returns the rate limiter for the AWS service a function calls, based on the boto3 client or
+    boto2 connection the function is bound to, or None for any other function.
+    """
+    owner = getattr(fun, '__self__', None)
+    meta = getattr(owner, 'meta', None)
+    if meta is not None and hasattr(meta, 'service_model'):
+        return get_rate_limiter(meta.service_model.service_name, meta.region_name)
+    # Only boto2 connections are asked for their host, other objects may compute it in a property
+    host = getattr(owner, 'host', None) if isinstance(owner, AWSAuthConnection) else None
+    if isinstance(host, basestring):
+        # boto2 connection hosts already name both service and region, e.g. ec2.us-west-2.amazonaws.com
+        return get_rate_limiter(host)
+    return None
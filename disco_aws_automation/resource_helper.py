@@ -2,6 +2,7 @@
 This module has a bunch of functions about waiting for an AWS resource to become available
 """
 import logging
+import random
 import time
 
 from botocore.exceptions import ClientError
@@ -12,12 +13,16 @@ from .exceptions import (
     ExpectedTimeoutError,
     S3WritingError
 )
+from .rate_limiter import get_rate_limiter_for_call
+from .api_profiler import API_PROFILER
 
 logger = logging.getLogger(__name__)
 
+THROTTLING_ERROR_CODES = ("Throttling", "RequestLimitExceeded")
 STATE_POLL_INTERVAL = 2  # seconds
 INSTANCE_SSHABLE_POLL_INTERVAL = 15  # seconds
 MAX_POLL_INTERVAL = 60  # seconds
+BATCH_DESCRIBE_MAX_IDS = 200  # AWS limit on the number of values of a describe filter
 
 
 def create_filters(filter_dict):
@@ -46,6 +51,35 @@ def find_or_create(find, create):
         return create()
 
 
+def _error_code(err):
+    """Returns the AWS error code of a boto2 or boto3 exception, or None for any other exception"""
+    if isinstance(err, BotoServerError):
+        return err.error_code
+    elif isinstance(err, ClientError):
+        return err.response['Error'].get('Code', 'Unknown')
+    return None
+
+
+def _call_name(limiter, fun):
+    """Returns the name under which retries of fun are profiled"""
+    return "{0}:{1}".format(limiter.name if limiter else "local", getattr(fun, '__name__', fun))
+
+
+def _rate_limited_call(limiter, fun, *args, **kwargs):
+    """Calls fun once, waiting for the rate limiter first and reporting the outcome to it"""
+    if not limiter:
+        return fun(*args, **kwargs)
+    API_PROFILER.record_rate_limit_wait(_call_name(limiter, fun), limiter.acquire())
+    try:
+        result = fun(*args, **kwargs)
+    except Exception as err:
+        if _error_code(err) in THROTTLING_ERROR_CODES:
+            limiter.throttled()
+        raise
+    limiter.succeeded()
+    return result
+
+
 def keep_trying(max_time, fun, *args, **kwargs):
     """
     Execute function fun with args and kwargs until it does
@@ -55,22 +89,28 @@ def keep_trying(max_time, fun, *args, **kwargs):
     increasing number seconds following the fibonacci series
     (up to MAX_POLL_INTERVAL seconds).
 
+    Calls of AWS client methods are paced by the rate limiter
+    of their service, see rate_limiter.
+
     Note: If you are only concerned about throttling use throttled_call
     instead. Any irrecoverable exception within a keep_trying will
     cause a max_time delay.
     """
 
+    limiter = get_rate_limiter_for_call(fun)
     last_delay = 0
     curr_delay = 1
     expire_time = time.time() + max_time
     while True:
         try:
-            return fun(*args, **kwargs)
-        except Exception:
+            return _rate_limited_call(limiter, fun, *args, **kwargs)
+        except Exception as err:
             if logging.getLogger().level == logging.DEBUG:
                 logger.exception("Failed to run %s.", fun)
             if time.time() > expire_time:
                 raise
+            API_PROFILER.record_retry(_call_name(limiter, fun), curr_delay,
+                                      throttled=_error_code(err) in THROTTLING_ERROR_CODES)
             time.sleep(curr_delay)
             delay_register = last_delay
             last_delay = curr_delay
@@ -82,30 +122,31 @@ def throttled_call(fun, *args, **kwargs):
     Execute function fun with args and kwargs until it does
     not throw a throttled exception or 5 minutes have passed.
 
-    After each failed attempt a delay is introduced of an
-    increasing number seconds following the fibonacci series
-    (up to MAX_POLL_INTERVAL seconds).
+    Calls of AWS client methods are paced by the rate limiter of
+    their service, which slows down every thread calling that service
+    when one of them is throttled. After each throttled attempt a
+    delay is introduced of a random part of an increasing number
+    seconds following the fibonacci series (up to MAX_POLL_INTERVAL
+    seconds), so that throttled threads don't retry in lockstep.
     """
+    limiter = get_rate_limiter_for_call(fun)
     max_time = 5 * 60
     last_delay = 0
     curr_delay = 1
     expire_time = time.time() + max_time
     while True:
         try:
-            return fun(*args, **kwargs)
+            return _rate_limited_call(limiter, fun, *args, **kwargs)
         except (BotoServerError, ClientError) as err:
             if logging.getLogger().level == logging.DEBUG:
                 logger.exception("Failed to run %s.", fun)
 
-            if isinstance(err, BotoServerError):
-                error_code = err.error_code
-            else:
-                error_code = err.response['Error'].get('Code', 'Unknown')
-
-            if (error_code not in ("Throttling", "RequestLimitExceeded")) or (time.time() > expire_time):
+            if (_error_code(err) not in THROTTLING_ERROR_CODES) or (time.time() > expire_time):
                 raise
 
-            time.sleep(curr_delay)
+            delay = random.uniform(curr_delay / 2.0, curr_delay)
+            API_PROFILER.record_retry(_call_name(limiter, fun), delay, throttled=True)
+            time.sleep(delay)
             delay_register = last_delay
             last_delay = curr_delay
             curr_delay = min(curr_delay + delay_register, MAX_POLL_INTERVAL)
@@ -174,6 +215,130 @@ def wait_for_state_boto3(describe_func, params_dict, resources_name,
         time_passed += STATE_POLL_INTERVAL
 
 
+def _describe_boto2(method_name, filter_name, state_attr):
+    """Returns a describe function for a kind of boto2 resource, see BatchWaiter"""
+    def _describe(connection, resource_ids):
+        resources = throttled_call(getattr(connection, method_name), filters={filter_name: resource_ids})
+        return {resource.id: (getattr(resource, state_attr), resource) for resource in resources}
+    return _describe
+
+
+def _describe_nat_gateways(connection, resource_ids):
+    """Describe function for NAT gateways using a boto3 ec2 client, see BatchWaiter"""
+    nat_gateways = throttled_call(
+        connection.describe_nat_gateways,
+        Filters=create_filters({'nat-gateway-id': resource_ids})
+    )['NatGateways']
+    return {nat_gateway['NatGatewayId']: (nat_gateway['State'], nat_gateway) for nat_gateway in nat_gateways}
+
+
+class BatchWaiter(object):
+    """
+    Waits for many resources of one kind to reach a state.
+
+    All resources still being waited on are polled together, with one describe call per
+    BATCH_DESCRIBE_MAX_IDS resources per round. The delay between rounds grows exponentially
+    from poll_interval up to max_poll_interval, with random jitter so that waiters started at
+    the same time don't poll in lockstep.
+
+    The connection is a boto2 ec2 connection for instances, volumes, snapshots and images and
+    a boto3 ec2 client for NAT gateways. Callers waiting for several resources, like the AMIs of
+    a spinup or the NAT gateways of a VPC, should pass all of them to one wait.
+    """
+    KINDS = {
+        "instance": _describe_boto2("get_only_instances", "instance-id", "state"),
+        "volume": _describe_boto2("get_all_volumes", "volume-id", "status"),
+        "snapshot": _describe_boto2("get_all_snapshots", "snapshot-id", "status"),
+        "image": _describe_boto2("get_all_images", "image-id", "state"),
+        "nat_gateway": _describe_nat_gateways,
+    }
+
+    def __init__(self, connection, kind, timeout=15 * 60, poll_interval=STATE_POLL_INTERVAL,
+                 max_poll_interval=MAX_POLL_INTERVAL):
+        if kind not in BatchWaiter.KINDS:
+            raise ValueError("Can't wait for resources of kind {0}".format(kind))
+        self.connection = connection
+        self.kind = kind
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    def _describe(self, resource_ids):
+        described = {}
+        for index in range(0, len(resource_ids), BATCH_DESCRIBE_MAX_IDS):
+            described.update(BatchWaiter.KINDS[self.kind](
+                self.connection, resource_ids[index:index + BATCH_DESCRIBE_MAX_IDS]))
+        return described
+
+    def settle(self, resource_ids, state, failure_states=(u'failed', u'terminated', u'error'),
+               missing_ok=False):
+        """
+        Generator yielding a (resource_id, state, resource) tuple for each resource as soon as it has
+        reached either the requested state or one of the failure states. The resource is the boto2
+        object or boto3 dict returned by the last describe call.
+
+        Resources AWS doesn't return are assumed not to exist yet, unless missing_ok is set in which
+        case they are considered settled, which is handy when waiting for deletions.
+
+        Raises TimeoutError if some resources have not settled after timeout seconds.
+        """
+        pending = list(resource_ids)
+        start_time = time.time()
+        delay = self.poll_interval
+        while pending:
+            try:
+                described = self._describe(pending)
+            except (EC2ResponseError, ClientError):
+                logger.debug("Failed to describe %ss %s", self.kind, pending, exc_info=True)
+                described = None  # These are most likely transient, we will timeout if they are not
+
+            if described is not None:
+                still_pending = []
+                for resource_id in pending:
+                    current_state, resource = described.get(resource_id, (None, None))
+                    if current_state == state or current_state in failure_states:
+                        yield resource_id, current_state, resource
+                    elif current_state is None and missing_ok:
+                        yield resource_id, None, None
+                    else:
+                        still_pending.append(resource_id)
+                pending = still_pending
+
+            if not pending:
+                break
+
+            time_passed = time.time() - start_time
+            if time_passed >= self.timeout:
+                raise TimeoutError(
+                    "Timed out waiting for {0}s {1} to change state to {2} after {3}s."
+                    .format(self.kind, " ".join(pending), state, int(time_passed)))
+
+            time.sleep(random.uniform(delay / 2.0, delay))
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def wait(self, resource_ids, state, failure_states=(u'failed', u'terminated', u'error'),
+             missing_ok=False):
+        """
+        Waits for all resources to reach state and returns a dict of the described resources keyed by id.
+
+        Raises ExpectedTimeoutError if any resource entered one of the failure states and TimeoutError
+        if some resources have not settled after timeout seconds.
+        """
+        settled = {}
+        failed = []
+        for resource_id, current_state, resource in self.settle(resource_ids, state, failure_states,
+                                                                missing_ok=missing_ok):
+            settled[resource_id] = resource
+            if current_state != state and current_state in failure_states:
+                failed.append("{0} ({1})".format(resource_id, current_state))
+
+        if failed:
+            raise ExpectedTimeoutError(
+                "{0}s {1} failed to reach state {2}".format(self.kind, ", ".join(failed), state))
+
+        return settled
+
+
 def wait_for_sshable(remotecmd, instance, timeout=15 * 60, quiet=False):
     """Returns True when host is up and sshable
     returns False on timeout
@@ -183,7 +348,8 @@ def wait_for_sshable(remotecmd, instance, timeout=15 * 60, quiet=False):
 
     if not quiet:
         logger.info("Waiting for instance %s to be fully provisioned.", instance.id)
-    wait_for_state(instance, u'running', timeout)
+    BatchWaiter(instance.connection, "instance", timeout=timeout).wait([instance.id], u'running')
+    instance.update()  # pick up the addresses assigned on boot
     if not quiet:
         logger.info("Instance %s running (booting up).", instance.id)
 
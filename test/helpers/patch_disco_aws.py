@@ -25,14 +25,16 @@ The mocks will be provided as keyword arguments starting with mock.  For example
 See PATCH_LIST and patch_disco_aws for available mocks and their names.
 """
 from ConfigParser import NoSectionError, NoOptionError
+from functools import wraps
 
 from mock import Mock, patch
 from moto import mock_ec2, mock_s3, mock_autoscaling, mock_route53, mock_elb
 
+from disco_aws_automation.client_registry import clear_clients
 from test.helpers.patcher import patcher
 
 TEST_ENV_NAME = "unittestenv"
-PATCH_LIST = [patch("disco_aws_automation.disco_aws.wait_for_state",
+PATCH_LIST = [patch("disco_aws_automation.disco_aws.BatchWaiter",
                     kwargs_field="mock_wait"),
               patch("disco_aws_automation.disco_vpc.DiscoVPC.fetch_environment",
                     kwargs_field="mock_fetch_env")]
@@ -90,6 +92,16 @@ def get_mock_config(config_dict=None):
     return mock_config
 
 
+def fresh_clients(func):
+    '''Decorator that makes the wrapped function create its own AWS connections'''
+    @wraps(func)
+    def _fresh(*args, **kwargs):
+        clear_clients()
+        return func(*args, **kwargs)
+    return _fresh
+
+
 patch_disco_aws = patcher(patches=PATCH_LIST,
-                          decorators=[mock_ec2, mock_s3, mock_autoscaling, mock_route53, mock_elb],
+                          decorators=[mock_ec2, mock_s3, mock_autoscaling, mock_route53, mock_elb,
+                                      fresh_clients],
                           mock_config=get_mock_config())
@@ -6,6 +6,7 @@ from unittest import TestCase
 
 from mock import MagicMock, patch, ANY, call
 import boto.ec2.autoscale
+import boto.ec2.blockdevicemapping
 
 from disco_aws_automation import DiscoAutoscale
 
@@ -178,6 +179,7 @@ class DiscoAutoscaleTests(TestCase):
         self._autoscale.get_launch_config = MagicMock(return_value=mock_lc)
         self._autoscale.update_group = MagicMock()
         self._autoscale.get_existing_group = MagicMock(return_value="group")
+        self._autoscale.get_configs = MagicMock(return_value=[])
         self._autoscale.update_snapshot("snap-NEW", 99, hostclass="mhcfoo")
         self.assertNotEqual(self._autoscale.update_group.mock_calls, [call("group", mock_lc.name)])
         self.assertEqual(mock_lc.block_device_mappings["/dev/snap"].snapshot_id, "snap-NEW")
@@ -274,6 +276,22 @@ class DiscoAutoscaleTests(TestCase):
 
         self.assertEqual(self._autoscale.get_configs(), good_lgs)
 
+    def test_get_existing_groups_cached(self):
+        '''get_existing_groups reuses cached groups until a group is created'''
+        groups = MagicMock()
+        groups.next_token = None
+        groups.__iter__.return_value = [self.mock_group("mhcfoo")]
+        self._mock_connection.get_all_groups.return_value = groups
+
+        self._autoscale.get_existing_groups()
+        self._autoscale.get_existing_groups()
+        self.assertEqual(self._mock_connection.get_all_groups.call_count, 1)
+
+        self._autoscale.create_group(hostclass="mhcfoo", launch_config="launch_config-X",
+                                     vpc_zone_id="zone-X")
+        self._autoscale.get_existing_groups()
+        self.assertEqual(self._mock_connection.get_all_groups.call_count, 2)
+
     def test_get_launch_configs_filter(self):
         '''get_launch_configs correctly filters out empty launch config names'''
         mock_groups = [
@@ -293,3 +311,91 @@ class DiscoAutoscaleTests(TestCase):
                 mock_groups[1].launch_config_name
             ]
         )
+
+    def _mock_listing(self, items):
+        listing = MagicMock()
+        listing.next_token = None
+        listing.__iter__.return_value = items
+        return listing
+
+    def test_get_or_create_config_reuses(self):
+        '''get_or_create_config only creates a launch configuration if there is no identical one'''
+        params = {"image_id": "ami-12345678", "instance_type": "m3.large",
+                  "user_data": "hostclass=\"mhcfoo\""}
+        self._mock_connection.get_all_launch_configurations.return_value = self._mock_listing([])
+
+        config = self._autoscale.get_or_create_config("mhcfoo", **params)
+        self.assertRegexpMatches(config.name, r"^us-moon-1_mhcfoo_[0-9a-f]{16}$")
+        self.assertEqual(self._mock_connection.create_launch_configuration.call_count, 1)
+
+        self._mock_connection.get_all_launch_configurations.return_value = self._mock_listing([config])
+        self.assertIs(self._autoscale.get_or_create_config("mhcfoo", **params), config)
+        self.assertEqual(self._mock_connection.create_launch_configuration.call_count, 1)
+
+    def test_config_digest(self):
+        '''Launch configurations with the same parameters get the same name and others do not'''
+        bdm = boto.ec2.blockdevicemapping.BlockDeviceMapping()
+        bdm["/dev/sda"] = boto.ec2.blockdevicemapping.BlockDeviceType(snapshot_id="snap-1", size=8)
+        same_bdm = boto.ec2.blockdevicemapping.BlockDeviceMapping()
+        same_bdm["/dev/sda"] = boto.ec2.blockdevicemapping.BlockDeviceType(snapshot_id="snap-1", size=8)
+        other_bdm = boto.ec2.blockdevicemapping.BlockDeviceMapping()
+        other_bdm["/dev/sda"] = boto.ec2.blockdevicemapping.BlockDeviceType(snapshot_id="snap-1", size=9)
+
+        def _digest(image_id, bdm):
+            return DiscoAutoscale._config_digest({"image_id": image_id, "block_device_mappings": [bdm]})
+        self.assertEqual(_digest("ami-1", bdm), _digest("ami-1", same_bdm))
+        self.assertNotEqual(_digest("ami-1", bdm), _digest("ami-1", other_bdm))
+        self.assertNotEqual(_digest("ami-1", bdm), _digest("ami-2", bdm))
+
+    def test_clean_configs_skips_used(self):
+        '''clean_configs only deletes the launch configurations no group uses'''
+        used_config = self.mock_lg("mhcfoo")
+        unused_configs = [self.mock_lg("mhcbar"), self.mock_lg("mhcbaz")]
+        self._mock_connection.get_all_groups.return_value = self._mock_listing(
+            [self.mock_group("mhcfoo", launch_config_name=used_config.name)])
+        self._mock_connection.get_all_launch_configurations.return_value = self._mock_listing(
+            [used_config] + unused_configs)
+        # Created up front as MagicMock doesn't create children thread safely for the delete pool
+        self._mock_boto3_connection.delete_launch_configuration = MagicMock()
+
+        self._autoscale.clean_configs()
+
+        self.assertEqual(
+            sorted(_call[1]["LaunchConfigurationName"]
+                   for _call in self._mock_boto3_connection.delete_launch_configuration.call_args_list),
+            sorted(config.name for config in unused_configs))
+        self._mock_connection.delete_launch_configuration.assert_not_called()
+
+    def test_deferred_config_cleanup(self):
+        '''clean_configs does nothing within deferred_config_cleanup, which cleans up once on exit'''
+        unused_config = self.mock_lg("mhcbar")
+        self._mock_connection.get_all_groups.return_value = self._mock_listing([])
+        self._mock_connection.get_all_launch_configurations.return_value = self._mock_listing(
+            [unused_config])
+
+        with self._autoscale.deferred_config_cleanup():
+            self._autoscale.clean_configs()
+            self._mock_boto3_connection.delete_launch_configuration.assert_not_called()
+
+        self._mock_boto3_connection.delete_launch_configuration.assert_called_once_with(
+            LaunchConfigurationName=unused_config.name)
+
+    def test_delete_hostclasses_groups(self):
+        '''delete_hostclasses_groups deletes the groups of the given hostclasses and their configs'''
+        groups = [self.mock_group("mhcfoo"), self.mock_group("mhcbar"), self.mock_group("mhcbaz")]
+        self._autoscale.get_existing_groups = MagicMock(return_value=groups)
+        self._autoscale.delete_config = MagicMock()
+        # Created up front as MagicMock doesn't create children thread safely for the delete pool
+        self._mock_boto3_connection.delete_auto_scaling_group = MagicMock()
+
+        self._autoscale.delete_hostclasses_groups(["mhcfoo", "mhcbar"], force=True, max_concurrency=2)
+
+        self.assertEqual(
+            sorted(_call[1]["AutoScalingGroupName"]
+                   for _call in self._mock_boto3_connection.delete_auto_scaling_group.call_args_list),
+            sorted(group.name for group in groups[:2]))
+        self._mock_boto3_connection.delete_auto_scaling_group.assert_any_call(
+            AutoScalingGroupName=groups[0].name, ForceDelete=True)
+        self.assertEqual(
+            sorted(_call[0][0] for _call in self._autoscale.delete_config.call_args_list),
+            sorted(group.launch_config_name for group in groups[:2]))
@@ -11,6 +11,7 @@ from disco_aws_automation import DiscoAlarmConfig
 from disco_aws_automation import DiscoSNS
 from disco_aws_automation import AlarmConfigError
 from disco_aws_automation import DiscoELB
+from disco_aws_automation.client_registry import clear_clients
 from test.helpers.patch_disco_aws import get_mock_config
 
 TOPIC_ARN = "arn:aws:sns:us-west-2:123456789012:ci"
@@ -25,6 +26,7 @@ class DiscoAlarmTests(TestCase):
     """Test disco_alarm"""
 
     def setUp(self):
+        clear_clients()
         self.autoscale = MagicMock()
         self.autoscale.get_existing_group.return_value.name = MOCK_GROUP_NAME
         self.elasticsearch = MagicMock()
@@ -115,6 +117,19 @@ class DiscoAlarmTests(TestCase):
         self.alarm.delete_hostclass_environment_alarms(ENVIRONMENT, "hcfoo")
         self.assertEqual(1, self._alarm_count())
 
+    def test_delete_by_hostclasses(self):
+        """
+        Deletion of several hostclasses at once
+        """
+        self.alarm._upsert_alarm(self._make_alarm(hostclass="hcfoo").to_metric_alarm(TOPIC_ARN))
+        self.alarm._upsert_alarm(self._make_alarm(hostclass="hcbar").to_metric_alarm(TOPIC_ARN))
+        self.alarm._upsert_alarm(self._make_alarm(hostclass="hcbaz").to_metric_alarm(TOPIC_ARN))
+        self.assertEqual(3, self._alarm_count())
+        self.alarm.delete_hostclasses_environment_alarms(ENVIRONMENT, ["hcfoo", "hcbar"])
+        self.assertEqual(1, self._alarm_count())
+        self.alarm.delete_hostclasses_environment_alarms("otherenv", ["hcbaz"])
+        self.assertEqual(1, self._alarm_count())
+
     def test_get_alarms(self):
         """Test that get_alarms filter works"""
         self.alarm._upsert_alarm(self._make_alarm(hostclass="hcfoo").to_metric_alarm(TOPIC_ARN))
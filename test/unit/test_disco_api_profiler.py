@@ -0,0 +1,75 @@
+"""
+Tests of api_profiler
+"""
+from unittest import TestCase
+
+from mock import MagicMock
+
+from disco_aws_automation.api_profiler import ApiProfiler
+
+
+class DiscoApiProfilerTests(TestCase):
+    '''Test ApiProfiler class'''
+
+    def setUp(self):
+        self.profiler = ApiProfiler()
+        self.profiler.enable()
+
+    def test_disabled(self):
+        """Nothing is recorded and connections are left alone while profiling is disabled"""
+        profiler = ApiProfiler()
+        connection = MagicMock(host="ec2.us-west-2.amazonaws.com")
+        make_request = connection.make_request
+        profiler.record_call("ec2", "DescribeInstances", 0.1)
+
+        self.assertIs(profiler.profile_connection(connection).make_request, make_request)
+        self.assertEqual(profiler.summary()["total_calls"], 0)
+
+    def test_record_call(self):
+        """Calls are counted per service and operation with a latency histogram"""
+        self.profiler.record_call("ec2", "DescribeInstances", 0.07)
+        self.profiler.record_call("ec2", "DescribeInstances", 20, error=True)
+
+        summary = self.profiler.summary()
+        stats = summary["operations"]["ec2.DescribeInstances"]
+        self.assertEqual(summary["total_calls"], 2)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["max_seconds"], 20)
+        self.assertEqual(stats["latency_histogram"]["<=0.1s"], 1)
+        self.assertEqual(stats["latency_histogram"][">10.0s"], 1)
+
+    def test_record_retry(self):
+        """Throttles, failures and sleep time are recorded per retried function"""
+        self.profiler.record_retry("ec2:describe_instances", 1, throttled=True)
+        self.profiler.record_retry("ec2:describe_instances", 2, throttled=False)
+        self.profiler.record_rate_limit_wait("ec2:describe_instances", 0.5)
+
+        self.assertEqual(self.profiler.summary()["retries"]["ec2:describe_instances"],
+                         {"throttles": 1, "failures": 1, "sleep_seconds": 3, "rate_limit_wait_seconds": 0.5})
+
+    def test_profile_boto2_connection(self):
+        """Requests of boto2 connections are recorded"""
+        connection = MagicMock(spec=["make_request", "host"], host="autoscaling.us-west-2.amazonaws.com")
+        connection.make_request.return_value = MagicMock(status=200)
+
+        self.profiler.profile_connection(connection)
+        connection.make_request("DescribeAutoScalingGroups", {})
+
+        self.assertEqual(
+            self.profiler.summary()["operations"]["autoscaling.DescribeAutoScalingGroups"]["calls"], 1)
+
+    def test_profile_boto3_client(self):
+        """Calls of boto3 clients are recorded through client events"""
+        client = MagicMock(spec=["meta"])
+        self.profiler.profile_connection(client)
+        model = MagicMock()
+        model.name = "DescribeVpcs"
+        model.service_model.service_name = "ec2"
+        context = {}
+
+        client.meta.events.register.assert_any_call("before-call", self.profiler._before_boto3_call)
+        self.profiler._before_boto3_call(model=model, params={}, context=context)
+        self.profiler._after_boto3_call(model=model, http_response=MagicMock(status_code=200),
+                                        parsed={}, context=context)
+
+        self.assertEqual(self.profiler.summary()["operations"]["ec2.DescribeVpcs"]["calls"], 1)
@@ -6,11 +6,11 @@ from unittest import TestCase
 
 import boto.ec2.instance
 from boto.exception import EC2ResponseError
-from mock import MagicMock, call, patch, create_autospec
+from mock import ANY, MagicMock, call, patch, create_autospec
 from moto import mock_elb
 
 from disco_aws_automation import DiscoAWS
-from disco_aws_automation.exceptions import TimeoutError, SmokeTestError
+from disco_aws_automation.exceptions import TimeoutError, SmokeTestError, ProvisioningError
 
 from test.helpers.patch_disco_aws import (patch_disco_aws,
                                           get_default_config_dict,
@@ -428,6 +428,52 @@ class DiscoAWSTests(TestCase):
         self.instance.tags.get = MagicMock(return_value=None)
         self.assertRaises(TimeoutError, aws.smoketest_once, self.instance)
 
+    def _get_smoketest_aws(self, mock_config, instances):
+        aws = DiscoAWS(config=mock_config, environment_name=TEST_ENV_NAME, boto2_conn=MagicMock())
+
+        def _get_all_instances(filters):
+            return [MagicMock(instances=[instance for instance in instances
+                                         if instance.id in filters["instance-id"]])]
+
+        aws.connection.get_all_instances.side_effect = _get_all_instances
+        return aws
+
+    def _get_smoketest_instance(self, instance_id, state="running", smoketest="100"):
+        instance = MagicMock(id=instance_id, state=state)
+        instance.tags = {"smoketest": smoketest} if smoketest else {}
+        return instance
+
+    @patch_disco_aws
+    def test_smoketest_batches_describe(self, mock_config, **kwargs):
+        """smoketest refreshes instances with one describe call per 200 instances"""
+        instances = [self._get_smoketest_instance("i-{0:08d}".format(index)) for index in xrange(250)]
+        aws = self._get_smoketest_aws(mock_config, instances)
+
+        aws.smoketest(instances)
+
+        self.assertEqual(aws.connection.get_all_instances.call_count, 2)
+        for instance in instances:
+            self.assertFalse(instance.update.called)
+
+    @patch_disco_aws
+    def test_smoketest_terminated(self, mock_config, **kwargs):
+        """smoketest raises SmokeTestError if an instance has terminated"""
+        instances = [self._get_smoketest_instance("i-00000001"),
+                     self._get_smoketest_instance("i-00000002", state="terminated", smoketest=None)]
+        aws = self._get_smoketest_aws(mock_config, instances)
+
+        self.assertRaises(SmokeTestError, aws.smoketest, instances)
+
+    @patch_disco_aws
+    @patch("time.sleep")
+    def test_smoketest_timeout(self, mock_sleep, mock_config, **kwargs):
+        """smoketest raises TimeoutError for instances unknown to AWS or not yet smoketested"""
+        instances = [self._get_smoketest_instance("i-00000001", smoketest=None),
+                     self._get_smoketest_instance("i-00000002")]
+        aws = self._get_smoketest_aws(mock_config, instances[:1])
+
+        self.assertRaises(TimeoutError, aws.smoketest, instances, timeout=0)
+
     @patch_disco_aws
     def test_is_terminal_state_updates(self, mock_config, **kwargs):
         '''is_terminal_state calls instance update'''
@@ -463,3 +509,264 @@ class DiscoAWSTests(TestCase):
     def test_is_running_running(self, mock_config, **kwargs):
         '''is_running returns true for running instance'''
         self.assertTrue(DiscoAWS.is_running(self.instance))
+
+    def _get_spinup_aws(self, mock_config, mock_bake=None, failing_hostclasses=(), pending_hostclasses=()):
+        if mock_bake:
+            mock_bake.return_value.find_ami.side_effect = \
+                lambda stage, hostclass, ami, **kwargs: MagicMock(
+                    hostclass=hostclass, id="ami-" + hostclass,
+                    state=u'pending' if hostclass in pending_hostclasses else u'available')
+            mock_bake.ami_hostclass.side_effect = lambda ami: ami.hostclass
+        aws = DiscoAWS(config=mock_config, environment_name=TEST_ENV_NAME, boto2_conn=MagicMock(),
+                       autoscale=MagicMock(), vpc=MagicMock(), elb=MagicMock(), alarms=MagicMock(),
+                       log_metrics=MagicMock(), storage=MagicMock())
+        aws.autoscale.get_existing_groups.return_value = []
+        aws.autoscale.get_hostclass.side_effect = lambda group_name: group_name.split("_")[0]
+
+        def _provision(ami, hostclass, **kwargs):
+            if hostclass in failing_hostclasses:
+                raise RuntimeError("provision failed")
+            return {"hostclass": hostclass, "group_name": "{0}_group".format(hostclass)}
+
+        aws.provision = MagicMock(side_effect=_provision)
+        aws.wait_for_autoscaling_instances = MagicMock(return_value=[])
+        aws.iter_autoscaling_instances = MagicMock(side_effect=lambda metadata_list: iter([]))
+        aws.smoketest = MagicMock()
+        return aws
+
+    def _get_pipeline(self, hostclasses):
+        return [{"sequence": sequence, "hostclass": hostclass, "instance_type": "m3.large"}
+                for sequence, hostclass in hostclasses]
+
+    @patch_disco_aws
+    @patch("disco_aws_automation.disco_aws.DiscoBake")
+    def test_spinup_provisions_each_sequence(self, mock_bake, mock_config, **kwargs):
+        """spinup provisions every hostclass of every sequence group"""
+        aws = self._get_spinup_aws(mock_config, mock_bake)
+        pipeline = self._get_pipeline([(1, "mhca"), (1, "mhcb"), (1, "mhcc"), (2, "mhcd")])
+
+        aws.spinup(pipeline, max_concurrency=2)
+
+        self.assertEqual(
+            sorted([_call[1]["hostclass"] for _call in aws.provision.call_args_list]),
+            ["mhca", "mhcb", "mhcc", "mhcd"])
+        self.assertEqual(aws.iter_autoscaling_instances.call_count, 2)
+
+    @patch_disco_aws
+    @patch("disco_aws_automation.disco_aws.DiscoBake")
+    def test_spinup_waits_for_amis_at_once(self, mock_bake, mock_config, mock_wait, **kwargs):
+        """spinup waits for all the AMIs that aren't available yet with one waiter"""
+        aws = self._get_spinup_aws(mock_config, mock_bake, pending_hostclasses=("mhca", "mhcc"))
+        pipeline = self._get_pipeline([(1, "mhca"), (1, "mhcb"), (2, "mhcc")])
+
+        aws.spinup(pipeline, max_concurrency=2)
+
+        self.assertEqual(mock_wait.return_value.wait.call_count, 1)
+        self.assertEqual(sorted(mock_wait.return_value.wait.call_args[0][0]), ["ami-mhca", "ami-mhcc"])
+        self.assertEqual([_call[1]["ami"].state for _call in aws.provision.call_args_list],
+                         [u'available'] * 3)
+
+    @patch_disco_aws
+    @patch("disco_aws_automation.disco_aws.DiscoBake")
+    def test_spinup_rolls_back_on_failure(self, mock_bake, mock_config, **kwargs):
+        """spinup rolls back what it provisioned for a sequence group and reports every failed hostclass"""
+        aws = self._get_spinup_aws(mock_config, mock_bake, failing_hostclasses=("mhcb", "mhcc"))
+        aws.autoscale.get_existing_groups.return_value = [MagicMock()]
+        aws.autoscale.get_existing_groups.return_value[0].name = "mhcd_group"
+        pipeline = self._get_pipeline([(1, "mhca"), (1, "mhcb"), (1, "mhcc"), (1, "mhcd"), (2, "mhce")])
+
+        with self.assertRaises(ProvisioningError) as context:
+            aws.spinup(pipeline, max_concurrency=3)
+
+        self.assertIn("mhcb", str(context.exception))
+        self.assertIn("mhcc", str(context.exception))
+        aws.autoscale.delete_groups.assert_called_once_with(group_name="mhca_group", force=True)
+        # mhcd already had a group, which still uses its ELB, alarms and log groups
+        aws.elb.delete_elbs.assert_called_once_with(["mhca"], testing=False)
+        aws.alarms.delete_hostclasses_environment_alarms.assert_called_once_with(TEST_ENV_NAME, ["mhca"])
+        aws.log_metrics.delete_hostclasses_log_groups.assert_called_once_with(["mhca"])
+        self.assertNotIn("mhce", [_call[1]["hostclass"] for _call in aws.provision.call_args_list])
+        aws.iter_autoscaling_instances.assert_not_called()
+
+    @patch_disco_aws
+    @patch("disco_aws_automation.disco_aws.DiscoBake")
+    def test_spinup_dependency_order(self, mock_bake, mock_config, **kwargs):
+        """spinup starts each hostclass only after the hostclasses it depends on"""
+        aws = self._get_spinup_aws(mock_config, mock_bake)
+        pipeline = [
+            {"hostclass": "mhca", "depends_on": "mhcb mhcc", "smoke_test": "no"},
+            {"hostclass": "mhcb", "depends_on": "mhcc", "smoke_test": "yes"},
+            {"hostclass": "mhcc", "depends_on": "", "smoke_test": "no"}]
+
+        aws.spinup(pipeline, max_concurrency=3)
+
+        self.assertEqual([_call[1]["hostclass"] for _call in aws.provision.call_args_list],
+                         ["mhcc", "mhcb", "mhca"])
+        aws.wait_for_autoscaling_instances.assert_called_once_with(
+            [{"hostclass": "mhcb", "group_name": "mhcb_group"}])
+
+    @patch_disco_aws
+    @patch("disco_aws_automation.disco_aws.DiscoBake")
+    def test_spinup_dependency_failure(self, mock_bake, mock_config, **kwargs):
+        """spinup does not start dependents of a hostclass that failed to spin up"""
+        aws = self._get_spinup_aws(mock_config, mock_bake, failing_hostclasses=("mhcb",))
+        pipeline = [
+            {"hostclass": "mhca", "depends_on": "mhcb"},
+            {"hostclass": "mhcb", "depends_on": ""}]
+
+        with self.assertRaises(ProvisioningError) as context:
+            aws.spinup(pipeline)
+
+        self.assertIn("Not started: mhca", str(context.exception))
+        self.assertEqual(aws.provision.call_count, 1)
+        aws.autoscale.delete_groups.assert_not_called()
+
+    @patch_disco_aws
+    @patch("disco_aws_automation.disco_aws.DiscoBake")
+    def test_spinup_dependency_rolls_back(self, mock_bake, mock_config, **kwargs):
+        """spinup rolls back every hostclass it provisioned when one fails its smoke tests"""
+        aws = self._get_spinup_aws(mock_config, mock_bake)
+        aws.smoketest.side_effect = SmokeTestError("smoke tests failed")
+        pipeline = [
+            {"hostclass": "mhca", "depends_on": "mhcb", "smoke_test": "no"},
+            {"hostclass": "mhcb", "depends_on": "mhcc", "smoke_test": "yes"},
+            {"hostclass": "mhcc", "depends_on": "", "smoke_test": "no"}]
+
+        with self.assertRaises(ProvisioningError) as context:
+            aws.spinup(pipeline, testing=True)
+
+        self.assertIn("Not started: mhca", str(context.exception))
+        deleted_groups = [_call[1]["group_name"] for _call in aws.autoscale.delete_groups.call_args_list]
+        self.assertEqual(sorted(deleted_groups), ["mhcb_group", "mhcc_group"])
+        aws.elb.delete_elbs.assert_called_once_with(["mhcb", "mhcc"], testing=True)
+        aws.alarms.delete_hostclasses_environment_alarms.assert_not_called()
+
+    def test_pipeline_dependencies_cycle(self):
+        """Dependency cycles in a pipeline are rejected"""
+        pipeline = [
+            {"hostclass": "mhca", "depends_on": "mhcb"},
+            {"hostclass": "mhcb", "depends_on": "mhca"},
+            {"hostclass": "mhcc", "depends_on": ""}]
+        self.assertRaises(ProvisioningError, DiscoAWS._pipeline_dependencies, pipeline)
+
+    def test_pipeline_dependencies_unknown(self):
+        """Dependencies on hostclasses missing from the pipeline are rejected"""
+        pipeline = [{"hostclass": "mhca", "depends_on": "mhcz"}]
+        self.assertRaises(ProvisioningError, DiscoAWS._pipeline_dependencies, pipeline)
+
+    @patch_disco_aws
+    @patch("disco_aws_automation.disco_aws.is_ssh_reachable")
+    def test_find_jump_address_cached(self, mock_reachable, mock_config, **kwargs):
+        """The jump host is only looked up again once it stops accepting ssh connections"""
+        aws = DiscoAWS(config=mock_config, environment_name=TEST_ENV_NAME)
+        aws.find_jump_host = MagicMock(side_effect=[
+            MagicMock(ip_address="1.2.3.4"), MagicMock(ip_address=None, private_ip_address="10.0.0.5")])
+        mock_reachable.return_value = True
+
+        self.assertEqual(aws.find_jump_address(), "1.2.3.4")
+        self.assertEqual(aws.find_jump_address(), "1.2.3.4")
+        self.assertEqual(aws.find_jump_host.call_count, 1)
+        mock_reachable.assert_called_with("1.2.3.4")
+
+        mock_reachable.return_value = False
+        self.assertEqual(aws.find_jump_address(), "10.0.0.5")
+        self.assertEqual(aws.find_jump_host.call_count, 2)
+
+    @patch_disco_aws
+    def test_remotecmd_parallel(self, mock_config, **kwargs):
+        """Commands run on every instance and results come back in the order of the instances"""
+        aws = DiscoAWS(config=mock_config, environment_name=TEST_ENV_NAME)
+        aws._disco_remote_exec = MagicMock()
+        aws.find_jump_address = MagicMock(return_value="1.2.3.4")
+        instances = [MagicMock(id="i-{0}".format(index)) for index in range(5)]
+
+        def _remotecmd(instance, remote_command, output_handler, **kwargs):
+            output_handler("out of {0}\n".format(instance.id))
+            return (1 if instance.id == "i-3" else 0, "out of {0}\n".format(instance.id))
+        aws.remotecmd = MagicMock(side_effect=_remotecmd)
+        output = []
+
+        results = aws.remotecmd_parallel(instances, ["uptime"], user="root", max_concurrency=3, timeout=60,
+                                         output_handler=lambda instance, line: output.append(line))
+        self.assertEqual([code for code, _ in results], [0, 0, 0, 1, 0])
+        self.assertEqual(results[2][1], "out of i-2\n")
+        self.assertEqual(sorted(output), ["out of i-{0}\n".format(index) for index in range(5)])
+        aws.remotecmd.assert_any_call(instances[0], ["uptime"], user="root", nothrow=True,
+                                      output_handler=ANY, timeout=60)
+
+    @patch_disco_aws
+    def test_instances_from_selectors(self, mock_config, **kwargs):
+        """Each kind of selector is one filtered describe call and every instance is returned once"""
+        aws = DiscoAWS(config=mock_config, environment_name=TEST_ENV_NAME)
+        foo1 = MagicMock(id="i-1", tags={"hostclass": "mhcfoo", "hostname": "mhcfoo-1"})
+        foo2 = MagicMock(id="i-2", tags={"hostclass": "mhcfoo", "hostname": "mhcfoo-2"})
+        bar = MagicMock(id="i-3", tags={"hostclass": "mhcbar", "hostname": "mhcbar-1"})
+        aws.instances = MagicMock(side_effect=[[foo1, foo2], [foo2, bar]])
+
+        instances = aws.instances_from_selectors(hostclasses=["mhcfoo", "mhcfoo"],
+                                                 hostnames=["mhcbar-1", "mhcfoo-2", "mhcnone-1"])
+        self.assertEqual(instances, [foo1, foo2, bar])
+        aws.instances.assert_has_calls([
+            call(filters={"tag:hostclass": ["mhcfoo"]}),
+            call(filters={"tag:hostname": ["mhcbar-1", "mhcfoo-2", "mhcnone-1"]})])
+        self.assertEqual(aws.instances.call_count, 2)
+
+    @patch_disco_aws
+    def test_instances_from_asgs_chunked(self, mock_config, **kwargs):
+        """Long lists of filter values are split over several describe calls"""
+        aws = DiscoAWS(config=mock_config, environment_name=TEST_ENV_NAME)
+        aws.instances = MagicMock(return_value=[])
+        asgs = ["asg-{0:03}".format(index) for index in range(250)]
+        self.assertEqual(aws.instances_from_asgs(asgs), [])
+        aws.instances.assert_has_calls([
+            call(filters={"tag:aws:autoscaling:groupName": asgs[:200]}),
+            call(filters={"tag:aws:autoscaling:groupName": asgs[200:]})])
+        self.assertEqual(aws.instances_from_hostclasses([]), [])
+        self.assertEqual(aws.instances.call_count, 2)
+
+    def _get_autoscaling_group(self, name, min_size, instance_ids):
+        group = MagicMock(min_size=min_size, instances=[MagicMock(instance_id=_id) for _id in instance_ids])
+        group.name = name
+        return group
+
+    @patch_disco_aws
+    @patch("time.sleep")
+    def test_iter_autoscaling_instances(self, mock_sleep, mock_config, **kwargs):
+        """Groups are yielded as they reach min_size and only groups still scaling are polled"""
+        aws = DiscoAWS(config=mock_config, environment_name=TEST_ENV_NAME, autoscale=MagicMock())
+        aws.autoscale.get_groups.side_effect = [
+            [self._get_autoscaling_group("foo_1", 1, ["i-1"]),
+             self._get_autoscaling_group("bar_1", 2, ["i-2"])],
+            [self._get_autoscaling_group("bar_1", 2, ["i-2", "i-3"])]]
+        aws.instances = MagicMock(side_effect=lambda instance_ids: instance_ids)
+
+        results = list(aws.iter_autoscaling_instances([{"group_name": "foo_1"}, {"group_name": "bar_1"}]))
+
+        self.assertEqual(results, [("foo_1", ["i-1"]), ("bar_1", ["i-2", "i-3"])])
+        aws.autoscale.get_groups.assert_has_calls([call(["bar_1", "foo_1"]), call(["bar_1"])])
+        aws.autoscale.get_instances.assert_not_called()
+
+    @patch_disco_aws
+    @patch("time.sleep")
+    def test_wait_for_autoscaling_instances_timeout(self, mock_sleep, mock_config, **kwargs):
+        """Waiting for groups that don't reach min_size times out"""
+        aws = DiscoAWS(config=mock_config, environment_name=TEST_ENV_NAME, autoscale=MagicMock())
+        aws.autoscale.get_groups.return_value = [self._get_autoscaling_group("foo_1", 2, ["i-1"])]
+
+        self.assertRaises(TimeoutError, aws.wait_for_autoscaling_instances, [{"group_name": "foo_1"}],
+                          timeout=0)
+
+    @patch_disco_aws
+    def test_spindown_all_hostclasses_at_once(self, mock_config, **kwargs):
+        """spindown deletes the resources of all hostclasses with one call each"""
+        aws = self._get_spinup_aws(mock_config)
+
+        aws.spindown(["mhca", "mhcb"], max_concurrency=2)
+
+        aws.autoscale.delete_hostclasses_groups.assert_called_once_with(
+            ["mhca", "mhcb"], force=True, max_concurrency=2)
+        aws.elb.delete_elbs.assert_called_once_with(["mhca", "mhcb"], max_concurrency=2)
+        aws.alarms.delete_hostclasses_environment_alarms.assert_called_once_with(
+            TEST_ENV_NAME, ["mhca", "mhcb"])
+        aws.log_metrics.delete_hostclasses_log_groups.assert_called_once_with(
+            ["mhca", "mhcb"], max_concurrency=2)
@@ -1,10 +1,12 @@
 """
 Tests of disco_bake
 """
+import datetime
 import random
 from unittest import TestCase
 
 import boto.ec2.instance
+from boto.exception import EC2ResponseError
 from mock import MagicMock, Mock, PropertyMock, ANY, create_autospec
 
 from disco_aws_automation import DiscoBake, AMIError
@@ -101,3 +103,128 @@ class DiscoBakeTests(TestCase):
         '''Test that list amis can filter by productline and stage successfully'''
         self.assertEqual(self._bake.list_amis(stage="tested", product_line="someone_else"),
                          [self._amis_by_name["mhcbar 1"]])
+
+    def test_get_ami_creation_times(self):
+        '''Test that the snapshots of all AMIs without a timestamp are looked up at once'''
+        def _ami(ami_id, name, snapshot_ids):
+            ami = MagicMock(id=ami_id)
+            ami.name = name
+            ami.block_device_mapping = {
+                "/dev/sd{0}".format(index): MagicMock(snapshot_id=snapshot_id)
+                for index, snapshot_id in enumerate(snapshot_ids)}
+            return ami
+        amis = [_ami("ami-1", "mhcfoo 1400000000", ["snap-1"]),
+                _ami("ami-2", "mhcbar", ["snap-2", "snap-3", None]),
+                _ami("ami-3", "mhcbaz", [])]
+        self._bake.connection.get_all_snapshots.return_value = [
+            MagicMock(id="snap-2", start_time="2016-01-01T10:00:00.000Z"),
+            MagicMock(id="snap-3", start_time="2016-01-02T10:00:00.000Z")]
+
+        creation_times = self._bake.get_ami_creation_times(amis)
+        self.assertEqual(creation_times["ami-1"], DiscoBake.extract_ami_creation_time_from_ami_name(amis[0]))
+        self.assertEqual(creation_times["ami-2"], datetime.datetime(2016, 1, 2, 10))
+        self.assertIsNone(creation_times["ami-3"])
+        self.assertEqual(self._bake.connection.get_all_snapshots.call_count, 1)
+        self.assertEqual(sorted(self._bake.connection.get_all_snapshots.call_args[1]["snapshot_ids"]),
+                         ["snap-2", "snap-3"])
+
+    def test_get_amis_skip_missing(self):
+        '''Test that get_amis skips deregistered images when asked to'''
+        def _get_all_images(image_ids, **kwargs):
+            if "ami-gone" in image_ids:
+                raise EC2ResponseError(400, "Bad Request", body={
+                    "Error": {"Code": "InvalidAMIID.NotFound", "Message": "test"}})
+            return [MagicMock(id=image_id) for image_id in image_ids]
+        bake = DiscoBake(config=MagicMock(), connection=MagicMock())
+        bake.connection.get_all_images.side_effect = _get_all_images
+
+        amis = bake.get_amis(["ami-1", "ami-gone", "ami-2"], skip_missing=True)
+
+        self.assertEqual([ami.id for ami in amis], ["ami-1", "ami-2"])
+        self.assertRaises(EC2ResponseError, bake.get_amis, ["ami-1", "ami-gone"])
+
+    def test_find_ami(self):
+        '''Test that find_ami returns the newest AMI of a hostclass with a stage and productline'''
+        self.assertEqual(self._bake.find_ami("tested", "mhcfoo"), self._amis_by_name["mhcfoo 4"])
+        self.assertEqual(self._bake.find_ami("tested", "mhcbar", product_line="someone_else"),
+                         self._amis_by_name["mhcbar 1"])
+        self.assertIsNone(self._bake.find_ami("untested", "mhcbar"))
+        self._bake.get_amis.assert_called_with(filters={"name": "mhcbar *"})
+
+        self._bake.get_amis.return_value = [self._amis_by_name["mhcfoo 5"]]
+        self.assertEqual(self._bake.find_ami("tested", ami_id=self._amis_by_name["mhcfoo 5"].id),
+                         self._amis_by_name["mhcfoo 5"])
+        self._bake.get_amis.assert_called_with([self._amis_by_name["mhcfoo 5"].id])
+
+    def test_find_ami_with_index(self):
+        '''Test that find_ami looks up AMIs in an AmiIndex without listing images again'''
+        index = self._bake.ami_index()
+        self.assertEqual(self._bake.find_ami("tested", "mhcfoo", index=index), self._amis_by_name["mhcfoo 4"])
+        self.assertEqual(self._bake.find_ami("tested", "mhcbar", index=index), self._amis_by_name["mhcbar 2"])
+        self.assertIsNone(self._bake.find_ami("untested", "mhcbar", index=index))
+        self.assertEqual(self._bake.find_ami("tested", ami_id=self._amis_by_name["mhcfoo 5"].id, index=index),
+                         self._amis_by_name["mhcfoo 5"])
+        self._bake.get_amis.assert_called_once_with()
+
+    def test_ami_filter_index(self):
+        '''Test that ami_filter without a list of AMIs filters the cached index of all images in order'''
+        self.assertEqual(self._bake.ami_filter(None, hostclass="mhcfoo", state="available"),
+                         [self._amis_by_name["mhcfoo 4"], self._amis_by_name["mhcfoo 5"]])
+        self.assertEqual(self._bake.ami_filter(None, stage="tested"),
+                         [self._amis_by_name["mhcbar 2"], self._amis_by_name["mhcfoo 4"],
+                          self._amis_by_name["mhcbar 1"]])
+        self.assertEqual(self._bake.list_amis(product_line="astro"),
+                         [self._amis_by_name["mhcfoo 1"], self._amis_by_name["mhcfoo 4"]])
+        self._bake.get_amis.assert_called_once_with()
+
+    def test_list_stragglers(self):
+        '''Test that list_stragglers lists the images once for all hostclasses'''
+        self.add_ami('mhcbaz 3', 'untested')
+        stragglers = self._bake.list_stragglers(days=1)
+        self.assertEqual(stragglers, {"mhcfoo": self._amis_by_name["mhcfoo 1"],
+                                      "mhcbar": None,
+                                      "mhcbaz": self._amis_by_name["mhcbaz 3"]})
+        self._bake.get_amis.assert_called_once_with()
+
+    def test_bake_amis(self):
+        '''Test that bake_amis bakes from one phase 1 AMI and checks the repo once'''
+        self._bake._vpc = MagicMock()
+        self._bake._disco_remote_exec = MagicMock()
+        self._bake.option = MagicMock(side_effect=lambda key: {
+            "no_repo_hostclasses": "mhcnorepo", "phase1_hostclass": "mhcphase1"}.get(key, key))
+        self._bake.hc_option = MagicMock(return_value="2")
+        self._bake.is_repo_ready = MagicMock(return_value=True)
+        self._bake._get_phase1_ami_id = MagicMock(return_value="ami-phase1")
+
+        def _bake_ami(hostclass, no_destroy, source_ami_id=None, stage=None, check_repo=True):
+            self.assertEqual((source_ami_id, check_repo), ("ami-phase1", False))
+            if hostclass == "mhcbar":
+                raise AMIError("bake failed")
+            return MagicMock(id="ami-" + hostclass)
+
+        self._bake.bake_ami = MagicMock(side_effect=_bake_ami)
+        results = self._bake.bake_amis(["mhcfoo", "mhcbar", "mhcbaz"], max_concurrency=2)
+
+        self.assertEqual([(result["hostclass"], result["ami"]) for result in results],
+                         [("mhcfoo", "ami-mhcfoo"), ("mhcbar", None), ("mhcbaz", "ami-mhcbaz")])
+        self.assertEqual([bool(result["error"]) for result in results], [False, True, False])
+        self.assertEqual(self._bake.bake_ami.call_count, 3)
+        self._bake.is_repo_ready.assert_called_once_with()
+
+    def test_bake_amis_repo_not_ready(self):
+        '''Test that bake_amis only bakes the hostclasses that don't need the repo if it is down'''
+        self._bake.option = MagicMock(side_effect=lambda key: {
+            "no_repo_hostclasses": "mhcnorepo", "phase1_hostclass": "mhcphase1"}.get(key, key))
+        self._bake.hc_option = MagicMock(return_value="2")
+        self._bake.is_repo_ready = MagicMock(return_value=False)
+        self._bake._get_phase1_ami_id = MagicMock(return_value="ami-phase1")
+        self._bake.bake_ami = MagicMock(return_value=MagicMock(id="ami-new"))
+
+        results = self._bake.bake_amis(["mhcfoo", "mhcnorepo", "mhcbar"])
+
+        self.assertEqual([(result["hostclass"], result["ami"]) for result in results],
+                         [("mhcfoo", None), ("mhcnorepo", "ami-new"), ("mhcbar", None)])
+        self.assertEqual([bool(result["error"]) for result in results], [True, False, True])
+        self._bake.bake_ami.assert_called_once_with("mhcnorepo", False, source_ami_id="ami-phase1",
+                                                    stage=None, check_repo=False)
+        self._bake.is_repo_ready.assert_called_once_with()
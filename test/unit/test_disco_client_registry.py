@@ -0,0 +1,84 @@
+"""
+Tests of the AWS client registry
+"""
+import threading
+from unittest import TestCase
+
+from boto.connection import AWSAuthConnection
+from boto3.resources.base import ServiceResource
+from botocore.client import BaseClient
+from mock import MagicMock, patch
+
+from disco_aws_automation.client_registry import (
+    clear_clients,
+    get_boto2_connection,
+    get_boto3_client,
+    get_boto3_resource
+)
+
+
+def _in_other_thread(fun):
+    """Returns the result of calling fun in a new thread"""
+    results = []
+    thread = threading.Thread(target=lambda: results.append(fun()))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+class DiscoClientRegistryTests(TestCase):
+    '''Test the AWS client registry'''
+
+    def setUp(self):
+        clear_clients()
+
+    def tearDown(self):
+        clear_clients()
+
+    @patch('boto3.client', side_effect=lambda *args, **kwargs: MagicMock(spec=BaseClient))
+    def test_boto3_client_shared(self, client_mock):
+        """boto3 clients are created once per service and region and shared by all threads"""
+        client = get_boto3_client('ec2')
+        self.assertIs(client, get_boto3_client('ec2'))
+        self.assertIs(client, _in_other_thread(lambda: get_boto3_client('ec2')))
+        self.assertIsNot(client, get_boto3_client('ec2', 'us-east-1'))
+        self.assertIsNot(client, get_boto3_client('rds'))
+        self.assertEqual(client_mock.call_count, 3)
+        client_mock.assert_any_call('ec2')
+        client_mock.assert_any_call('ec2', region_name='us-east-1')
+
+    @patch('boto3.resource', side_effect=lambda *args, **kwargs: MagicMock(spec=ServiceResource))
+    def test_boto3_resource_per_thread(self, resource_mock):
+        """boto3 resources are reused within a thread but not shared between threads"""
+        resource = get_boto3_resource('iam')
+        self.assertIs(resource, get_boto3_resource('iam'))
+        self.assertIsNot(resource, _in_other_thread(lambda: get_boto3_resource('iam')))
+        self.assertEqual(resource_mock.call_count, 2)
+
+    @patch('boto.connect_ec2', side_effect=lambda: MagicMock(spec=AWSAuthConnection))
+    def test_boto2_connection_per_thread(self, connect_mock):
+        """boto2 connections are reused within a thread but not shared between threads"""
+        connection = get_boto2_connection('ec2')
+        self.assertIs(connection, get_boto2_connection('ec2'))
+        self.assertIsNot(connection, _in_other_thread(lambda: get_boto2_connection('ec2')))
+        self.assertEqual(connect_mock.call_count, 2)
+
+    def test_boto2_unknown_service(self):
+        """Asking for a boto2 connection to an unknown service raises"""
+        self.assertRaises(ValueError, get_boto2_connection, 'nosuchservice')
+
+    @patch('boto3.client')
+    def test_test_doubles_not_cached(self, client_mock):
+        """Objects that aren't boto clients are handed out but never cached"""
+        client_mock.side_effect = [MagicMock(), MagicMock()]
+        self.assertIsNot(get_boto3_client('ssm'), get_boto3_client('ssm'))
+
+    @patch('boto3.client', side_effect=lambda *args, **kwargs: MagicMock(spec=BaseClient))
+    @patch('boto.connect_route53', side_effect=lambda: MagicMock(spec=AWSAuthConnection))
+    def test_clear_clients(self, connect_mock, client_mock):
+        """clear_clients makes the registry create new clients and connections"""
+        client = get_boto3_client('elb')
+        connection = get_boto2_connection('route53')
+        clear_clients()
+        self.assertIsNot(client, get_boto3_client('elb'))
+        self.assertIsNot(connection, get_boto2_connection('route53'))
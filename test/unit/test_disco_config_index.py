@@ -0,0 +1,112 @@
+"""
+Tests of the configuration index
+"""
+from ConfigParser import ConfigParser, InterpolationError, NoOptionError, NoSectionError
+import os
+from StringIO import StringIO
+import tempfile
+from unittest import TestCase
+
+from disco_aws_automation import read_config
+from disco_aws_automation.config_index import ConfigIndex, get_config_index
+from test.helpers.patch_disco_aws import get_mock_config
+
+CONFIG = """
+[disco_aws]
+default_instance_type = m3.large
+default_instance_type@prod = m3.xlarge
+default_owner = nobody
+
+[mhcfoo]
+instance_type = t2.small
+Instance_Type@Staging = t2.medium
+"""
+
+
+def _parse(text):
+    config = ConfigParser()
+    config.readfp(StringIO(text))
+    return config
+
+
+class DiscoConfigIndexTests(TestCase):
+    '''Test ConfigIndex'''
+
+    def setUp(self):
+        self.index = ConfigIndex(_parse(CONFIG))
+
+    def test_get(self):
+        """get returns the plain value when there is no environment specific one"""
+        self.assertEqual(self.index.get("mhcfoo", "instance_type"), "t2.small")
+        self.assertEqual(self.index.get("mhcfoo", "instance_type", "ci"), "t2.small")
+
+    def test_get_environment_override(self):
+        """get prefers option@environment, ignoring case like ConfigParser does"""
+        self.assertEqual(self.index.get("mhcfoo", "instance_type", "staging"), "t2.medium")
+        self.assertEqual(self.index.get("mhcfoo", "INSTANCE_TYPE", "STAGING"), "t2.medium")
+
+    def test_get_missing(self):
+        """get raises the same errors as ConfigParser.get"""
+        self.assertRaises(NoOptionError, self.index.get, "mhcfoo", "owner")
+        self.assertRaises(NoSectionError, self.index.get, "mhcbar", "owner")
+
+    def test_lookup_falls_back(self):
+        """lookup returns the first candidate that is set, with environment overrides"""
+        candidates = [("mhcbar", "instance_type"), ("disco_aws", "default_instance_type")]
+        self.assertEqual(self.index.lookup(candidates), "m3.large")
+        self.assertEqual(self.index.lookup(candidates, "prod"), "m3.xlarge")
+        self.assertEqual(self.index.lookup(candidates, "prod"), "m3.xlarge")
+        self.assertEqual(self.index.lookup([("mhcfoo", "owner"), ("disco_aws", "default_owner")]), "nobody")
+
+    def test_lookup_missing(self):
+        """lookup raises for the last candidate when no candidate is set"""
+        with self.assertRaises(NoOptionError) as context:
+            self.index.lookup([("mhcfoo", "owner"), ("disco_aws", "default_zone")])
+        self.assertEqual(context.exception.option, "default_zone")
+
+    def test_interpolation(self):
+        """Values are interpolated, and a bad one only breaks lookups of its own option"""
+        index = ConfigIndex(_parse(CONFIG + "owner = %(instance_type)s-owner\nbroken = %(missing)s\n"))
+        self.assertEqual(index.get("mhcfoo", "owner"), "t2.small-owner")
+        self.assertRaises(InterpolationError, index.get, "mhcfoo", "broken")
+        self.assertRaises(InterpolationError, index.get, "mhcfoo", "broken")
+
+    def test_mock_config(self):
+        """Objects with sections and items methods can be indexed too"""
+        index = ConfigIndex(get_mock_config({"mhcfoo": {"Owner": "me", "Owner@ci": "you"}}))
+        self.assertEqual(index.get("mhcfoo", "Owner"), "me")
+        self.assertEqual(index.get("mhcfoo", "Owner", "ci"), "you")
+        self.assertRaises(NoOptionError, index.get, "mhcfoo", "owner")
+
+    def test_index_shared(self):
+        """There is one index per configuration object"""
+        config = _parse(CONFIG)
+        self.assertIs(get_config_index(config), get_config_index(config))
+        self.assertIsNot(get_config_index(config), get_config_index(_parse(CONFIG)))
+
+
+class DiscoReadConfigTests(TestCase):
+    '''Test read_config caching'''
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".ini")
+        os.close(handle)
+        self._write(CONFIG)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _write(self, text):
+        with open(self.path, "w") as config_file:
+            config_file.write(text)
+
+    def test_read_config_shared(self):
+        """read_config parses a file once until it is modified"""
+        config = read_config(self.path)
+        self.assertIs(config, read_config(self.path))
+
+        self._write(CONFIG + "owner = someone\n")
+        os.utime(self.path, (0, 0))
+        modified = read_config(self.path)
+        self.assertIsNot(config, modified)
+        self.assertEqual(modified.get("mhcfoo", "owner"), "someone")
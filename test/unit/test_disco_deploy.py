@@ -161,6 +161,8 @@ class DiscoDeployTests(TestCase):
         self._disco_bake.promote_ami = MagicMock()
         self._disco_bake.ami_stages = MagicMock(return_value=['untested', 'failed', 'tested'])
         self._disco_bake.get_ami_creation_time = DiscoBake.extract_ami_creation_time_from_ami_name
+        self._disco_bake.get_ami_creation_times = MagicMock(
+            side_effect=lambda amis: {ami.id: self._disco_bake.get_ami_creation_time(ami) for ami in amis})
         self._ci_deploy = DiscoDeploy(
             self._disco_aws, self._test_aws, self._disco_bake, self._disco_autoscale, self._disco_elb,
             pipeline_definition=MOCK_PIPELINE_DEFINITION,
@@ -305,6 +307,17 @@ class DiscoDeployTests(TestCase):
         self.assertEqual(self._ci_deploy.get_latest_tested_amis()['mhcfoo'],
                          self._amis_by_name['mhcfoo 3'])
 
+    def test_ami_creation_times_looked_up_once(self):
+        '''Tests that the creation times of all stage AMIs are looked up together and only once'''
+        self._ci_deploy._disco_bake.get_ami_creation_time = MagicMock()
+        self._ci_deploy._disco_bake.get_ami_creation_times.side_effect = lambda amis: {
+            ami.id: DiscoBake.extract_ami_creation_time_from_ami_name(ami) for ami in amis}
+        self._ci_deploy.get_test_amis()
+        self._ci_deploy.get_failed_amis()
+        self._ci_deploy._disco_bake.get_ami_creation_times.assert_called_once_with(
+            self._ci_deploy.all_stage_amis)
+        self._ci_deploy._disco_bake.get_ami_creation_time.assert_not_called()
+
     def test_get_latest_failed_amis_works(self):
         '''Tests that get_latest_failed_amis() returns latest failed amis'''
         self.assertEqual(self._ci_deploy.get_latest_failed_amis()['mhcfoo'],
@@ -1066,6 +1079,45 @@ class DiscoDeployTests(TestCase):
         self._ci_deploy._disco_bake.get_amis = MagicMock(return_value=amis)
         self.assertEqual(self._ci_deploy._get_latest_other_image_id('ami-11112222'), amis[1].id)
 
+    def test_get_old_and_new_instances(self):
+        '''_get_old_instances and _get_new_instances split the hostclass instances and look up the AMI once'''
+        ami = self.mock_ami("mhcabc 2")
+        self._ci_deploy._disco_bake.connection.get_image.return_value = ami
+        old_inst, new_inst = self.mock_instance(), self.mock_instance()
+        new_inst.image_id = ami.id
+        self._disco_autoscale.get_instances.return_value = [old_inst, new_inst]
+        self._disco_aws.instances.return_value = [old_inst, new_inst]
+
+        self.assertEqual(self._ci_deploy._get_old_instances(ami.id), [old_inst])
+        self.assertEqual(self._ci_deploy._get_new_instances(ami.id), [new_inst])
+        self._ci_deploy._disco_bake.connection.get_image.assert_called_once_with(ami.id)
+        self._disco_autoscale.get_instances.assert_called_with(hostclass="mhcabc")
+        self._disco_aws.instances.assert_called_with(instance_ids=[old_inst.id, new_inst.id])
+
+    def test_rollback_describes_instances_once(self):
+        '''The rollback of a failed AMI describes the hostclass instances once for old and new instances'''
+        ami = self.mock_ami("mhcintegrated 2")
+        self._ci_deploy._disco_bake.connection.get_image.return_value = ami
+        old_inst, new_inst = self.mock_instance(), self.mock_instance()
+        new_inst.image_id = ami.id
+        self._disco_autoscale.get_instances.return_value = [old_inst, new_inst]
+        self._disco_aws.instances.return_value = [old_inst, new_inst]
+        self._ci_deploy.run_integration_tests = MagicMock(return_value=True)
+        self._ci_deploy.wait_for_smoketests = MagicMock(return_value=False)
+
+        self._ci_deploy.test_ami(ami, dry_run=False)
+
+        self.assertEqual(self._disco_aws.instances.call_count, 1)
+        self._disco_aws.terminate.assert_called_once_with([new_inst], use_autoscaling=True)
+        self._disco_bake.get_amis.assert_called_once_with(image_ids=[old_inst.image_id])
+
+    def test_get_old_instances_without_group_instances(self):
+        '''_get_old_instances doesn't describe instances if the hostclass has none'''
+        self._ci_deploy._disco_bake.connection.get_image.return_value = self.mock_ami("mhcabc 2")
+        self._disco_autoscale.get_instances.return_value = []
+        self.assertEqual(self._ci_deploy._get_old_instances("ami-11112222"), [])
+        self._disco_aws.instances.assert_not_called()
+
     def test_maintenance_mode_failure(self):
         '''Test that we handle maintenance mode failure appropriately'''
         ami = MagicMock()
@@ -1266,17 +1318,22 @@ class DiscoDeployTests(TestCase):
         self._ci_deploy.test()
         self.assertEqual(self._ci_deploy.test_ami.call_count, 1)
 
+    def test_test_with_amis_raises(self):
+        '''Test that test without max_concurrency raises the error of the tested ami'''
+        self._ci_deploy.test_ami = MagicMock(side_effect=RuntimeError("deploy failed"))
+        self.assertRaises(RuntimeError, self._ci_deploy.test)
+
     def test_test_wo_amis(self):
         '''Test test without amis'''
         self._ci_deploy.get_test_amis = MagicMock(return_value=[])
         self._ci_deploy.test_ami = MagicMock()
-        self._ci_deploy.test()
+        self.assertEqual(self._ci_deploy.test(), [])
         self.assertEqual(self._ci_deploy.test_ami.call_count, 0)
 
     def test_update_with_amis(self):
         '''Test update with amis'''
         self._ci_deploy.update_ami = MagicMock()
-        self._ci_deploy.update()
+        self.assertEqual(len(self._ci_deploy.update()), 1)
         self.assertEqual(self._ci_deploy.update_ami.call_count, 1)
 
     def test_update_wo_amis(self):
@@ -1286,6 +1343,34 @@ class DiscoDeployTests(TestCase):
         self._ci_deploy.update()
         self.assertEqual(self._ci_deploy.update_ami.call_count, 0)
 
+    def test_test_parallel(self):
+        '''Test that test with max_concurrency tests every hostclass and reports each of them'''
+        def _test_ami(ami, dry_run, deployment_strategy):
+            if ami.name == 'mhcbluegreen 2':
+                raise RuntimeError("deploy failed")
+            elif DiscoBake.ami_hostclass(ami) == 'mhcfoo':
+                ami.tags.get.return_value = 'failed'
+            elif DiscoBake.ami_hostclass(ami) == 'mhctimedautoscale':
+                return False
+        self._ci_deploy.test_ami = MagicMock(side_effect=_test_ami)
+
+        results = self._ci_deploy.test(max_concurrency=2)
+
+        self.assertEqual(self._ci_deploy.test_ami.call_count, 4)
+        self.assertEqual([result['hostclass'] for result in results],
+                         ['mhcbluegreen', 'mhcbluegreennondeployable', 'mhcfoo', 'mhctimedautoscale'])
+        self.assertEqual([result['hostclass'] for result in results if result['error']],
+                         ['mhcbluegreen', 'mhcfoo', 'mhctimedautoscale'])
+        self.assertEqual([result['stage'] for result in results if result['hostclass'] == 'mhcfoo'],
+                         ['failed'])
+
+    def test_update_parallel_wo_amis(self):
+        '''Test update with max_concurrency without amis'''
+        self._ci_deploy.get_update_amis = MagicMock(return_value=[])
+        self._ci_deploy.update_ami = MagicMock()
+        self.assertEqual(self._ci_deploy.update(max_concurrency=2), [])
+        self.assertEqual(self._ci_deploy.update_ami.call_count, 0)
+
     def test_pending_ami(self):
         '''Ensure pending AMIs are not considered for deployment'''
         expected_ami = self.add_ami('mhcfoo 10', 'untested', 'pending')
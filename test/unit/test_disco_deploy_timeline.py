@@ -0,0 +1,78 @@
+"""
+Tests of deploy_timeline
+"""
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from mock import patch
+
+from disco_aws_automation.deploy_timeline import DeployTimeline, PUT_METRIC_DATA_MAX_ITEMS
+
+
+class DiscoDeployTimelineTests(TestCase):
+    '''Test DeployTimeline class'''
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(handle)
+        self.timeline = DeployTimeline()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _read_spans(self):
+        with open(self.path) as timeline_file:
+            return [json.loads(line) for line in timeline_file]
+
+    def test_disabled(self):
+        """Spans are handed out but not recorded while the timeline is disabled"""
+        with self.timeline.phase("smoketests", "mhcfoo", "ami-1") as span:
+            span["outcome"] = "passed"
+        self.assertEqual(self._read_spans(), [])
+
+    def test_nested_spans(self):
+        """Nested spans are written as they end and inherit the deploy, hostclass and AMI"""
+        self.timeline.enable(path=self.path)
+        with self.timeline.phase("blue_green_deploy", "mhcfoo", "ami-1"):
+            with self.timeline.phase("smoketests") as span:
+                span["outcome"] = "failed"
+            with self.assertRaises(RuntimeError):
+                with self.timeline.phase("rollback"):
+                    raise RuntimeError("teardown failed")
+
+        spans = self._read_spans()
+        self.assertEqual([(span["phase"], span["parent"], span["outcome"]) for span in spans],
+                         [("smoketests", "blue_green_deploy", "failed"),
+                          ("rollback", "blue_green_deploy", "error"),
+                          ("blue_green_deploy", None, "done")])
+        self.assertEqual(set((span["deploy"], span["hostclass"], span["ami"]) for span in spans),
+                         set([(spans[-1]["deploy"], "mhcfoo", "ami-1")]))
+        self.assertTrue(all(span["end"] >= span["start"] for span in spans))
+
+    @patch("disco_aws_automation.deploy_timeline.get_boto3_client")
+    def test_cloudwatch_metrics(self, client_mock):
+        """The durations of the spans of a deploy are sent to CloudWatch when the deploy ends"""
+        self.timeline.enable(namespace="Deploys")
+        with self.timeline.phase("classic_deploy", "mhcfoo", "ami-1"):
+            for _ in range(PUT_METRIC_DATA_MAX_ITEMS):
+                with self.timeline.phase("smoketests"):
+                    pass
+            client_mock.return_value.put_metric_data.assert_not_called()
+
+        calls = client_mock.return_value.put_metric_data.call_args_list
+        self.assertEqual([len(_call[1]["MetricData"]) for _call in calls], [PUT_METRIC_DATA_MAX_ITEMS, 1])
+        self.assertEqual(calls[-1][1]["Namespace"], "Deploys")
+        self.assertEqual(calls[-1][1]["MetricData"][0]["Dimensions"],
+                         [{"Name": "Phase", "Value": "classic_deploy"},
+                          {"Name": "Hostclass", "Value": "mhcfoo"}])
+
+    @patch("disco_aws_automation.deploy_timeline.get_boto3_client")
+    def test_cloudwatch_failure_ignored(self, client_mock):
+        """Failing to send metrics doesn't fail the deploy"""
+        client_mock.return_value.put_metric_data.side_effect = RuntimeError("no permission")
+        self.timeline.enable(namespace="Deploys")
+        with self.timeline.phase("classic_deploy", "mhcfoo", "ami-1"):
+            pass
+        self.assertEqual(client_mock.return_value.put_metric_data.call_count, 1)
@@ -0,0 +1,50 @@
+"""
+Tests of describe_cache
+"""
+from unittest import TestCase
+
+from mock import MagicMock, patch
+
+from disco_aws_automation.describe_cache import DescribeCache
+
+
+class DiscoDescribeCacheTests(TestCase):
+    '''Test DescribeCache class'''
+
+    def setUp(self):
+        self.cache = DescribeCache(ttl=10)
+        self.fetch = MagicMock(return_value=["i-1"])
+
+    def test_get_cached(self):
+        """Identical describes are only fetched once"""
+        self.assertEqual(self.cache.get("instances", self.fetch, filters={"a": ["b", "c"]}), ["i-1"])
+        self.assertEqual(self.cache.get("instances", self.fetch, filters={"a": ["b", "c"]}), ["i-1"])
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_get_different_params(self):
+        """Describes with different parameters are fetched separately"""
+        self.cache.get("instances", self.fetch, filters={"a": ["b"]})
+        self.cache.get("instances", self.fetch, filters={"a": ["c"]})
+        self.cache.get("images", self.fetch, filters={"a": ["b"]})
+        self.assertEqual(self.fetch.call_count, 3)
+
+    def test_get_expired(self):
+        """Describes are fetched again once the entry has expired"""
+        with patch("time.time", return_value=1000):
+            self.cache.get("instances", self.fetch)
+        with patch("time.time", return_value=1011):
+            self.cache.get("instances", self.fetch)
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_invalidate(self):
+        """Invalidating an operation drops only its entries"""
+        self.cache.get("instances", self.fetch)
+        self.cache.get("images", self.fetch)
+        self.cache.invalidate("instances")
+        self.cache.get("instances", self.fetch)
+        self.cache.get("images", self.fetch)
+        self.assertEqual(self.fetch.call_count, 3)
+
+        self.cache.invalidate()
+        self.cache.get("images", self.fetch)
+        self.assertEqual(self.fetch.call_count, 4)
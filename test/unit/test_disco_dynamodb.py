@@ -4,6 +4,7 @@ from boto.dynamodb2.fields import HashKey, RangeKey, GlobalAllIndex
 from boto.dynamodb2.table import Table
 from moto import mock_dynamodb2
 from disco_aws_automation import DiscoDynamoDB
+from disco_aws_automation.client_registry import clear_clients
 from disco_aws_automation.exceptions import DynamoDBEnvironmentError
 
 
@@ -24,6 +25,9 @@ MOCK_TABLE_WRITE_THROUGHPUT_UPDATE = 19
 class DiscoDynamoDBTests(TestCase):
     """Test disco_dynamodb"""
 
+    def setUp(self):
+        clear_clients()
+
     @mock_dynamodb2
     def test_list_tables(self):
         """ Ensures DiscoDynamoDB returns names of all the tables in sorted order """
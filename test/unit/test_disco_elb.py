@@ -3,6 +3,7 @@ from unittest import TestCase
 from mock import MagicMock
 from moto import mock_elb
 from disco_aws_automation import DiscoELB, CommandError
+from disco_aws_automation.client_registry import clear_clients
 
 TEST_ENV_NAME = 'unittestenv'
 TEST_HOSTCLASS = 'mhcunit'
@@ -37,6 +38,7 @@ class DiscoELBTests(TestCase):
     """Test DiscoELB"""
 
     def setUp(self):
+        clear_clients()
         self.route53 = MagicMock()
         self.acm = MagicMock()
         self.iam = MagicMock()
@@ -310,6 +312,17 @@ class DiscoELBTests(TestCase):
         self.disco_elb.delete_elb(hostclass='mhcbar')
         self.assertEquals(len(self.disco_elb.list()), 0)
 
+    @mock_elb
+    def test_delete_elbs(self):
+        """Test deletion of the ELBs of several hostclasses"""
+        self._create_elb(hostclass='mhcbar')
+        self._create_elb(hostclass='mhcfoo')
+        self._create_elb(hostclass='mhcbaz')
+        self.disco_elb.delete_elbs(['mhcbar', 'mhcfoo', 'mhcnoelb'], max_concurrency=1)
+        self.assertEquals([elb['LoadBalancerName'] for elb in self.disco_elb.list()],
+                          [DiscoELB.get_elb_id(TEST_ENV_NAME, 'mhcbaz')])
+        self.assertEquals(self.route53.delete_records_by_values.call_count, 1)
+
     @mock_elb
     def test_destroy_all_elbs(self):
         """Test deletion of all ELBs"""
@@ -0,0 +1,32 @@
+"""
+Tests that importing the disco_aws_automation package stays cheap
+"""
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+HEAVY_MODULES = ["boto", "boto3", "botocore", "elasticsearch", "requests_aws4auth"]
+LOADED_MODULES = (
+    "import sys; import disco_aws_automation; "
+    "print(' '.join(sorted(name for name, module in sys.modules.items() if module is not None)))"
+)
+
+
+class DiscoImportTimeTests(TestCase):
+    '''Test what importing disco_aws_automation loads'''
+
+    def _loaded_modules(self):
+        """Returns the modules loaded by importing the package in a fresh interpreter"""
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return subprocess.check_output([sys.executable, "-c", LOADED_MODULES], cwd=root).split()
+
+    def test_import_is_lazy(self):
+        """Importing the package doesn't import the AWS and elasticsearch libraries"""
+        self.assertEqual(sorted(set(HEAVY_MODULES) & set(self._loaded_modules())), [])
+
+    def test_import_skips_disco_modules(self):
+        """Importing the package doesn't import the modules defining its classes"""
+        disco_modules = [name for name in self._loaded_modules()
+                         if name.startswith("disco_aws_automation.disco_")]
+        self.assertEqual(disco_modules, [])
@@ -11,6 +11,8 @@ class DiscoLogMetricsTests(TestCase):
     def setUp(self):
         self.log_metrics = DiscoLogMetrics('test-env')
         self.log_metrics.logs = MagicMock()
+        # Log groups are deleted from a thread pool, and MagicMock doesn't create children thread safely
+        self.log_metrics.logs.delete_log_group = MagicMock()
 
         config_mock = PropertyMock(return_value=get_mock_config({
             'mhcdummy.metric_name': {
@@ -89,6 +91,28 @@ class DiscoLogMetricsTests(TestCase):
 
         self.log_metrics.logs.delete_log_group.assert_has_calls(expected, any_order=True)
 
+    def test_delete_hostclasses_log_groups(self):
+        """Test delete log groups for several hostclasses"""
+        self.log_metrics.delete_hostclasses_log_groups(['mhcbanana', 'mhcother'])
+
+        self.log_metrics.logs.describe_log_groups.assert_called_once_with(logGroupNamePrefix='test-env/')
+        self.log_metrics.logs.delete_log_group.assert_called_once_with(
+            logGroupName='test-env/mhcbanana/warning_log')
+
+    def test_delete_hostclasses_log_groups_pages(self):
+        """Test delete log groups for several hostclasses reads all pages of log groups"""
+        self.log_metrics.logs.describe_log_groups.side_effect = [
+            {'logGroups': [{'logGroupName': 'test-env/mhcdummy/info_log'}], 'nextToken': 'token'},
+            {'logGroups': [{'logGroupName': 'test-env/mhcbanana/warning_log'}]}
+        ]
+        self.log_metrics.delete_hostclasses_log_groups(['mhcdummy', 'mhcbanana'])
+
+        self.log_metrics.logs.describe_log_groups.assert_called_with(
+            logGroupNamePrefix='test-env/', nextToken='token')
+        expected = [call(logGroupName='test-env/mhcdummy/info_log'),
+                    call(logGroupName='test-env/mhcbanana/warning_log')]
+        self.log_metrics.logs.delete_log_group.assert_has_calls(expected, any_order=True)
+
     def test_update(self):
         """Test deleting and creating metric filter from config"""
         self.log_metrics.update('mhcdummy')
@@ -58,7 +58,7 @@ class DiscoMetaNetworkTests(TestCase):
 
     def setUp(self):
         self.mock_vpc_conn = _get_vpc_conn_mock()
-        with patch('disco_aws_automation.disco_metanetwork.VPCConnection',
+        with patch('disco_aws_automation.disco_metanetwork.get_boto2_connection',
                    return_value=self.mock_vpc_conn):
             self.mock_vpc = _get_vpc_mock()
             self.meta_network = DiscoMetaNetwork(TEST_ENV_NAME, self.mock_vpc, network_cidr='10.101.0.0/16')
@@ -0,0 +1,86 @@
+"""
+Tests of rate_limiter
+"""
+from unittest import TestCase
+
+from boto.ec2.connection import EC2Connection
+from mock import MagicMock, patch
+
+from disco_aws_automation import rate_limiter
+from disco_aws_automation.rate_limiter import AdaptiveRateLimiter
+
+
+class DiscoRateLimiterTests(TestCase):
+    '''Test AdaptiveRateLimiter class'''
+
+    @patch("time.sleep")
+    def test_acquire_within_burst(self, mock_sleep):
+        """Calls within the burst size don't wait"""
+        limiter = AdaptiveRateLimiter("test", burst=3)
+        for _ in xrange(3):
+            limiter.acquire()
+        self.assertFalse(mock_sleep.called)
+
+    @patch("time.sleep")
+    def test_acquire_beyond_burst(self, mock_sleep):
+        """Calls beyond the burst size wait for a token"""
+        limiter = AdaptiveRateLimiter("test", max_rate=10.0, burst=1)
+        limiter.acquire()
+        with patch("time.time", return_value=limiter._last_refill):
+            mock_sleep.side_effect = lambda delay: setattr(limiter, "_tokens", 1)
+            limiter.acquire()
+        mock_sleep.assert_called_once_with(0.1)
+
+    def test_throttled_and_succeeded(self):
+        """Throttling halves the rate and successful calls restore it gradually"""
+        limiter = AdaptiveRateLimiter("test", max_rate=8.0, min_rate=1.0)
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 4.0)
+        for _ in xrange(5):
+            limiter.throttled()
+        self.assertEqual(limiter.rate, 1.0)
+        for _ in xrange(100):
+            limiter.succeeded()
+        self.assertEqual(limiter.rate, 8.0)
+
+    def test_get_rate_limiter_shared(self):
+        """Calls to the same service and region share a rate limiter"""
+        self.assertIs(rate_limiter.get_rate_limiter("ec2", "us-west-2"),
+                      rate_limiter.get_rate_limiter("ec2", "us-west-2"))
+        self.assertIsNot(rate_limiter.get_rate_limiter("ec2", "us-west-2"),
+                         rate_limiter.get_rate_limiter("ec2", "us-east-1"))
+
+    def test_get_rate_limiter_for_call(self):
+        """Boto3 client methods are mapped to the limiter of their service and region"""
+        class _Client(object):
+            meta = MagicMock(region_name="us-west-2")
+
+            def describe_things(self):
+                """Stands in for a boto3 client method"""
+                pass
+
+        _Client.meta.service_model.service_name = "ec2"
+        self.assertIs(rate_limiter.get_rate_limiter_for_call(_Client().describe_things),
+                      rate_limiter.get_rate_limiter("ec2", "us-west-2"))
+        self.assertIsNone(rate_limiter.get_rate_limiter_for_call(lambda: None))
+
+    def test_get_rate_limiter_for_boto2_call(self):
+        """Boto2 connection methods are mapped to the limiter of their host"""
+        connection = EC2Connection.__new__(EC2Connection)
+        connection.host = "ec2.us-west-2.amazonaws.com"
+        self.assertIs(rate_limiter.get_rate_limiter_for_call(connection.get_all_instances),
+                      rate_limiter.get_rate_limiter("ec2.us-west-2.amazonaws.com"))
+
+    def test_get_rate_limiter_for_call_host_property(self):
+        """The host property of objects that aren't boto2 connections is never read"""
+        class _Archiver(object):
+            @property
+            def host(self):
+                """Stands in for a host looked up from configuration"""
+                raise RuntimeError("host looked up")
+
+            def archive(self):
+                """Stands in for a method passed to throttled_call"""
+                pass
+
+        self.assertIsNone(rate_limiter.get_rate_limiter_for_call(_Archiver().archive))
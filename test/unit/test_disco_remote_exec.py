@@ -1,12 +1,21 @@
 """
 Tests of disco_remote_exec
 """
+import socket
+import time
 import unittest
 
-from mock import MagicMock, patch
+from mock import ANY, MagicMock, patch
 
 from disco_aws_automation import CommandError
-from disco_aws_automation.disco_remote_exec import DiscoRemoteExec
+from disco_aws_automation.disco_remote_exec import (
+    DiscoRemoteExec,
+    SSH_TIMEOUT_RETURN_CODE,
+    SshControlMasters,
+    first_ssh_reachable,
+    forget_ssh_reachability,
+    is_ssh_reachable
+)
 
 TEST_DEFAULT_SSH_OPTIONS = '-oConnectTimeout=10 -oBatchMode=yes -oStrictHostKeyChecking=no " \
                  "-oUserKnownHostsFile=/dev/null'
@@ -50,7 +59,8 @@ class DiscoRemoteExecTests(unittest.TestCase):
                                   user=TEST_USER,
                                   jump_address=TEST_JUMP_ADDRESS)
 
-        mock_get_exec_command.assert_called_once_with(TEST_ADDRESS, TEST_COMMAND, TEST_USER, None, (), None)
+        mock_get_exec_command.assert_called_once_with(TEST_ADDRESS, TEST_COMMAND, TEST_USER, None, (), None,
+                                                      control_path=ANY)
 
     # pylint: disable=unused-argument
     @patch('disco_aws_automation.disco_remote_exec.DiscoRemoteExec._is_reachable', return_value=False)
@@ -64,7 +74,7 @@ class DiscoRemoteExecTests(unittest.TestCase):
                                   jump_address=TEST_JUMP_ADDRESS)
 
         mock_get_exec_command.assert_called_once_with(TEST_ADDRESS, TEST_COMMAND, TEST_USER,
-                                                      TEST_JUMP_ADDRESS, (), None)
+                                                      TEST_JUMP_ADDRESS, (), None, control_path=ANY)
 
     def test_arguments_simple(self):
         """test getting ssh arguments with minimal options"""
@@ -146,3 +156,149 @@ class DiscoRemoteExecTests(unittest.TestCase):
                     TEST_COMMAND_STR]
 
         self.assertEquals(command, expected)
+
+    def test_arguments_multiplexed(self):
+        """test getting ssh arguments when sharing a master connection"""
+        command = DiscoRemoteExec._get_remote_exec_command(address=TEST_ADDRESS,
+                                                           remote_command=TEST_COMMAND,
+                                                           user=TEST_USER,
+                                                           jump_address=None,
+                                                           ssh_options=[],
+                                                           forward_agent=False,
+                                                           control_path='/tmp/control')
+        expected = ['ssh',
+                    '-oConnectTimeout=10',
+                    '-oBatchMode=yes',
+                    '-oStrictHostKeyChecking=no',
+                    '-oUserKnownHostsFile=/dev/null',
+                    '-oControlMaster=auto',
+                    '-oControlPath=/tmp/control',
+                    '-oControlPersist=300',
+                    '-l%s' % TEST_USER,
+                    TEST_ADDRESS,
+                    TEST_COMMAND_STR]
+
+        self.assertEquals(command, expected)
+
+    def test_arguments_multiplexed_with_jump_address(self):
+        """test that a multiplexed connection shares the connection to the jump box"""
+        command = DiscoRemoteExec._get_remote_exec_command(address=TEST_ADDRESS,
+                                                           remote_command=TEST_COMMAND,
+                                                           user=TEST_USER,
+                                                           jump_address=TEST_JUMP_ADDRESS,
+                                                           ssh_options=[],
+                                                           forward_agent=False,
+                                                           control_path='/tmp/control')
+        expected = ['ssh',
+                    '-A',
+                    '-t',
+                    '%s@%s' % (TEST_USER, TEST_JUMP_ADDRESS),
+                    '-oConnectTimeout=10',
+                    '-oBatchMode=yes',
+                    '-oStrictHostKeyChecking=no',
+                    '-oUserKnownHostsFile=/dev/null',
+                    '-oControlMaster=auto',
+                    '-oControlPath=/tmp/control',
+                    '-oControlPersist=300',
+                    TEST_PROXY_HOP]
+
+        self.assertEquals(command, expected)
+
+    def test_control_paths(self):
+        """test that there is one master connection per user and address"""
+        masters = SshControlMasters()
+        try:
+            path = masters.control_path(TEST_USER, TEST_ADDRESS)
+            self.assertEquals(path, masters.control_path(TEST_USER, TEST_ADDRESS))
+            self.assertNotEquals(path, masters.control_path(TEST_USER, TEST_JUMP_ADDRESS))
+            self.assertNotEquals(path, masters.control_path("root", TEST_ADDRESS))
+        finally:
+            masters.close_all()
+
+    def test_control_paths_disabled(self):
+        """test that no master connection is used when multiplexing is disabled"""
+        self.assertIsNone(SshControlMasters(enabled=False).control_path(TEST_USER, TEST_ADDRESS))
+
+
+def _connect_only_to(*addresses):
+    """Returns a create_connection replacement that only accepts connections to the given addresses"""
+    def _create_connection(address, timeout):
+        if address[0] not in addresses:
+            raise socket.timeout()
+        return MagicMock()
+    return _create_connection
+
+
+class DiscoSshReachabilityTests(unittest.TestCase):
+    """Tests of ssh reachability probes"""
+
+    def setUp(self):
+        forget_ssh_reachability()
+
+    def tearDown(self):
+        forget_ssh_reachability()
+
+    @patch('socket.create_connection')
+    def test_probe_results_remembered(self, mock_connect):
+        """test that both reachable and unreachable addresses are only probed once"""
+        mock_connect.side_effect = _connect_only_to(TEST_ADDRESS)
+        self.assertTrue(is_ssh_reachable(TEST_ADDRESS))
+        self.assertTrue(is_ssh_reachable(TEST_ADDRESS))
+        self.assertFalse(is_ssh_reachable(TEST_JUMP_ADDRESS))
+        self.assertFalse(is_ssh_reachable(TEST_JUMP_ADDRESS))
+        self.assertEquals(mock_connect.call_count, 2)
+
+        forget_ssh_reachability(TEST_JUMP_ADDRESS)
+        self.assertFalse(is_ssh_reachable(TEST_JUMP_ADDRESS))
+        self.assertEquals(mock_connect.call_count, 3)
+
+    @patch('socket.create_connection')
+    def test_first_reachable(self, mock_connect):
+        """test that the reachable address wins and unreachable or missing addresses are skipped"""
+        mock_connect.side_effect = _connect_only_to(TEST_ADDRESS)
+        self.assertEquals(first_ssh_reachable([None, TEST_JUMP_ADDRESS, TEST_ADDRESS]), TEST_ADDRESS)
+
+        mock_connect.reset_mock()
+        self.assertEquals(first_ssh_reachable([TEST_JUMP_ADDRESS, TEST_ADDRESS]), TEST_ADDRESS)
+        self.assertFalse(mock_connect.called)
+
+    @patch('socket.create_connection')
+    def test_first_reachable_in_order(self, mock_connect):
+        """test that an earlier reachable address wins even if a later one answers first"""
+        connect = _connect_only_to(TEST_JUMP_ADDRESS, TEST_ADDRESS)
+
+        def _slow_connect(address, timeout):
+            if address[0] == TEST_JUMP_ADDRESS:
+                time.sleep(0.1)
+            return connect(address, timeout)
+        mock_connect.side_effect = _slow_connect
+        self.assertEquals(first_ssh_reachable([TEST_JUMP_ADDRESS, TEST_ADDRESS]), TEST_JUMP_ADDRESS)
+
+    @patch('socket.create_connection')
+    def test_first_reachable_none(self, mock_connect):
+        """test that None is returned when no address is reachable"""
+        mock_connect.side_effect = _connect_only_to()
+        self.assertIsNone(first_ssh_reachable([TEST_JUMP_ADDRESS, TEST_ADDRESS]))
+        self.assertIsNone(first_ssh_reachable([]))
+        self.assertEquals(mock_connect.call_count, 2)
+
+
+class DiscoRemoteExecOutputTests(unittest.TestCase):
+    """Tests of running commands with streamed output and timeouts"""
+
+    def test_streamed_output(self):
+        """test that each line of output is handed over and the whole output returned"""
+        lines = []
+        result = DiscoRemoteExec._run_streaming(["sh", "-c", "cat; echo two; exit 3"], "one\n",
+                                                lines.append, None)
+        self.assertEquals(result, (3, "one\ntwo\n"))
+        self.assertEquals(lines, ["one\n", "two\n"])
+
+    def test_timeout(self):
+        """test that commands are killed once they time out"""
+        self.assertEquals(DiscoRemoteExec._run_buffered(["sh", "-c", "echo one; exec sleep 10"], None, 0.2),
+                          (SSH_TIMEOUT_RETURN_CODE, "one\n"))
+        self.assertEquals(DiscoRemoteExec._run_streaming(["sh", "-c", "echo one; exec sleep 10"], None,
+                                                         lambda line: None, 0.2),
+                          (SSH_TIMEOUT_RETURN_CODE, "one\n"))
+        self.assertEquals(DiscoRemoteExec._run_buffered(["cat"], "one", 5), (0, "one"))
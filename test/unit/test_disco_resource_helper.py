@@ -3,6 +3,8 @@ Tests of disco_aws
 """
 from unittest import TestCase
 
+from mock import MagicMock, patch
+
 from disco_aws_automation import resource_helper
 from disco_aws_automation import exceptions
 
@@ -18,3 +20,58 @@ class DiscoResourceHelperTests(TestCase):
     def test_check_written_s3_1(self):
         """Check raise exception when length does match"""
         resource_helper.check_written_s3("test", 1024, 1024)
+
+    def _get_volume_connection(self, states):
+        """Returns a mock boto2 connection whose volumes go through the given states on each describe"""
+        connection = MagicMock()
+        rounds = iter(states)
+
+        def _get_all_volumes(filters):
+            return [MagicMock(id=volume_id, status=status)
+                    for volume_id, status in next(rounds).items()
+                    if volume_id in filters["volume-id"]]
+
+        connection.get_all_volumes.side_effect = _get_all_volumes
+        return connection
+
+    @patch("time.sleep")
+    def test_batch_waiter_wait(self, mock_sleep):
+        """BatchWaiter polls all pending resources with one describe call per round"""
+        connection = self._get_volume_connection([
+            {"vol-1": "creating"},
+            {"vol-1": "available", "vol-2": "creating"},
+            {"vol-2": "available"}])
+
+        settled = resource_helper.BatchWaiter(connection, "volume").wait(["vol-1", "vol-2"], "available")
+
+        self.assertEqual(sorted(settled.keys()), ["vol-1", "vol-2"])
+        self.assertEqual(connection.get_all_volumes.call_count, 3)
+        self.assertEqual(connection.get_all_volumes.call_args[1], {"filters": {"volume-id": ["vol-2"]}})
+
+    @patch("time.sleep")
+    def test_batch_waiter_failure(self, mock_sleep):
+        """BatchWaiter raises ExpectedTimeoutError when a resource fails"""
+        connection = self._get_volume_connection([{"vol-1": "available", "vol-2": "error"}])
+        waiter = resource_helper.BatchWaiter(connection, "volume")
+
+        self.assertRaises(exceptions.ExpectedTimeoutError, waiter.wait, ["vol-1", "vol-2"], "available")
+
+    @patch("time.sleep")
+    def test_batch_waiter_timeout(self, mock_sleep):
+        """BatchWaiter raises TimeoutError when resources don't settle in time"""
+        connection = self._get_volume_connection([{"vol-1": "creating"}])
+        waiter = resource_helper.BatchWaiter(connection, "volume", timeout=0)
+
+        self.assertRaises(exceptions.TimeoutError, waiter.wait, ["vol-1"], "available")
+
+    @patch("time.sleep")
+    def test_batch_waiter_missing_ok(self, mock_sleep):
+        """BatchWaiter considers missing resources settled when missing_ok is set"""
+        connection = MagicMock()
+        connection.describe_nat_gateways.return_value = {
+            "NatGateways": [{"NatGatewayId": "nat-1", "State": "deleted"}]}
+
+        settled = resource_helper.BatchWaiter(connection, "nat_gateway").wait(
+            ["nat-1", "nat-2"], "deleted", missing_ok=True)
+
+        self.assertEqual(settled, {"nat-1": {"NatGatewayId": "nat-1", "State": "deleted"}, "nat-2": None})
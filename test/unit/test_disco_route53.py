@@ -5,6 +5,7 @@ from boto.route53.record import Record
 from moto import mock_route53, mock_sns
 
 from disco_aws_automation import DiscoRoute53
+from disco_aws_automation.client_registry import clear_clients
 
 TEST_DOMAIN = 'example.com.'
 TEST_DOMAIN2 = 'foo.com.'
@@ -40,6 +41,9 @@ def _create_mock_zone_and_records(route53):
 class DiscoRoute53Tests(TestCase):
     """Test DiscoRoute53"""
 
+    def setUp(self):
+        clear_clients()
+
     @mock_sns
     @mock_route53
     def test_list_zones(self):
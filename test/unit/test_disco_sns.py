@@ -3,6 +3,7 @@ from unittest import TestCase
 from moto import mock_sns
 import boto
 from disco_aws_automation import DiscoSNS
+from disco_aws_automation.client_registry import clear_clients
 
 
 ACCOUNT_ID = "123456789012"  # mock_sns uses account id 123456789012
@@ -14,6 +15,9 @@ SUBSCRIPTION_URL = "https://example.com/fake_api_endpoint"
 class DiscoSNSTests(TestCase):
     """Test DiscoSNS class"""
 
+    def setUp(self):
+        clear_clients()
+
     @mock_sns
     def get_region(self):
         """Return SNS region of SNS Mock"""
@@ -10,12 +10,14 @@ from mock import MagicMock
 from moto import mock_ec2
 
 from disco_aws_automation import DiscoStorage
+from disco_aws_automation.client_registry import clear_clients
 
 
 class DiscoStorageTests(TestCase):
     """Test DiscoStorage class"""
 
     def setUp(self):
+        clear_clients()
         self.storage = DiscoStorage(environment_name='unittestenv')
 
     def _create_snapshot(self, hostclass, env):